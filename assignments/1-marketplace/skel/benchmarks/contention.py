@@ -0,0 +1,79 @@
+"""
+This module measures the Marketplace's throughput when many threads add and remove products at the
+same time, for a different number of shards.
+
+Usage: python3 -m benchmarks.contention [operations per thread]
+
+Computer Systems Architecture Course
+Assignment 1
+March 2021
+"""
+import logging
+import sys
+import time
+from threading import Barrier, Thread
+
+from tema.marketplace import Marketplace
+from tema.product import Tea
+
+THREAD_COUNTS = [1, 2, 4, 8, 16, 32, 64, 200]
+SHARD_COUNTS = [1, 16]
+NUM_PRODUCTS = 64
+DEFAULT_OPERATIONS = 2000
+
+
+def worker(marketplace, product, operations, barrier):
+    """
+    Publishes a unit of the product, then moves it in and out of a cart.
+    """
+    producer_id = marketplace.register_producer()
+    cart_id = marketplace.new_cart()
+    marketplace.publish(producer_id, product)
+
+    barrier.wait()
+    for _ in range(operations // 2):
+        marketplace.add_to_cart(cart_id, product, block=True)
+        marketplace.remove_from_cart(cart_id, product)
+
+
+def measure(num_threads, num_shards, operations):
+    """
+    Runs the workers on a Marketplace with the given number of shards.
+    :returns the number of operations per second
+    """
+    marketplace = Marketplace(1, num_shards=num_shards)
+    products = [Tea(f'Tea {i}', i, 'Herbal') for i in range(NUM_PRODUCTS)]
+
+    # The main thread waits for every worker to be ready as well, then starts the clock
+    barrier = Barrier(num_threads + 1)
+    threads = [Thread(target=worker,
+                      args=(marketplace, products[i % NUM_PRODUCTS], operations, barrier))
+               for i in range(num_threads)]
+    for thread in threads:
+        thread.start()
+
+    barrier.wait()
+    start = time.perf_counter()
+    for thread in threads:
+        thread.join()
+
+    return num_threads * (operations // 2 * 2) / (time.perf_counter() - start)
+
+
+def main():
+    """
+    Runs the measurement for every number of threads and shards and prints a table.
+    """
+    operations = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_OPERATIONS
+
+    logging.disable(logging.CRITICAL)
+
+    print(f"{'threads':>8}" + "".join(f"{f'{shards} shard(s) op/s':>20}"
+                                      for shards in SHARD_COUNTS))
+    for num_threads in THREAD_COUNTS:
+        print(f"{num_threads:>8}" + "".join(f"{measure(num_threads, shards, operations):>20.0f}"
+                                            for shards in SHARD_COUNTS))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+"""
+This module compares the order throughput of the marketplace when the carts keep their reserved
+units until their order is placed, the default, and when the reservations expire after a time to
+live, giving the units held by slow carts to the carts waiting for them. The tests run on a
+virtual clock, the throughput is the number of orders per simulated second.
+
+Usage: python3 -m benchmarks.expiry [--ttl SECONDS ...] [test ...]
+
+Computer Systems Architecture Course
+Assignment 1
+March 2021
+"""
+import argparse
+import glob
+import logging
+import os
+
+from benchmarks.suite import DEFAULT_TIME_LIMIT, TESTS_DIR, run_scenario
+from tema.marketplace import Marketplace
+from tema.scenario import load_market_config
+
+DEFAULT_TTLS = [0.5, 2.0]
+
+
+def main():
+    """
+    Runs every test without a time to live and with each of the given ones and prints the orders
+    per simulated second.
+    """
+    parser = argparse.ArgumentParser(description="Compare the order throughput with and without "
+                                                 "reservation expiry")
+    parser.add_argument("tests", nargs='*', metavar="test",
+                        help=f"tests to run, by name or input file, default all in {TESTS_DIR}/")
+    parser.add_argument("--ttl", type=float, action="append", metavar="SECONDS",
+                        help=f"a reservation time to live to measure, default {DEFAULT_TTLS}")
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+
+    test_files = [test if test.endswith('.in') else os.path.join(TESTS_DIR, f'{test}.in')
+                  for test in args.tests] or sorted(glob.glob(os.path.join(TESTS_DIR, '*.in')))
+    modes = [('no expiry', None)] + [(f'ttl {ttl:g} s', {'reservation_ttl': ttl})
+                                     for ttl in args.ttl or DEFAULT_TTLS]
+
+    print(f"{'test':>8}{'carts':>8}" + "".join(f"{f'{name} (orders/s)':>24}"
+                                              for name, _ in modes))
+    for test_file in test_files:
+        market_config = load_market_config(test_file)
+
+        cells = []
+        for _, options in modes:
+            result = run_scenario(Marketplace, market_config, True, DEFAULT_TIME_LIMIT,
+                                  engine_options=options)
+            carts = result['carts']
+            cells.append(f"{carts['per_s']:.2f}" + ("" if result['completed'] else " (stuck)"))
+
+        name = os.path.basename(test_file)[:-len('.in')]
+        print(f"{name:>8}{carts['count']:>8}" + "".join(f"{cell:>24}" for cell in cells))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+"""
+This module compares the time the carts take from their creation to their order when the
+consumers waiting for a product are served most recent first, the default, and in arrival order,
+the fair mode. The tests run on a virtual clock.
+
+Usage: python3 -m benchmarks.fairness [test ...]
+
+Computer Systems Architecture Course
+Assignment 1
+March 2021
+"""
+import glob
+import logging
+import os
+import sys
+
+from benchmarks.suite import DEFAULT_TIME_LIMIT, TESTS_DIR, run_scenario
+from tema.marketplace import Marketplace
+from tema.scenario import load_market_config
+
+MODES = (('most recent first', None), ('fair', {'fair': True}))
+
+
+def main():
+    """
+    Runs every test in both modes and prints the median and the 99th percentile of the carts'
+    completion times.
+    """
+    logging.disable(logging.CRITICAL)
+
+    test_files = [test if test.endswith('.in') else os.path.join(TESTS_DIR, f'{test}.in')
+                  for test in sys.argv[1:]] or sorted(glob.glob(os.path.join(TESTS_DIR, '*.in')))
+
+    print(f"{'test':>8}{'carts':>8}" + "".join(f"{f'{name} p50/p99 (s)':>32}"
+                                              for name, _ in MODES))
+    for test_file in test_files:
+        market_config = load_market_config(test_file)
+
+        cells = []
+        for _, options in MODES:
+            result = run_scenario(Marketplace, market_config, True, DEFAULT_TIME_LIMIT,
+                                  engine_options=options)
+            carts = result['carts']
+            cells.append(f"{carts['p50_s']:.2f}/{carts['p99_s']:.2f}" if carts['count'] else "-")
+
+        name = os.path.basename(test_file)[:-len('.in')]
+        print(f"{name:>8}{carts['count']:>8}" + "".join(f"{cell:>32}" for cell in cells))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+"""
+This module benchmarks the Marketplace's inventory against the original flat list of products.
+
+Usage: python3 -m benchmarks.inventory [units ...]
+
+Computer Systems Architecture Course
+Assignment 1
+March 2021
+"""
+import logging
+import sys
+import timeit
+
+from tema.marketplace import Marketplace
+from tema.product import Tea
+
+# Number of different products in the market, as many as the biggest generated test uses
+NUM_PRODUCTS = 10
+
+# Number of add/remove pairs timed for each inventory size
+NUM_OPERATIONS = 2000
+
+DEFAULT_UNITS = [100, 1000, 2000, 10000]
+
+
+class ListInventory:
+    """
+    The original inventory: one flat list holding every available unit.
+    """
+
+    def __init__(self):
+        """
+        Constructor
+        """
+        self.available_products = []
+
+    def publish(self, product):
+        """
+        Makes a unit of the product available.
+        """
+        self.available_products.append(product)
+
+    def add_to_cart(self, product):
+        """
+        Reserves a unit of the product, scanning the whole list.
+        """
+        if product not in self.available_products:
+            return False
+
+        self.available_products.remove(product)
+        return True
+
+    def remove_from_cart(self, product):
+        """
+        Returns a unit of the product.
+        """
+        self.available_products.append(product)
+
+
+def build_products():
+    """
+    Builds the products in the market.
+    """
+    return [Tea(f'Tea {i}', i, 'Herbal') for i in range(NUM_PRODUCTS)]
+
+
+def bench_list(units, products):
+    """
+    Times add/remove pairs on a list inventory holding the given number of units.
+    :returns the mean time of an add/remove pair in microseconds
+    """
+    inventory = ListInventory()
+    for i in range(units):
+        inventory.publish(products[i % NUM_PRODUCTS])
+
+    # The last product is the worst case for the list scan
+    product = products[-1]
+
+    def operation():
+        inventory.add_to_cart(product)
+        inventory.remove_from_cart(product)
+
+    return timeit.timeit(operation, number=NUM_OPERATIONS) / NUM_OPERATIONS * 1e6
+
+
+def bench_marketplace(units, products):
+    """
+    Times add/remove pairs on a Marketplace holding the given number of units.
+    :returns the mean time of an add/remove pair in microseconds
+    """
+    marketplace = Marketplace(units)
+    producer_id = marketplace.register_producer()
+    cart_id = marketplace.new_cart()
+    for i in range(units):
+        marketplace.publish(producer_id, products[i % NUM_PRODUCTS])
+
+    product = products[-1]
+
+    def operation():
+        marketplace.add_to_cart(cart_id, product)
+        marketplace.remove_from_cart(cart_id, product)
+
+    return timeit.timeit(operation, number=NUM_OPERATIONS) / NUM_OPERATIONS * 1e6
+
+
+def main():
+    """
+    Runs the benchmark for every inventory size and prints a table with the results.
+    """
+    units_list = [int(arg) for arg in sys.argv[1:]] or DEFAULT_UNITS
+
+    # Only the inventory is measured, not the log file
+    logging.disable(logging.CRITICAL)
+
+    products = build_products()
+
+    print(f"{'units':>10} {'list (us/op)':>14} {'market (us/op)':>14} {'speedup':>10}")
+    for units in units_list:
+        list_time = bench_list(units, products)
+        marketplace_time = bench_marketplace(units, products)
+        print(f"{units:>10} {list_time:>14.2f} {marketplace_time:>14.2f} "
+              f"{list_time / marketplace_time:>9.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+"""
+This module measures the wall time of every test when the market runs on threads in one process
+and when it runs on a different number of processes, checking the orders against the reference
+output.
+
+Usage: python3 -m benchmarks.processes [tests directory]
+
+Computer Systems Architecture Course
+Assignment 1
+March 2021
+"""
+import glob
+import os
+import subprocess
+import sys
+import time
+
+PROCESS_COUNTS = [1, 2, 4]
+DEFAULT_TESTS_DIR = 'tests'
+
+
+def order_lines(output):
+    """
+    Returns the sorted lines of an output, the way check_test.py compares them.
+    """
+    return sorted(line.strip() + ")" for line in output.split(")") if line.strip())
+
+
+def measure(input_file, num_processes):
+    """
+    Runs test.py on a test, on threads if the number of processes is 0.
+    :returns the wall time in seconds and whether the orders match the reference output
+    """
+    command = [sys.executable, 'test.py', input_file]
+    if num_processes:
+        command += ['--processes', str(num_processes)]
+
+    start = time.perf_counter()
+    result = subprocess.run(command, capture_output=True, text=True, check=True)
+    wall_time = time.perf_counter() - start
+
+    with open(input_file.replace('.in', '.ref.out'), encoding='utf-8') as ref_file:
+        correct = order_lines(result.stdout) == order_lines(ref_file.read())
+
+    return wall_time, correct
+
+
+def main():
+    """
+    Runs every test on threads and on every number of processes and prints a table.
+    """
+    tests_dir = sys.argv[1] if len(sys.argv) > 1 else DEFAULT_TESTS_DIR
+    modes = [0] + PROCESS_COUNTS
+
+    print(f"{'test':>8}{'threads (s)':>16}" + "".join(f"{f'{count} process(es) (s)':>20}"
+                                                    for count in PROCESS_COUNTS))
+    for input_file in sorted(glob.glob(os.path.join(tests_dir, '*.in'))):
+        cells = []
+        for num_processes in modes:
+            wall_time, correct = measure(input_file, num_processes)
+            cells.append(f"{wall_time:.2f}" + ("" if correct else " WRONG"))
+
+        name = os.path.basename(input_file)[:-len('.in')]
+        print(f"{name:>8}{cells[0]:>16}" + "".join(f"{cell:>20}" for cell in cells[1:]))
+
+
+if __name__ == '__main__':
+    main()
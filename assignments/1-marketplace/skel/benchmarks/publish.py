@@ -0,0 +1,79 @@
+"""
+This module measures how long a producer with a full queue takes to publish again after one of
+his products is bought, when polling the marketplace and when blocking in it.
+
+Usage: python3 -m benchmarks.publish [republish_wait_time] [orders]
+
+Computer Systems Architecture Course
+Assignment 1
+March 2021
+"""
+import io
+import logging
+import random
+import statistics
+import sys
+import time
+from contextlib import redirect_stdout
+
+from tema.marketplace import Marketplace
+from tema.producer import Producer
+from tema.product import Tea
+
+DEFAULT_REPUBLISH_WAIT_TIME = 0.1
+DEFAULT_ORDERS = 50
+
+
+def measure(blocking, republish_wait_time, orders):
+    """
+    Buys the only product of a producer with a queue of size 1, over and over again, and measures
+    the time between placing each order and the next unit being published.
+    :returns a list with the measured times in milliseconds
+    """
+    random.seed(0)
+    product = Tea('Linden', 9, 'Herbal')
+
+    marketplace = Marketplace(1)
+    producer = Producer([(product, 1, 0)], marketplace, republish_wait_time, blocking=blocking,
+                        daemon=True)
+    producer.start()
+
+    cart_id = marketplace.new_cart()
+    marketplace.add_to_cart(cart_id, product, block=True)
+
+    latencies = []
+    for _ in range(orders):
+        # Place the order at a random moment of the producer's retry period, like a consumer that
+        # spends some time filling his cart would
+        time.sleep(random.uniform(0, republish_wait_time))
+
+        start = time.perf_counter()
+        marketplace.place_order(cart_id)
+        cart_id = marketplace.new_cart()
+        marketplace.add_to_cart(cart_id, product, block=True)
+        latencies.append((time.perf_counter() - start) * 1000)
+
+    return latencies
+
+
+def main():
+    """
+    Runs the measurement for both producer modes and prints the results.
+    """
+    republish_wait_time = float(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_REPUBLISH_WAIT_TIME
+    orders = int(sys.argv[2]) if len(sys.argv) > 2 else DEFAULT_ORDERS
+
+    logging.disable(logging.CRITICAL)
+
+    print(f"republish_wait_time = {republish_wait_time}s, {orders} orders")
+    print(f"{'mode':>10} {'mean (ms)':>10} {'p50 (ms)':>10} {'max (ms)':>10}")
+    for blocking in (False, True):
+        # The orders' output is not part of the measurement
+        with redirect_stdout(io.StringIO()):
+            latencies = measure(blocking, republish_wait_time, orders)
+        print(f"{'blocking' if blocking else 'polling':>10} {statistics.mean(latencies):>10.3f} "
+              f"{statistics.median(latencies):>10.3f} {max(latencies):>10.3f}")
+
+
+if __name__ == '__main__':
+    main()
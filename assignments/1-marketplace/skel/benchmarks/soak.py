@@ -0,0 +1,133 @@
+"""
+This module checks that a long-running marketplace doesn't grow with the number of carts it served:
+consumers fill, order and abandon carts over and over while the memory the marketplace holds is
+measured at regular intervals.
+
+Usage: python3 -m benchmarks.soak [--carts N] [--consumers N] [--checkpoints N]
+                                  [--max-growth BYTES]
+
+Computer Systems Architecture Course
+Assignment 1
+March 2021
+"""
+import argparse
+import logging
+import sys
+import time
+import tracemalloc
+from threading import Event, Thread
+
+from tema.marketplace import Marketplace
+from tema.order_sink import DiscardingOrderSink
+from tema.product import Tea
+
+DEFAULT_CARTS = 1000000
+DEFAULT_CONSUMERS = 4
+DEFAULT_CHECKPOINTS = 10
+
+# The most the traced memory may grow by between the first and the last checkpoint, in bytes
+DEFAULT_MAX_GROWTH = 256 * 1024
+
+# Every this many carts is abandoned instead of ordered
+ABANDON_EVERY = 10
+
+# The only product, so no producer's queue fills up with products no one wants
+PRODUCT = Tea('Soak Tea', 1, 'Herbal')
+
+
+def produce(marketplace, producer_id, stopped):
+    """
+    Publishes the product until stopped.
+    """
+    while not stopped.is_set():
+        marketplace.publish(producer_id, PRODUCT, block=True, timeout=0.1)
+
+
+def serve_carts(marketplace, num_carts):
+    """
+    Fills the given number of carts with two units, removes one, then orders or abandons them.
+    """
+    for index in range(num_carts):
+        cart_id = marketplace.new_cart()
+        marketplace.add_many_to_cart(cart_id, PRODUCT, 2, block=True)
+        marketplace.remove_from_cart(cart_id, PRODUCT)
+
+        if index % ABANDON_EVERY == 0:
+            marketplace.abandon_cart(cart_id)
+        else:
+            marketplace.place_order(cart_id)
+
+
+def soak(num_carts, num_consumers, num_checkpoints):
+    """
+    Serves the carts in rounds, measuring the traced memory after each one.
+    :returns a list of (carts served, traced bytes, open carts) tuples
+    """
+    marketplace = Marketplace(4, log_level=logging.WARNING, order_sink=DiscardingOrderSink())
+
+    stopped = Event()
+    producers = [Thread(target=produce, args=(marketplace, marketplace.register_producer(),
+                                              stopped))
+                 for _ in range(num_consumers)]
+    for producer in producers:
+        producer.start()
+
+    tracemalloc.start()
+    checkpoints = []
+    per_consumer = num_carts // num_checkpoints // num_consumers
+
+    for checkpoint in range(1, num_checkpoints + 1):
+        consumers = [Thread(target=serve_carts, args=(marketplace, per_consumer))
+                     for _ in range(num_consumers)]
+        for consumer in consumers:
+            consumer.start()
+        for consumer in consumers:
+            consumer.join()
+
+        checkpoints.append((checkpoint * per_consumer * num_consumers,
+                            tracemalloc.get_traced_memory()[0], len(marketplace.carts)))
+
+    tracemalloc.stop()
+
+    stopped.set()
+    for producer in producers:
+        producer.join()
+
+    return checkpoints
+
+
+def main():
+    """
+    Runs the soak test and prints the memory at every checkpoint. Fails if the memory grew.
+    """
+    parser = argparse.ArgumentParser(description="Check that the memory of a marketplace stays "
+                                                 "flat over many carts")
+    parser.add_argument("--carts", type=int, default=DEFAULT_CARTS, help="number of carts served")
+    parser.add_argument("--consumers", type=int, default=DEFAULT_CONSUMERS,
+                        help="number of consumer threads")
+    parser.add_argument("--checkpoints", type=int, default=DEFAULT_CHECKPOINTS,
+                        help="number of memory measurements")
+    parser.add_argument("--max-growth", type=int, default=DEFAULT_MAX_GROWTH,
+                        help="bytes the memory may grow by after the first checkpoint")
+    args = parser.parse_args()
+
+    # The orders aren't written, make sure the log isn't either
+    logging.disable(logging.CRITICAL)
+
+    start = time.perf_counter()
+    checkpoints = soak(args.carts, args.consumers, args.checkpoints)
+
+    print(f"{'carts':>12}{'traced (KiB)':>16}{'open carts':>12}")
+    for served, traced, open_carts in checkpoints:
+        print(f"{served:>12}{traced / 1024:>16.1f}{open_carts:>12}")
+
+    growth = checkpoints[-1][1] - checkpoints[0][1]
+    print(f"growth after the first checkpoint: {growth / 1024:.1f} KiB, "
+          f"{time.perf_counter() - start:.1f} s", file=sys.stderr)
+
+    if growth > args.max_growth:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,387 @@
+"""
+This module measures the throughput and the latency of a marketplace engine and prints the results
+as JSON.
+
+The scenarios are the tests in tests/ and, when its shape is given with the options, one generated
+with test-gen/test_generator.py. They run with the Producer and Consumer threads, on a virtual
+clock by default so the production times don't hide the engine's cost. The generator doesn't make
+sure its producers' queues don't fill up with products no one buys, so a generated scenario may
+deadlock; it is then reported as not completed.
+
+Usage: python3 -m benchmarks.suite [test ...] [--producers N] [--consumers N] [--products N]
+                                   [--queue-size N] [--carts N] [--large-carts] [--no-removal]
+                                   [--engine module.Class] [--on-demand] [--fair] [--real-time]
+                                   [--time-limit SECONDS] [--seed N] [--output FILE]
+
+Computer Systems Architecture Course
+Assignment 1
+March 2021
+"""
+import argparse
+import glob
+import importlib
+import io
+import json
+import logging
+import os
+import random
+import sys
+import time
+from collections import defaultdict
+
+from tema.clock import REAL_CLOCK, VirtualClock
+from tema.consumer import Consumer
+from tema.order_sink import OrderSink
+from tema.producer import Producer
+from tema.scenario import build_market_config, load_market_config
+
+# The test generator isn't a package, it imports its helpers from its own directory
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                             'test-gen'))
+# pylint: disable=import-error, wrong-import-position, wrong-import-order
+import test_generator
+from test_utils import (ARG_CHUNK_SIZE, ARG_CONSUMERS, ARG_IS_BASIC, ARG_JOBS, ARG_MAX_CARTS,
+                        ARG_MIN_CARTS, ARG_SEED, ARG_SUPPORTS_REMOVAL, DEFAULT_CHUNK_SIZE,
+                        DEFAULT_JOBS)
+# pylint: enable=import-error, wrong-import-position, wrong-import-order
+
+DEFAULT_ENGINE = 'tema.marketplace.Marketplace'
+
+# The operations whose latency is measured
+TIMED_OPERATIONS = ('register_producer', 'publish', 'publish_many', 'new_cart', 'add_to_cart',
+                    'add_many_to_cart', 'remove_from_cart', 'remove_many_from_cart',
+                    'place_order')
+
+TESTS_DIR = 'tests'
+
+# The longest a scenario may run for in seconds, in real time
+DEFAULT_TIME_LIMIT = 120
+
+# The parameters of a generated scenario, as taken by test_generator.py
+PARAMETERS = ('producers', 'consumers', 'products', 'queue_size', 'min_carts', 'max_carts',
+              'large_carts', 'removals')
+
+
+class TimedMarketplace:
+    """
+    Class that represents a marketplace engine whose operations are timed, along with the time
+    each cart takes from its creation to its order.
+    """
+
+    def __init__(self, marketplace, clock):
+        """
+        Constructor
+        :type marketplace: Marketplace
+        :param marketplace: the timed engine
+        :type clock: RealClock
+        :param clock: the clock the carts are timed with, the engine's one
+        """
+        self.marketplace = marketplace
+        self.clock = clock
+
+        # The latencies of each operation in seconds (operation -> list)
+        self.latencies = defaultdict(list)
+
+        # The creation time of the carts not ordered yet (cart id -> time) and the completion
+        # time of the ordered ones
+        self.cart_starts = {}
+        self.cart_times = []
+
+        # When the engine started and when it placed its last order, for its orders per second
+        self.started = self.last_order = clock.time()
+        self.timed_new_cart = self.timed('new_cart')
+        self.timed_place_order = self.timed('place_order')
+
+    def __getattr__(self, name):
+        """
+        Returns the engine's attribute, timing it if it's one of the measured operations. The
+        timed method is cached, so this is only called once for each of them.
+        """
+        if name not in TIMED_OPERATIONS:
+            return getattr(self.marketplace, name)
+
+        timed = self.timed(name)
+        setattr(self, name, timed)
+        return timed
+
+    def timed(self, name):
+        """
+        Returns the engine's method with the given name, recording its latencies.
+        """
+        method = getattr(self.marketplace, name)
+        latencies = self.latencies[name]
+
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                latencies.append(time.perf_counter() - start)
+
+        return timed
+
+    def new_cart(self):
+        """
+        Creates a cart, starting its completion time.
+        """
+        cart_id = self.timed_new_cart()
+        self.cart_starts[cart_id] = self.clock.time()
+
+        return cart_id
+
+    def place_order(self, cart_id):
+        """
+        Places the order of a cart, recording its completion time.
+        """
+        order = self.timed_place_order(cart_id)
+        self.last_order = self.clock.time()
+        self.cart_times.append(self.last_order - self.cart_starts.pop(cart_id))
+
+        return order
+
+
+def generate_scenario(parameters, seed):
+    """
+    Generates a market configuration like test_generator.py does.
+    :type parameters: Dict
+    :param parameters: the scenario's parameters, named as in PARAMETERS
+    :type seed: Int
+    :param seed: the seed of the random generator
+    :returns the configuration, with products instead of product ids
+    """
+    random.seed(seed)
+
+    products = test_generator.generate_products(parameters['products'])
+    producers = test_generator.generate_producers(parameters['producers'], products,
+                                                  not parameters['large_carts'])
+
+    # Consumers only ask for products someone produces
+    products = {product_id: product for product_id, product in products.items()
+                if product.pop('is_produced')}
+
+    arguments = {
+        ARG_SEED: seed, ARG_CONSUMERS: parameters['consumers'],
+        ARG_MIN_CARTS: parameters['min_carts'], ARG_MAX_CARTS: parameters['max_carts'],
+        ARG_SUPPORTS_REMOVAL: parameters['removals'], ARG_IS_BASIC: not parameters['large_carts'],
+        ARG_JOBS: DEFAULT_JOBS, ARG_CHUNK_SIZE: DEFAULT_CHUNK_SIZE}
+
+    # The reference output isn't needed, the orders aren't checked
+    input_file = io.StringIO()
+    test_generator.generate_stream_test(
+        arguments, products, producers,
+        test_generator.generate_marketplace(parameters['queue_size']),
+        input_file=input_file, output_file=io.StringIO())
+
+    return build_market_config(json.loads(input_file.getvalue()))
+
+
+def percentile(values, fraction):
+    """
+    Returns the value below which the given fraction of the sorted values are.
+    """
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def wait_for_consumers(consumers, clock, time_limit):
+    """
+    Waits until every consumer is done, the market is deadlocked or the time limit is reached.
+    :returns True if every consumer is done
+    """
+    deadline = time.monotonic() + time_limit
+
+    for consumer in consumers:
+        while consumer.is_alive():
+            # A virtual clock knows when the market is deadlocked
+            if time.monotonic() > deadline or isinstance(clock, VirtualClock) and clock.stalled():
+                return False
+
+            consumer.join(0.05)
+
+    return True
+
+
+def run_scenario(engine, market_config, virtual_time, time_limit, *, on_demand=False,
+                 engine_options=None):
+    """
+    Runs a scenario on a new instance of the engine until every consumer is done.
+    :type engine_options: Dict
+    :param engine_options: other keyword arguments the engine is built with
+    :returns a dict with the scenario's results
+    """
+    clock = VirtualClock() if virtual_time else REAL_CLOCK
+
+    # The orders' output is not part of the measurement
+    marketplace = TimedMarketplace(engine(**market_config['marketplace'], **engine_options or {},
+                                          order_sink=OrderSink(io.StringIO()), clock=clock),
+                                   clock)
+
+    # The consumers are left behind if the scenario doesn't complete
+    producers = [Producer(**config, marketplace=marketplace, on_demand=on_demand, clock=clock,
+                          daemon=True)
+                 for config in market_config['producers']]
+    consumers = [Consumer(**config, marketplace=marketplace, clock=clock, daemon=True)
+                 for config in market_config['consumers']]
+
+    start = time.perf_counter()
+    for thread in producers + consumers:
+        thread.start()
+
+    completed = wait_for_consumers(consumers, clock, time_limit)
+    wall_time = time.perf_counter() - start
+
+    # The producers end once the marketplace stops
+    marketplace.stop()
+    if completed:
+        for producer in producers:
+            producer.join()
+
+    latencies = {name: sorted(values) for name, values in list(marketplace.latencies.items())
+                 if values}
+    operations = sum(len(values) for values in latencies.values())
+
+    # The carts' completion times and the units left unsold, if the engine counts them
+    cart_times = sorted(marketplace.cart_times)
+    run_time = marketplace.last_order - marketplace.started
+    carts = {'count': len(cart_times),
+             'per_s': round(len(cart_times) / run_time, 3) if run_time else None}
+    if cart_times:
+        carts.update(p50_s=round(percentile(cart_times, 0.5), 6),
+                     p99_s=round(percentile(cart_times, 0.99), 6),
+                     max_s=round(cart_times[-1], 6))
+    if hasattr(marketplace.marketplace, 'stats'):
+        carts['unsold_units'] = sum(marketplace.stats()['queue_occupancy'].values())
+
+    return {
+        'producers': len(producers),
+        'consumers': len(consumers),
+        'queue_size_per_producer': market_config['marketplace']['queue_size_per_producer'],
+        'completed': completed,
+        'wall_time_s': round(wall_time, 6),
+        'simulated_time_s': round(clock.time(), 6) if virtual_time else None,
+        'operations': operations,
+        'ops_per_s': round(operations / wall_time, 1),
+        'latency_us': {name: {'count': len(values),
+                              'p50': round(percentile(values, 0.5) * 1e6, 1),
+                              'p99': round(percentile(values, 0.99) * 1e6, 1)}
+                       for name, values in sorted(latencies.items())},
+        'carts': carts,
+    }
+
+
+def load_engine(path):
+    """
+    Returns the marketplace class with the given dotted path. It is built with the queue size per
+    producer and the order_sink and clock keyword arguments.
+    """
+    module_name, class_name = path.rsplit('.', 1)
+    return getattr(importlib.import_module(module_name), class_name)
+
+
+def parse_arguments():
+    """
+    Parses the command line arguments.
+    """
+    parser = argparse.ArgumentParser(description="Benchmark a marketplace engine")
+    parser.add_argument("tests", nargs='*', metavar="test",
+                        help=f"tests to run, by name or input file, default all in {TESTS_DIR}/")
+    parser.add_argument("--producers", type=int, help="number of generated producers")
+    parser.add_argument("--consumers", type=int, help="number of generated consumers")
+    parser.add_argument("--products", type=int, help="number of generated products")
+    parser.add_argument("--queue-size", type=int, help="generated queue size per producer")
+    parser.add_argument("--carts", type=int, help="maximum number of generated carts per consumer")
+    parser.add_argument("--large-carts", action="store_true",
+                        help="up to 10 operations of up to 10 units in each generated cart")
+    parser.add_argument("--no-removal", action="store_true",
+                        help="generated carts without remove operations")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the scenario generator")
+    parser.add_argument("--engine", default=DEFAULT_ENGINE,
+                        help="dotted path of the marketplace class to measure")
+    parser.add_argument("--on-demand", action="store_true",
+                        help="only produce the products the waiting consumers need")
+    parser.add_argument("--fair", action="store_true",
+                        help="serve the consumers waiting for a product in arrival order")
+    parser.add_argument("--reservation-ttl", type=float, metavar="SECONDS",
+                        help="give back the units a cart holds for longer than SECONDS")
+    parser.add_argument("--real-time", action="store_true",
+                        help="wait for the production times for real")
+    parser.add_argument("--time-limit", type=float, default=DEFAULT_TIME_LIMIT,
+                        help="the longest a scenario may run for, in seconds")
+    parser.add_argument("--output", help="file to write the JSON results to, default stdout")
+
+    return parser.parse_args()
+
+
+def generated_parameters(args):
+    """
+    Returns the parameters of the scenario to generate, starting from the generator's defaults,
+    or None if the options don't describe one.
+    """
+    options = {'producers': args.producers, 'consumers': args.consumers,
+               'products': args.products, 'queue_size': args.queue_size,
+               'max_carts': args.carts}
+    if all(value is None for value in options.values()) and not args.large_carts \
+            and not args.no_removal:
+        return None
+
+    parameters = dict(zip(PARAMETERS, (
+        test_generator.DEFAULT_NUM_PRODUCERS, test_generator.DEFAULT_NUM_CONSUMERS,
+        test_generator.DEFAULT_NUM_PRODUCTS, test_generator.DEFAULT_MARKETPLACE_QUEUE_SIZE,
+        test_generator.DEFAULT_MIN_NUMBER_CARTS_PER_CONSUMER,
+        test_generator.DEFAULT_MAX_NUMBER_CARTS_PER_CONSUMER, False, True)))
+    parameters.update({name: value for name, value in options.items() if value is not None})
+    parameters.update(min_carts=min(parameters['min_carts'], parameters['max_carts']),
+                      large_carts=args.large_carts, removals=not args.no_removal)
+
+    return parameters
+
+
+def main():
+    """
+    Runs the chosen scenarios and prints their results as JSON.
+    """
+    args = parse_arguments()
+    logging.disable(logging.CRITICAL)
+
+    # The tests are given by name or by input file
+    test_files = [test if test.endswith('.in') else os.path.join(TESTS_DIR, f'{test}.in')
+                  for test in args.tests]
+    parameters = generated_parameters(args)
+    if not test_files and parameters is None:
+        test_files = sorted(glob.glob(os.path.join(TESTS_DIR, '*.in')))
+
+    scenarios = {os.path.basename(test_file)[:-len('.in')]: load_market_config(test_file)
+                 for test_file in test_files}
+    if parameters is not None:
+        scenarios['generated'] = generate_scenario(parameters, args.seed)
+
+    engine = load_engine(args.engine)
+    engine_options = {}
+    if args.fair:
+        engine_options['fair'] = True
+    if args.reservation_ttl is not None:
+        engine_options['reservation_ttl'] = args.reservation_ttl
+
+    results = {
+        'engine': args.engine,
+        'clock': 'real' if args.real_time else 'virtual',
+        'on_demand': args.on_demand,
+        'fair': args.fair,
+        'reservation_ttl': args.reservation_ttl,
+        'python': sys.version.split()[0],
+        'generated': None if parameters is None else dict(parameters, seed=args.seed),
+        'scenarios': {name: run_scenario(engine, market_config, not args.real_time,
+                                         args.time_limit, on_demand=args.on_demand,
+                                         engine_options=engine_options or None)
+                      for name, market_config in scenarios.items()},
+    }
+
+    text = json.dumps(results, indent=4)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as output_file:
+            print(text, file=output_file)
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
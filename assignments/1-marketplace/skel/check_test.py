@@ -1,45 +1,115 @@
 """
 This module checks that the homework's solution output is correct
 
+The output and the reference output are compared as multisets of "consumer bought product" lines,
+whatever their order. Both files are read in chunks and only the count of each distinct line is
+kept, so the memory used doesn't grow with the number of lines.
+
 Computer Systems Architecture Course
 Assignment 1
 March 2021
 """
-import subprocess
 import sys
+from collections import Counter, defaultdict
+
+# The number of characters read from a file at once
+CHUNK_SIZE = 64 * 1024
+
+
+def count_orders(filename, counts, sign):
+    """
+    Counts the order lines of a file.
+    :type filename: String
+    :param filename: the file
+    :type counts: Counter
+    :param counts: the count of each line, changed in place
+    :type sign: Int
+    :param sign: 1 to add the file's lines to the counts, -1 to subtract them
+    """
+    with open(filename, encoding='utf-8') as input_file:
+        rest = ''
+        for chunk in iter(lambda: input_file.read(CHUNK_SIZE), ''):
+            # sometimes there is no new line between consumer outputs, every line ends with ")"
+            lines = (rest + chunk).split(")")
+            rest = lines.pop()
+
+            for line in lines:
+                line = line.strip()
+                if line:
+                    counts[line + ")"] += sign
+
+        if rest.strip():
+            counts[rest.strip()] += sign
+
+
+def compare_outputs(output_filename, ref_filename):
+    """
+    Compares an output with the reference one.
+    :returns a dict with the lines whose counts differ and by how much the output's count is
+    greater than the reference's, empty if the outputs match
+    """
+    counts = Counter()
+    count_orders(output_filename, counts, 1)
+    count_orders(ref_filename, counts, -1)
+
+    return {line: difference for line, difference in counts.items() if difference}
+
+
+def check_output(output_filename, ref_filename):
+    """
+    Checks an output against the reference one, whatever the order of its lines.
+    :returns True if they have the same lines
+    """
+    return not compare_outputs(output_filename, ref_filename)
+
+
+def describe_differences(differences):
+    """
+    Describes the differences between an output and the reference one, by product and by
+    consumer.
+    :type differences: Dict
+    :param differences: the differences, as returned by compare_outputs
+    :returns a list of lines
+    """
+    by_consumer = defaultdict(dict)
+    by_product = Counter()
+
+    for line, difference in differences.items():
+        consumer, _, product = line.partition(" bought ")
+        by_consumer[consumer][product or line] = difference
+        by_product[product or line] += difference
+
+    # The totals come first, they are the ones kept when the description is cut short
+    lines = [f"\tin all: {abs(difference)} {'extra' if difference > 0 else 'missing'} {product}"
+             for product, difference in sorted(by_product.items()) if difference]
+
+    for consumer, products in sorted(by_consumer.items()):
+        lines.append(f"\t{consumer}: " + ", ".join(
+            f"{abs(difference)} {'extra' if difference > 0 else 'missing'} {product}"
+            for product, difference in sorted(products.items())))
+
+    return lines
 
 
 def main():
+    """
+    Checks the output given on the command line and describes the differences, if any.
+    """
     if len(sys.argv) != 4:
-        print("Invalid number of arguments\nUsage: check_test.py testname output_filepath ref_filepath")
+        print("Invalid number of arguments\n"
+              "Usage: check_test.py testname output_filepath ref_filepath")
         return
 
     testname = sys.argv[1]
     output_filename = sys.argv[2]
     ref_filename = sys.argv[3]
-    # load the lines from the output file and sort them
-    with open(output_filename) as output_file:
-        output_lines = output_file.read()
-
-    output_lines = output_lines.split(")")  # sometimes there is no new line between consumer outputs
-    output_lines = [line.strip() + ")" for line in output_lines if len(line.strip()) > 0]
-
-    output_lines.sort()
-
-    sorted_output_filename = output_filename + ".sorted"
-
-    # write to input file (tests/{test_name}.in)
-    with open(sorted_output_filename, 'w') as sorted_output_file:
-        for line in output_lines:
-            print(line, file=sorted_output_file)
-
-    command = subprocess.Popen(["diff", sorted_output_filename, ref_filename], stdout=subprocess.PIPE)
-    out, err = command.communicate()
 
-    if len(out) == 0:
+    differences = compare_outputs(output_filename, ref_filename)
+    if not differences:
         print(f"Test {testname}" + ":\t\t" + "PASSED")
     else:
         print(f"Test {testname}" + ":\t\t" + "FAILED")
+        print("\n".join(describe_differences(differences)))
 
 
 if __name__ == "__main__":
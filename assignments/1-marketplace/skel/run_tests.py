@@ -0,0 +1,130 @@
+"""
+This module runs the tests concurrently, each in its own process and working directory, and checks
+their outputs against the reference ones.
+
+The output and the marketplace.log of each test are left in out/<test>/.
+
+Usage: python3 run_tests.py [--jobs N] [--timeout SECONDS] [test ...] [-- test.py options]
+
+Computer Systems Architecture Course
+Assignment 1
+March 2021
+"""
+import argparse
+import os
+import signal
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from check_test import compare_outputs, describe_differences
+
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+TESTS_DIR = os.path.join(ROOT_DIR, 'tests')
+OUT_DIR = os.path.join(ROOT_DIR, 'out')
+TEST_SCRIPT = os.path.join(ROOT_DIR, 'test.py')
+
+# The longest a test may run for in seconds, the last, largest tests get longer
+TIMEOUT = 30
+LONG_TIMEOUT = 60
+LONG_TESTS = ('09', '10')
+
+# The most lines of differences printed for a failed test
+MAX_DIFFERENCES = 20
+
+
+def run_test(name, test_args, timeout):
+    """
+    Runs test.py on a test in the test's working directory and checks its output.
+    :returns a (differences from the reference output, timed out, wall time) tuple
+    """
+    work_dir = os.path.join(OUT_DIR, name)
+    os.makedirs(work_dir, exist_ok=True)
+
+    output_filename = os.path.join(work_dir, f'{name}.out')
+    command = [sys.executable, TEST_SCRIPT, *test_args, os.path.join(TESTS_DIR, f'{name}.in')]
+
+    start = time.perf_counter()
+    with open(output_filename, 'w', encoding='utf-8') as output_file, \
+            open(os.path.join(work_dir, 'stderr'), 'w', encoding='utf-8') as error_file:
+        # A session of its own, so that a test running processes is killed with all of them
+        with subprocess.Popen(command, cwd=work_dir, stdout=output_file, stderr=error_file,
+                              start_new_session=True) as process:
+            try:
+                process.wait(timeout)
+                timed_out = False
+            except subprocess.TimeoutExpired:
+                os.killpg(process.pid, signal.SIGKILL)
+                process.wait()
+                timed_out = True
+
+    wall_time = time.perf_counter() - start
+
+    differences = compare_outputs(output_filename, os.path.join(TESTS_DIR, f'{name}.ref.out'))
+    return differences, timed_out, wall_time
+
+
+def main():
+    """
+    Runs the chosen tests, all of them by default, and prints their results as they finish.
+    """
+    parser = argparse.ArgumentParser(description="Run the tests concurrently",
+                                     usage="%(prog)s [-h] [--jobs N] [--timeout SECONDS] "
+                                           "[test ...] [-- test.py options]",
+                                     epilog="the options after -- are passed to test.py")
+    parser.add_argument("tests", nargs='*', help="the tests to run, by name (e.g. 01)")
+    parser.add_argument("--jobs", type=int, metavar="N",
+                        help="the number of tests run at once, all of them by default")
+    parser.add_argument("--timeout", type=float, metavar="SECONDS",
+                        help=f"the longest a test may run for, {TIMEOUT} s by default and "
+                             f"{LONG_TIMEOUT} s for tests {', '.join(LONG_TESTS)}")
+
+    # test.py's options come after --, their values can't be taken for test names
+    argv = sys.argv[1:]
+    test_args = []
+    if '--' in argv:
+        test_args = argv[argv.index('--') + 1:]
+        argv = argv[:argv.index('--')]
+    args = parser.parse_args(argv)
+
+    available = sorted(test[:-len('.in')] for test in os.listdir(TESTS_DIR)
+                       if test.endswith('.in'))
+    unknown = [name for name in args.tests if name not in available]
+    if unknown:
+        parser.error(f"unknown tests: {', '.join(unknown)}, the tests are "
+                     f"{', '.join(available)}")
+
+    tests = args.tests or available
+
+    timeouts = {name: args.timeout or (LONG_TIMEOUT if name in LONG_TESTS else TIMEOUT)
+                for name in tests}
+
+    start = time.perf_counter()
+    failed = 0
+
+    with ThreadPoolExecutor(args.jobs or len(tests)) as executor:
+        futures = {executor.submit(run_test, name, test_args, timeouts[name]): name
+                   for name in tests}
+
+        for future in as_completed(futures):
+            name = futures[future]
+            differences, timed_out, wall_time = future.result()
+            failed += bool(differences)
+
+            # The test's number, the way parse.awk expects it
+            number = name.lstrip('0') or name
+            if timed_out:
+                print(f"TIMEOUT. Test {number} exceeded maximum allowed time of "
+                      f"{timeouts[name]:g}")
+            print(f"Test {number}:\t\t{'FAILED' if differences else 'PASSED'}\t{wall_time:.2f} s")
+            for line in describe_differences(differences)[:MAX_DIFFERENCES]:
+                print(line)
+            sys.stdout.flush()
+
+    print(f"{len(tests) - failed}/{len(tests)} tests passed in {time.perf_counter() - start:.2f} s")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
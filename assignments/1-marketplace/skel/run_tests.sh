@@ -1,38 +1,13 @@
 #!/bin/bash
 
 SRC=tema
-TESTS=tests
-OUT=out
-PYTHON_CMD=/c/Python310/python
+PYTHON_CMD=${PYTHON_CMD:-python3}
+# test.py's options, set to --virtual-time to run the tests in simulated time, in a few seconds
+TEST_ARGS=${TEST_ARGS:-}
 
-for i in {1..8}
-do
-    TIMEOUT_VALS[$i]=30
-done
-for i in {9..10}
-do
-    TIMEOUT_VALS[$i]=60
-done
-
-# Cleanup the previous run's temporary files
-rm -f ${TESTS}/*.out.sorted
-
-# Run tests
-for i in {1..10}
-do
-    prefix=$(printf "%02d" $i)
-    rm -f "${TESTS}/$prefix".out
-    echo "Starting test $i"
-
-    timeout ${TIMEOUT_VALS[i]} ${PYTHON_CMD} test.py "${TESTS}/$prefix.in" > "${TESTS}/$prefix.out"
-    if [ ! $? -eq 0 ]
-    then
-        echo "TIMEOUT. Test $i exceeded maximum allowed time of ${TIMEOUT_VALS[i]}"
-    fi
-
-    echo "Finished test $i"
-    ${PYTHON_CMD} check_test.py $i "${TESTS}/$prefix.out" "${TESTS}/$prefix.ref.out"
-done
+# Run the tests concurrently, each in its own directory under out/, with its own timeout.
+# The failed tests are reported in the output, not in the exit status
+${PYTHON_CMD} run_tests.py "$@" ${TEST_ARGS:+-- ${TEST_ARGS}} || true
 
 # Pylint checks - the pylintrc file being in the same directory
 # Uncoment the following line to check your implementation's code style :)
@@ -0,0 +1,407 @@
+"""
+This module represents the asyncio flavour of the Marketplace, the Producer and the Consumer. They
+all run as coroutines on a single event loop instead of one thread each.
+
+Computer Systems Architecture Course
+Assignment 1
+March 2021
+"""
+import asyncio
+import io
+import unittest
+
+import tema.product as product_module
+from tema.cart import CartRegistry
+from tema.logger import LOGGER
+from tema.order_sink import OrderSink
+from tema.stock import ProductStock
+
+
+class AsyncProductWaiter:
+    """
+    Class that represents a consumer coroutine waiting in add_to_cart until the units of a product
+    he asked for are handed to him.
+    """
+
+    def __init__(self, quantity):
+        """
+        Constructor
+        :type quantity: Int
+        :param quantity: the number of units the waiter needs
+        """
+        self.quantity = quantity
+        self.done = asyncio.get_running_loop().create_future()
+
+        # The producers that supplied the units handed to the waiter so far
+        self.producer_ids = []
+
+    def satisfied(self):
+        """
+        Returns True if the waiter got all the units he needs.
+        """
+        return len(self.producer_ids) == self.quantity
+
+    def hand_over(self, producer_id):
+        """
+        Gives the waiter a unit supplied by the given producer and wakes him up once he has all of
+        them.
+        :type producer_id: Int
+        :param producer_id: the id of the producer that supplied the unit
+        """
+        self.producer_ids.append(producer_id)
+
+        if self.satisfied() and not self.done.done():
+            self.done.set_result(None)
+
+
+class AsyncMarketplace:
+    """
+    Class that represents the Marketplace for coroutines. Only one coroutine runs at a time, so
+    no locks are needed; waiting for products or for free slots suspends the coroutine.
+    """
+
+    def __init__(self, queue_size_per_producer, order_sink=None):
+        """
+        Constructor
+        :type queue_size_per_producer: Int
+        :param queue_size_per_producer: the maximum size of a queue associated with each producer
+        :type order_sink: OrderSink
+        :param order_sink: the sink the placed orders are written to, None for writing them to the
+        standard output
+        """
+        self.queue_size_per_producer = queue_size_per_producer
+
+        # The free slots in each producer's queue (producer id -> semaphore)
+        self.producers = []
+
+        # The consumers' open carts of reservations
+        self.carts = CartRegistry()
+
+        # The available products and the consumers waiting for them
+        self.stock = ProductStock()
+
+        self.order_sink = order_sink or OrderSink()
+
+    def register_producer(self):
+        """
+        Returns an id for the producer that calls this.
+        """
+        producer_id = len(self.producers)
+        self.producers.append(asyncio.BoundedSemaphore(self.queue_size_per_producer))
+
+        LOGGER.info("registered producer %d", producer_id)
+        return producer_id
+
+    async def publish_many(self, producer_id, product, quantity, block=False, timeout=None):
+        """
+        Adds up to the given number of units of the product provided by the producer to the
+        marketplace, as many as there are free slots in the producer's queue
+        :type producer_id: Int
+        :param producer_id: producer id
+        :type product: Product
+        :param product: the Product that will be published in the Marketplace
+        :type quantity: Int
+        :param quantity: the number of units to publish
+        :type block: Bool
+        :param block: wait until the producer's queue has at least one free slot instead of
+        publishing nothing
+        :type timeout: Float
+        :param timeout: the maximum number of seconds to wait for when blocking, None for no limit
+        :returns the number of published units
+        """
+        semaphore = self.producers[producer_id]
+        slots = 0
+
+        if block and quantity > 0 and semaphore.locked():
+            try:
+                await asyncio.wait_for(semaphore.acquire(), timeout)
+                slots = 1
+            except asyncio.TimeoutError:
+                pass
+
+        # Acquiring an unlocked semaphore doesn't suspend the coroutine
+        while slots < quantity and not semaphore.locked():
+            await semaphore.acquire()
+            slots += 1
+
+        if slots == 0:
+            LOGGER.info("publishing %s by producer %d failed", product, producer_id)
+            return 0
+
+        self.stock.supply(product, [producer_id] * slots)
+
+        LOGGER.info("publishing %d x %s by producer %d succeeded", slots, product, producer_id)
+        return slots
+
+    async def publish(self, producer_id, product, block=False, timeout=None):
+        """
+        Adds the product provided by the producer to the marketplace
+        :returns True or False. If the caller receives False, it should wait and then try again.
+        """
+        return await self.publish_many(producer_id, product, 1, block, timeout) == 1
+
+    def new_cart(self):
+        """
+        Creates a new cart for the consumer
+        :returns an int representing the cart_id
+        """
+        cart_id = self.carts.open()
+
+        LOGGER.info("added cart %d", cart_id)
+        return cart_id
+
+    async def add_many_to_cart(self, cart_id, product, quantity, block=False, timeout=None):
+        """
+        Adds up to the given number of units of a product to the given cart, as many as are
+        available.
+        :type cart_id: Int
+        :param cart_id: id cart
+        :type product: Product
+        :param product: the product to add to cart
+        :type quantity: Int
+        :param quantity: the number of units to add
+        :type block: Bool
+        :param block: wait until all the units become available instead of adding only the
+        available ones
+        :type timeout: Float
+        :param timeout: the maximum number of seconds to wait for when blocking, None for no limit
+        :returns the number of added units
+        """
+        producer_ids = self.stock.take(product, quantity)
+
+        if len(producer_ids) < quantity and block:
+            waiter = AsyncProductWaiter(quantity - len(producer_ids))
+            self.stock.add_waiter(product, waiter)
+
+            try:
+                await asyncio.wait_for(waiter.done, timeout)
+            except asyncio.TimeoutError:
+                # The waiter may have been satisfied before getting to run again
+                self.stock.remove_waiter(product, waiter)
+
+            producer_ids += waiter.producer_ids
+
+        self.carts.get(cart_id).add(product, producer_ids)
+
+        LOGGER.info("added %d of %d x %s to cart %d", len(producer_ids), quantity, product,
+                    cart_id)
+        return len(producer_ids)
+
+    async def add_to_cart(self, cart_id, product, block=False, timeout=None):
+        """
+        Adds a product to the given cart.
+        :returns True or False. If the caller receives False, it should wait and then try again
+        """
+        return await self.add_many_to_cart(cart_id, product, 1, block, timeout) == 1
+
+    def remove_many_from_cart(self, cart_id, product, quantity):
+        """
+        Removes up to the given number of units of a product from cart.
+        :type cart_id: Int
+        :param cart_id: id cart
+        :type product: Product
+        :param product: the product to remove from cart
+        :type quantity: Int
+        :param quantity: the number of units to remove
+        :returns the number of removed units
+        """
+        producer_ids = self.carts.get(cart_id).remove(product, quantity)
+        self.stock.supply(product, producer_ids)
+
+        LOGGER.info("removed %d of %d x %s from cart %d", len(producer_ids), quantity, product,
+                    cart_id)
+        return len(producer_ids)
+
+    def remove_from_cart(self, cart_id, product):
+        """
+        Removes a product from cart.
+        """
+        self.remove_many_from_cart(cart_id, product, 1)
+
+    async def place_order(self, cart_id):
+        """
+        Return a list with all the products in the cart. The order is written under the name of
+        the task placing it.
+        :type cart_id: Int
+        :param cart_id: id cart
+        """
+        reservations = self.carts.close(cart_id).reservations()
+
+        order = [product for product, _ in reservations]
+
+        # Free the slot that each bought product occupied in its producer's queue
+        for _, producer_id in reservations:
+            self.producers[producer_id].release()
+
+        self.order_sink.write_order(asyncio.current_task().get_name(), order)
+
+        LOGGER.info("cart %d placed an order", cart_id)
+        return order
+
+
+class AsyncProducer:
+    """
+    Class that represents a producer coroutine.
+    """
+
+    def __init__(self, products, marketplace, republish_wait_time, name=None):
+        """
+        Constructor.
+
+        @type products: List()
+        @param products: a list of products that the producer will produce
+
+        @type marketplace: AsyncMarketplace
+        @param marketplace: a reference to the marketplace
+
+        @type republish_wait_time: Time
+        @param republish_wait_time: not used, the producer waits in the marketplace for a free
+        slot. Accepted so that the scenario files can be used unchanged
+
+        @type name: String
+        @param name: the name of the producer
+        """
+        self.products = products
+        self.marketplace = marketplace
+        self.republish_wait_time = republish_wait_time
+        self.name = name
+
+        self.producer_id = self.marketplace.register_producer()
+
+    async def run(self):
+        """
+        Cycles through the products forever, publishing as many units as the queue can hold.
+        """
+        while True:
+            for product, quantity, production_time in self.products:
+                while quantity > 0:
+                    published = await self.marketplace.publish_many(self.producer_id, product,
+                                                                    quantity, block=True)
+                    quantity -= published
+
+                    await asyncio.sleep(published * production_time)
+
+
+class AsyncConsumer:
+    """
+    Class that represents a consumer coroutine.
+    """
+
+    def __init__(self, carts, marketplace, retry_wait_time, name=None):  # pylint: disable=unused-argument
+        """
+        Constructor.
+
+        :type carts: Iterable
+        :param carts: the carts, each a list of add and remove operations, gone through once
+
+        :type marketplace: AsyncMarketplace
+        :param marketplace: a reference to the marketplace
+
+        :type retry_wait_time: Time
+        :param retry_wait_time: not used, the consumer waits in the marketplace for the products.
+        Accepted so that the scenario files can be used unchanged
+
+        :type name: String
+        :param name: the name of the consumer, under which his orders are written
+        """
+        self.carts = carts
+        self.marketplace = marketplace
+        self.name = name
+
+    async def run(self):
+        """
+        Executes the consumer's carts. Must run in a task named after the consumer.
+        """
+        for cart in self.carts:
+            cart_id = self.marketplace.new_cart()
+
+            for operation in cart:
+                if operation['type'] == 'add':
+                    await self.marketplace.add_many_to_cart(cart_id, operation['product'],
+                                                            operation['quantity'], block=True)
+                elif operation['type'] == 'remove':
+                    self.marketplace.remove_many_from_cart(cart_id, operation['product'],
+                                                           operation['quantity'])
+
+            await self.marketplace.place_order(cart_id)
+
+
+async def run_market(market_config, order_sink=None):
+    """
+    Runs a market configuration, as built by test.py, on the current event loop until every
+    consumer is done.
+    :type market_config: Dict
+    :param market_config: the marketplace, producers and consumers configuration
+    :type order_sink: OrderSink
+    :param order_sink: the sink the placed orders are written to
+    """
+    marketplace = AsyncMarketplace(**market_config['marketplace'], order_sink=order_sink)
+
+    producers = [AsyncProducer(**p_market_config, marketplace=marketplace)
+                 for p_market_config in market_config['producers']]
+    consumers = [AsyncConsumer(**c_market_config, marketplace=marketplace)
+                 for c_market_config in market_config['consumers']]
+
+    producer_tasks = [asyncio.create_task(producer.run(), name=producer.name)
+                      for producer in producers]
+
+    # The consumers' orders are written under their tasks' names
+    await asyncio.gather(*(asyncio.create_task(consumer.run(), name=consumer.name)
+                           for consumer in consumers))
+
+    for task in producer_tasks:
+        task.cancel()
+    await asyncio.gather(*producer_tasks, return_exceptions=True)
+
+
+class TestAsyncMarketplace(unittest.IsolatedAsyncioTestCase):
+    """
+    Class used for testing the AsyncMarketplace.
+    """
+
+    def setUp(self) -> None:
+        """
+        Sets up the testing environment for the unit tests.
+        """
+        self.output = io.StringIO()
+        self.marketplace = AsyncMarketplace(2, order_sink=OrderSink(self.output))
+        self.producer = self.marketplace.register_producer()
+        self.cart = self.marketplace.new_cart()
+        self.tea = product_module.Tea('Mint Tea', 2, 'Herbal')
+
+    async def test_publish(self):
+        """
+        Test that a producer can't publish more products than his queue can hold.
+        """
+        self.assertEqual(await self.marketplace.publish_many(self.producer, self.tea, 3), 2)
+        self.assertFalse(await self.marketplace.publish(self.producer, self.tea))
+        self.assertFalse(await self.marketplace.publish(self.producer, self.tea, block=True,
+                                                        timeout=0.01))
+
+    async def test_add_to_cart_waits(self):
+        """
+        Test that a blocking add waits for the products to be published.
+        """
+        adding = asyncio.create_task(
+            self.marketplace.add_many_to_cart(self.cart, self.tea, 2, block=True, timeout=5))
+        await asyncio.sleep(0)
+
+        await self.marketplace.publish(self.producer, self.tea)
+        self.assertFalse(adding.done())
+
+        await self.marketplace.publish(self.producer, self.tea)
+        self.assertEqual(await adding, 2)
+
+    async def test_place_order(self):
+        """
+        Test that placing an order frees the producer's slots and writes the order.
+        """
+        await self.marketplace.publish_many(self.producer, self.tea, 2)
+        await self.marketplace.add_many_to_cart(self.cart, self.tea, 2)
+        self.assertEqual(self.marketplace.remove_many_from_cart(self.cart, self.tea, 1), 1)
+
+        await asyncio.create_task(self.marketplace.place_order(self.cart), name='cons1')
+
+        self.assertEqual(self.output.getvalue(),
+                         "cons1 bought Tea(name='Mint Tea', price=2, type='Herbal')\n")
+        self.assertEqual(await self.marketplace.publish_many(self.producer, self.tea, 2), 1)
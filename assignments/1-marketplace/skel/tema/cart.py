@@ -0,0 +1,408 @@
+"""
+This module offers the consumers' carts, the registry of the open carts and the expiry of the
+carts' reservations.
+
+Computer Systems Architecture Course
+Assignment 1
+March 2021
+"""
+import heapq
+import itertools
+import unittest
+from collections import Counter, deque
+from contextlib import nullcontext
+from threading import Lock, Thread, current_thread
+
+import tema.product as product_module
+from tema.clock import REAL_CLOCK
+from tema.stats import TimedLock
+
+
+class Cart:
+    """
+    Class that represents a consumer's cart, holding the reserved units of each product. Each unit
+    remembers the producer that supplied it and when it was added, so adding and removing units
+    doesn't scan the whole cart and the order keeps the order they were added in.
+    """
+
+    # Only the cart's consumer uses it, the units don't expire
+    lock = nullcontext()
+
+    def __init__(self):
+        """
+        Constructor
+        """
+        # The reserved units of each product, the first added one first
+        # (product -> deque of (addition number, producer id))
+        self.units = {}
+        self.additions = itertools.count()
+
+    def add(self, product, producer_ids):
+        """
+        Adds units of a product to the cart.
+        :type product: Product
+        :param product: the product to add
+        :type producer_ids: List
+        :param producer_ids: the ids of the producers that supplied the units
+        :returns the addition number of the product's last unit, None if the cart has none
+        """
+        units = self.units.get(product)
+        if units is None:
+            units = self.units[product] = deque()
+
+        units.extend((addition, producer_id)
+                     for producer_id, addition in zip(producer_ids, self.additions))
+
+        return units[-1][0] if units else None
+
+    def remove(self, product, quantity):
+        """
+        Removes up to the given number of units of a product, the first added ones.
+        :type product: Product
+        :param product: the product to remove
+        :type quantity: Int
+        :param quantity: the maximum number of units to remove
+        :returns a list with the ids of the producers of the removed units
+        """
+        units = self.units.get(product)
+        if not units:
+            return []
+
+        producer_ids = [units.popleft()[1] for _ in range(min(quantity, len(units)))]
+        if not units:
+            del self.units[product]
+
+        return producer_ids
+
+    def reservations(self):
+        """
+        Returns a list with the cart's (product, producer id) reservations in the order they were
+        added.
+        """
+        # Each product's units are already sorted by their addition number
+        return [(product, producer_id) for _, product, producer_id in heapq.merge(
+            *([(addition, product, producer_id) for addition, producer_id in units]
+              for product, units in self.units.items()))]
+
+    def forget_expired(self, product, quantity):  # pylint: disable=unused-argument
+        """
+        Forgets up to the given number of units of a product that expired.
+        :returns the number of forgotten units
+        """
+        return 0
+
+    def take_expired(self):
+        """
+        Returns the units that expired and must be added again before ordering, forgetting them.
+        :returns a list of (product, number of units) pairs
+        """
+        return []
+
+
+class ExpiringCart(Cart):
+    """
+    Class that represents a cart whose reservations expire. Both the consumer and the expiry
+    thread change it, under its lock. The cart counts the units that expired, so that they can
+    be added again before its order is placed.
+    """
+
+    def __init__(self):
+        """
+        Constructor
+        """
+        Cart.__init__(self)
+
+        self.lock = Lock()
+
+        # The number of units of each product that expired and weren't added again
+        self.expired = Counter()
+
+    def expire(self, product, last_addition):
+        """
+        Takes the units of a product out of the cart, up to the given addition.
+        :type product: Product
+        :param product: the product whose units expire
+        :type last_addition: Int
+        :param last_addition: the addition number of the last unit that expires
+        :returns a list with the ids of the producers of the expired units
+        """
+        units = self.units.get(product)
+        if not units:
+            return []
+
+        # The units are sorted by their addition number, the expired ones come first
+        producer_ids = []
+        while units and units[0][0] <= last_addition:
+            producer_ids.append(units.popleft()[1])
+
+        if not units:
+            del self.units[product]
+
+        self.expired[product] += len(producer_ids)
+        return producer_ids
+
+    def forget_expired(self, product, quantity):
+        forgotten = min(quantity, self.expired[product])
+        self.expired[product] -= forgotten
+
+        return forgotten
+
+    def take_expired(self):
+        expired = [(product, units) for product, units in self.expired.items() if units]
+        self.expired.clear()
+
+        return expired
+
+
+class CartRegistry:
+    """
+    Class that represents the open carts, keyed by ids that are never reused. A cart's storage is
+    released when its order is placed or it is abandoned, so the registry only holds the carts in
+    use however many were created. Using an id again after its cart was released fails, like using
+    an id that was never handed out.
+    """
+
+    def __init__(self, factory=Cart, expiry=None):
+        """
+        Constructor
+        :type factory: Callable
+        :param factory: builds an empty cart
+        :type expiry: ReservationExpiry
+        :param expiry: gives back the carts' reservations that expired, None if they don't expire
+        """
+        self.factory = factory
+        self.expiry = expiry
+
+        # The open carts (cart id -> cart)
+        self.carts = {}
+
+        # The number of ids handed out so far, the next id
+        self.issued = 0
+        self.lock = TimedLock('carts')
+
+    def open(self):
+        """
+        Opens a new cart.
+        :returns the new cart's id
+        """
+        # Using lock in order not to have two consumers with the same cart id
+        with self.lock:
+            cart_id = self.issued
+            self.issued += 1
+
+        self.carts[cart_id] = self.factory()
+        return cart_id
+
+    def get(self, cart_id):
+        """
+        Returns the open cart with the given id. A cart is only used by one consumer at a time, so
+        this needs no lock.
+        :type cart_id: Int
+        :param cart_id: an id returned by open()
+        :raises KeyError if the cart was released or the id is unknown
+        """
+        cart = self.carts.get(cart_id)
+        if cart is None:
+            raise self.missing(cart_id)
+
+        return cart
+
+    def find(self, cart_id):
+        """
+        Returns the open cart with the given id, None if it was released.
+        :type cart_id: Int
+        :param cart_id: an id returned by open()
+        """
+        return self.carts.get(cart_id)
+
+    def close(self, cart_id):
+        """
+        Releases the cart with the given id.
+        :type cart_id: Int
+        :param cart_id: an id returned by open()
+        :returns the released cart
+        :raises KeyError if the cart was already released or the id is unknown
+        """
+        cart = self.carts.pop(cart_id, None)
+        if cart is None:
+            raise self.missing(cart_id)
+
+        return cart
+
+    def missing(self, cart_id):
+        """
+        Returns the error raised when using an id that has no open cart.
+        :type cart_id: Int
+        :param cart_id: the id
+        """
+        if 0 <= cart_id < self.issued:
+            return KeyError(f"cart {cart_id} was released")
+
+        return KeyError(f"unknown cart {cart_id}")
+
+    def __len__(self):
+        return len(self.carts)
+
+
+class ReservationExpiry(Thread):
+    """
+    Class that represents the thread giving back the carts' reservations once their time to live
+    is over. All the reservations live as long, so their deadlines come in the order they were
+    added in: a queue of deadlines, sorted like a heap would keep them, finds the expired ones
+    without looking at the others or scanning the carts.
+    """
+
+    def __init__(self, ttl, expire, clock=REAL_CLOCK):
+        """
+        Constructor
+        :type ttl: Float
+        :param ttl: the number of seconds a reservation lives for
+        :type expire: Callable
+        :param expire: called with the cart id, the product and the last expired addition
+        number of each expired reservation
+        :type clock: RealClock
+        :param clock: the clock the reservations' lives are measured with
+        """
+        Thread.__init__(self, name='ReservationExpiry', daemon=True)
+
+        self.ttl = ttl
+        self.expire = expire
+        self.clock = clock
+
+        # The reservations not expired yet, the first one to expire first
+        # (deque of (deadline, cart id, product, last addition number))
+        self.deadlines = deque()
+        self.stopped = False
+
+        self.lock = Lock()
+        self.scheduled = clock.condition(self.lock)
+
+        # Register with the clock before starting, so that a virtual clock doesn't move on
+        # without the thread
+        self.clock.register()
+
+    def schedule(self, cart_id, product, last_addition):
+        """
+        Starts the life of the units of a product just added to a cart.
+        :type cart_id: Int
+        :param cart_id: the cart's id
+        :type product: Product
+        :param product: the added product
+        :type last_addition: Int
+        :param last_addition: the addition number of the last added unit
+        """
+        with self.lock:
+            # Reading the time with the lock held keeps the deadlines sorted
+            self.deadlines.append((self.clock.time() + self.ttl, cart_id, product, last_addition))
+
+            if len(self.deadlines) == 1:
+                self.scheduled.notify()
+
+    def run(self):
+        try:
+            while True:
+                with self.lock:
+                    expired = self.wait_for_expired()
+
+                if expired is None:
+                    return
+
+                for _, cart_id, product, last_addition in expired:
+                    self.expire(cart_id, product, last_addition)
+        finally:
+            self.clock.unregister()
+
+    def wait_for_expired(self):
+        """
+        Waits until some reservations expire and takes them off the queue. Must be called with
+        the lock held.
+        :returns a list of the expired reservations, None once the thread is stopped
+        """
+        while not self.stopped:
+            if not self.deadlines:
+                self.scheduled.wait()
+                continue
+
+            delay = self.deadlines[0][0] - self.clock.time()
+            if delay > 0:
+                self.scheduled.wait(delay)
+                continue
+
+            now = self.clock.time()
+            expired = []
+            while self.deadlines and self.deadlines[0][0] <= now:
+                expired.append(self.deadlines.popleft())
+
+            return expired
+
+        return None
+
+    def stop(self):
+        """
+        Stops the thread, the reservations don't expire anymore.
+        """
+        with self.lock:
+            self.stopped = True
+            self.scheduled.notify()
+
+        if self.is_alive() and current_thread() is not self:
+            self.join()
+
+
+class TestCart(unittest.TestCase):
+    """
+    Class used for testing the Cart.
+    """
+
+    def test_order_kept(self):
+        """
+        Test that removals take the first added units and the reservations keep the order they
+        were added in.
+        """
+        mint_tea = product_module.Tea('Mint Tea', 2, 'Herbal')
+        lime_tea = product_module.Tea('Lime Tea', 5, 'Fruit')
+        cart = Cart()
+
+        cart.add(mint_tea, [0, 1])
+        cart.add(lime_tea, [2])
+        cart.add(mint_tea, [3])
+
+        self.assertListEqual(cart.remove(mint_tea, 1), [0])
+        self.assertListEqual(cart.remove(lime_tea, 5), [2])
+        self.assertListEqual(cart.remove(lime_tea, 1), [])
+        self.assertListEqual(cart.reservations(), [(mint_tea, 1), (mint_tea, 3)])
+
+    def test_registry(self):
+        """
+        Test that the registry only holds the open carts and never reuses an id.
+        """
+        registry = CartRegistry()
+        first, second = registry.open(), registry.open()
+
+        registry.get(first).add(product_module.Tea('Mint Tea', 2, 'Herbal'), [0])
+        self.assertEqual(len(registry.close(first).reservations()), 1)
+        self.assertEqual(len(registry), 1)
+
+        # A released cart can't be used anymore, its id isn't reused
+        self.assertRaises(KeyError, registry.get, first)
+        self.assertRaises(KeyError, registry.close, first)
+        self.assertEqual(registry.open(), second + 1)
+        self.assertRaises(KeyError, registry.get, second + 2)
+
+    def test_expiry(self):
+        """
+        Test that the expired units leave the cart in the order they were added and are counted
+        until they are added again or removed.
+        """
+        mint_tea = product_module.Tea('Mint Tea', 2, 'Herbal')
+        cart = ExpiringCart()
+
+        first = cart.add(mint_tea, [0, 1])
+        cart.add(mint_tea, [2])
+
+        self.assertListEqual(cart.expire(mint_tea, first), [0, 1])
+        self.assertListEqual(cart.expire(mint_tea, first), [])
+        self.assertEqual(cart.forget_expired(mint_tea, 1), 1)
+        self.assertListEqual(cart.take_expired(), [(mint_tea, 1)])
+        self.assertListEqual(cart.take_expired(), [])
+        self.assertListEqual(cart.reservations(), [(mint_tea, 2)])
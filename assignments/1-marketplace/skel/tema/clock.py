@@ -0,0 +1,401 @@
+"""
+This module offers the clocks the Marketplace, the producers and the consumers wait with.
+
+The real clock waits in real time. The virtual clock keeps a simulated time that jumps straight to
+the next wake-up as soon as every thread using it is waiting, so a scenario runs as fast as its
+threads can do their work and gets the same outcome it would get in real time.
+
+Computer Systems Architecture Course
+Assignment 1
+March 2021
+"""
+import heapq
+import itertools
+import time
+import unittest
+from threading import Condition, Event, Lock, Thread
+
+
+class RealClock:
+    """
+    Class that represents the wall clock, waiting with the threading module's primitives.
+    """
+
+    @staticmethod
+    def time():
+        """
+        Returns the current time in seconds.
+        """
+        return time.monotonic()
+
+    @staticmethod
+    def sleep(seconds):
+        """
+        Waits for the given number of seconds.
+        """
+        time.sleep(seconds)
+
+    @staticmethod
+    def condition(lock):
+        """
+        Returns a condition variable using the given lock.
+        """
+        return Condition(lock)
+
+    def register(self):
+        """
+        Tells the clock a thread will wait with it. The real clock doesn't need to know.
+        """
+
+    def unregister(self):
+        """
+        Tells the clock a thread is done waiting with it.
+        """
+
+
+# The clock used when none is given
+REAL_CLOCK = RealClock()
+
+
+class Sleeper:
+    """
+    Class that represents a thread waiting with the virtual clock, until it is woken up or its
+    deadline is reached.
+    """
+
+    def __init__(self, deadline):
+        """
+        Constructor
+        :type deadline: Float
+        :param deadline: the virtual time the thread wakes up at, None for no limit
+        """
+        self.deadline = deadline
+        self.woken = False
+        self.notified = False
+        self.event = Event()
+
+    def wait(self):
+        """
+        Waits until the sleeper is woken up.
+        """
+        self.event.wait()
+
+
+class VirtualClock:
+    """
+    Class that represents a simulated clock. It counts the registered threads that aren't waiting
+    with it and, when none is left, moves the time to the earliest deadline and wakes the threads
+    waiting for it. The threads must register before they can be waited for, so they are
+    registered when they are built rather than when they start.
+    """
+
+    def __init__(self, start=0.0):
+        """
+        Constructor
+        :type start: Float
+        :param start: the initial time in seconds
+        """
+        self.now = start
+
+        # The number of registered threads that aren't waiting with the clock
+        self.running = 0
+
+        # The deadlines of the waiting threads, earliest first (heap of (deadline, order, sleeper))
+        self.deadlines = []
+        self.order = itertools.count()
+
+        self.lock = Lock()
+
+    def time(self):
+        """
+        Returns the current virtual time in seconds.
+        """
+        return self.now
+
+    def sleep(self, seconds):
+        """
+        Waits until the virtual time has advanced by the given number of seconds.
+        """
+        if seconds > 0:
+            self.start_waiting(seconds).wait()
+
+    def condition(self, lock):
+        """
+        Returns a condition variable using the given lock and waiting in virtual time.
+        """
+        return VirtualCondition(self, lock)
+
+    def register(self):
+        """
+        Tells the clock a thread will wait with it. The time doesn't advance while a registered
+        thread is running.
+        """
+        with self.lock:
+            self.running += 1
+
+    def unregister(self):
+        """
+        Tells the clock a thread is done waiting with it.
+        """
+        with self.lock:
+            self.running -= 1
+            self.advance()
+
+    def stalled(self):
+        """
+        Returns True if every registered thread is waiting without a deadline. Only a running
+        thread could wake them up, so they are deadlocked. Also True if no thread is registered.
+        """
+        with self.lock:
+            self.advance()
+            return self.running == 0 and not self.deadlines
+
+    def start_waiting(self, timeout):
+        """
+        Marks the calling thread as waiting until it is woken up or the timeout expires.
+        :type timeout: Float
+        :param timeout: the maximum number of seconds to wait for, None for no limit
+        :returns the sleeper to wait on
+        """
+        with self.lock:
+            sleeper = Sleeper(None if timeout is None else self.now + max(timeout, 0))
+            if sleeper.deadline is not None:
+                heapq.heappush(self.deadlines, (sleeper.deadline, next(self.order), sleeper))
+
+            self.running -= 1
+            self.advance()
+
+        return sleeper
+
+    def wake(self, sleeper, notified=True):
+        """
+        Wakes up a sleeper, unless it was already woken up.
+        :returns True if the sleeper was woken up by this call
+        """
+        with self.lock:
+            return self.wake_locked(sleeper, notified)
+
+    def wake_locked(self, sleeper, notified):
+        """
+        Wakes up a sleeper. Must be called with the clock's lock held.
+        """
+        if sleeper.woken:
+            return False
+
+        # The sleeper counts as running from now on, so the time can't advance before he gets to
+        # run and maybe wake up others
+        sleeper.woken = True
+        sleeper.notified = notified
+        self.running += 1
+        sleeper.event.set()
+
+        return True
+
+    def advance(self):
+        """
+        Moves the time to the earliest deadline and wakes up the sleepers waiting for it, if every
+        registered thread is waiting. Must be called with the clock's lock held.
+        """
+        # Sleepers woken up before their deadline are left in the heap and skipped here
+        while self.deadlines and self.deadlines[0][2].woken:
+            heapq.heappop(self.deadlines)
+
+        if self.running > 0 or not self.deadlines:
+            return
+
+        self.now = max(self.now, self.deadlines[0][0])
+        while self.deadlines and self.deadlines[0][0] <= self.now:
+            self.wake_locked(heapq.heappop(self.deadlines)[2], False)
+
+
+class VirtualCondition:
+    """
+    Class that represents a condition variable whose waits are timed by a virtual clock.
+    """
+
+    def __init__(self, clock, lock):
+        """
+        Constructor
+        :type clock: VirtualClock
+        :param clock: the clock the waits are timed by
+        :type lock: Lock
+        :param lock: the lock the condition is used with
+        """
+        self.clock = clock
+        self.lock = lock
+        self.sleepers = []
+
+    def __enter__(self):
+        return self.lock.__enter__()
+
+    def __exit__(self, *args):
+        return self.lock.__exit__(*args)
+
+    def wait(self, timeout=None):
+        """
+        Releases the lock and waits until notified or until the timeout expires. Must be called
+        with the lock held.
+        :returns True if notified
+        """
+        sleeper = self.clock.start_waiting(timeout)
+        self.sleepers.append(sleeper)
+
+        self.lock.release()
+        try:
+            sleeper.wait()
+        finally:
+            self.lock.acquire()
+
+        if sleeper in self.sleepers:
+            self.sleepers.remove(sleeper)
+
+        return sleeper.notified
+
+    def wait_for(self, predicate, timeout=None):
+        """
+        Waits until the predicate is true or until the timeout expires. Must be called with the
+        lock held.
+        :returns the last value of the predicate
+        """
+        deadline = None if timeout is None else self.clock.time() + timeout
+        result = predicate()
+
+        while not result:
+            remaining = None
+            if deadline is not None:
+                remaining = deadline - self.clock.time()
+                if remaining <= 0:
+                    break
+
+            self.wait(remaining)
+            result = predicate()
+
+        return result
+
+    def notify(self, count=1):
+        """
+        Wakes up the given number of waiting threads. Must be called with the lock held.
+        """
+        while count > 0 and self.sleepers:
+            # Sleepers whose timeout expired are already awake and don't count
+            if self.clock.wake(self.sleepers.pop(0)):
+                count -= 1
+
+    def notify_all(self):
+        """
+        Wakes up all the waiting threads. Must be called with the lock held.
+        """
+        self.notify(len(self.sleepers))
+
+
+class TestVirtualClock(unittest.TestCase):
+    """
+    Class used for testing the VirtualClock.
+    """
+
+    def setUp(self) -> None:
+        """
+        Sets up the testing environment for the unit tests.
+        """
+        self.clock = VirtualClock()
+
+    def run_registered(self, *targets):
+        """
+        Runs the targets on threads registered with the clock and waits for them. All of them are
+        registered before any starts, so the time doesn't advance before they are all waiting.
+        """
+        def run(target):
+            try:
+                target()
+            finally:
+                self.clock.unregister()
+
+        threads = [Thread(target=run, args=(target,)) for target in targets]
+        for _ in threads:
+            self.clock.register()
+
+        for thread in threads:
+            thread.start()
+
+        for thread in threads:
+            thread.join()
+
+    def test_sleep(self):
+        """
+        Test that the sleepers wake up in the order of their deadlines, without waiting.
+        """
+        woken = []
+
+        def sleeper(delay):
+            return lambda: (self.clock.sleep(delay), woken.append(self.clock.time()))
+
+        start = time.monotonic()
+        self.run_registered(sleeper(30), sleeper(10), sleeper(20))
+
+        self.assertEqual(woken, [10, 20, 30])
+        self.assertLess(time.monotonic() - start, 5)
+
+    def test_condition_timeout(self):
+        """
+        Test that a wait times out in virtual time unless notified.
+        """
+        condition = self.clock.condition(Lock())
+        results = []
+
+        def waiter():
+            with condition:
+                results.append(condition.wait_for(lambda: False, 60))
+                results.append(self.clock.time())
+
+        self.run_registered(waiter)
+        self.assertEqual(results, [False, 60])
+
+    def test_condition_notify(self):
+        """
+        Test that a thread waiting on a condition wakes up when another one notifies it, at the
+        virtual time of the notification.
+        """
+        condition = self.clock.condition(Lock())
+        notified = []
+        results = []
+
+        def notifier():
+            self.clock.sleep(5)
+            with condition:
+                notified.append(True)
+                condition.notify()
+
+        def waiter():
+            with condition:
+                results.append(condition.wait_for(lambda: notified, 100))
+                results.append(self.clock.time())
+
+        self.run_registered(waiter, notifier)
+
+        self.assertEqual(results, [[True], 5])
+
+    def test_stalled(self):
+        """
+        Test that the clock tells when every thread waits without a deadline.
+        """
+        condition = self.clock.condition(Lock())
+        notified = []
+
+        def waiter():
+            with condition:
+                condition.wait_for(lambda: notified)
+
+        self.clock.register()
+        waiting = Thread(target=waiter)
+        waiting.start()
+
+        while not self.clock.stalled():
+            time.sleep(0.01)
+
+        with condition:
+            notified.append(True)
+            condition.notify()
+
+        waiting.join()
+        self.assertFalse(self.clock.stalled())
+        self.clock.unregister()
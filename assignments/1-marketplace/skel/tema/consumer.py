@@ -5,28 +5,32 @@ Computer Systems Architecture Course
 Assignment 1
 March 2021
 """
-import time
 from threading import Thread
 
+from tema.clock import REAL_CLOCK
+
 
 class Consumer(Thread):
     """
     Class that represents a consumer.
     """
 
-    def __init__(self, carts, marketplace, retry_wait_time, **kwargs):
+    def __init__(self, carts, marketplace, retry_wait_time, clock=REAL_CLOCK, **kwargs):  # pylint: disable=unused-argument
         """
         Constructor.
 
-        :type carts: List
-        :param carts: a list of add and remove operations
+        :type carts: Iterable
+        :param carts: the carts, each a list of add and remove operations, gone through once
 
         :type marketplace: Marketplace
         :param marketplace: a reference to the marketplace
 
         :type retry_wait_time: Time
-        :param retry_wait_time: the number of seconds that a producer must wait
-        until the Marketplace becomes available
+        :param retry_wait_time: not used, the consumer waits in the marketplace for the products.
+        Accepted so that the scenario files can be used unchanged
+
+        :type clock: RealClock
+        :param clock: the clock the consumer waits with, the marketplace's one
 
         :type kwargs:
         :param kwargs: other arguments that are passed to the Thread's __init__()
@@ -35,9 +39,22 @@ class Consumer(Thread):
 
         self.carts = carts
         self.marketplace = marketplace
-        self.retry_wait_time = retry_wait_time
+        self.clock = clock
+
+        # Register with the clock before starting, so that a virtual clock doesn't move on
+        # without the consumer
+        self.clock.register()
 
     def run(self):
+        try:
+            self.buy()
+        finally:
+            self.clock.unregister()
+
+    def buy(self):
+        """
+        Fills and orders every cart.
+        """
         for cart in self.carts:
             # Register the cart in the marketplace
             cart_id = self.marketplace.new_cart()
@@ -51,14 +68,11 @@ class Consumer(Thread):
 
                 # Add or remove a quantity of product to/from the cart
                 if operation_type == 'add':
-                    for _ in range(quantity):
-                        # Try again later if the operation failed (the product is not available on
-                        # the market)
-                        while not self.marketplace.add_to_cart(cart_id, product):
-                            time.sleep(self.retry_wait_time)
+                    # Wait until the whole quantity is available on the market, the marketplace
+                    # hands us the units as soon as they are published or returned
+                    self.marketplace.add_many_to_cart(cart_id, product, quantity, block=True)
                 elif operation_type == 'remove':
-                    for _ in range(quantity):
-                        self.marketplace.remove_from_cart(cart_id, product)
+                    self.marketplace.remove_many_from_cart(cart_id, product, quantity)
 
             # In the end place the order
             self.marketplace.place_order(cart_id)
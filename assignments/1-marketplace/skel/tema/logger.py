@@ -0,0 +1,180 @@
+"""
+This module sets up the Marketplace's logging.
+
+The threads using the Marketplace only put the log records in a queue. A background listener thread
+formats them and writes them to a rotating log file in batches.
+
+Computer Systems Architecture Course
+Assignment 1
+March 2021
+"""
+import atexit
+import logging
+import time
+from logging.handlers import QueueHandler, RotatingFileHandler
+from queue import Empty, SimpleQueue
+from threading import Lock, Thread
+
+LOG_FILE = 'marketplace.log'
+LOG_FORMAT = '%(asctime)s %(levelname)8s: %(message)s'
+
+# The level of the logger when it is set up, unless it was given one before
+DEFAULT_LEVEL = logging.INFO
+
+# The log file is rotated when it reaches MAX_BYTES, keeping BACKUP_COUNT old files
+MAX_BYTES = 10 * 1024 * 1024
+BACKUP_COUNT = 3
+
+# The maximum number of records the listener writes before flushing the file
+BATCH_SIZE = 512
+
+LOGGER = logging.getLogger('marketplace')
+
+
+class DeferredQueueHandler(QueueHandler):
+    """
+    Queue handler that leaves formatting the record to the listener, so the logging thread only
+    pays for creating it and putting it in the queue.
+    """
+
+    def prepare(self, record):
+        """
+        Returns the record unchanged. Its arguments are products and ids, which don't change
+        until the listener gets to format them.
+        """
+        return record
+
+
+class BatchRotatingFileHandler(RotatingFileHandler):
+    """
+    Rotating file handler that flushes the file once per batch of records instead of after each
+    one.
+    """
+
+    def flush(self):
+        """
+        Does nothing, emit calls this after every record. The listener calls flush_batch instead.
+        """
+
+    def flush_batch(self):
+        """
+        Writes the buffered records to the file.
+        """
+        super().flush()
+
+
+class LogListener(Thread):
+    """
+    Class that represents the thread writing the queued log records.
+    """
+
+    def __init__(self, log_queue, handler, batch_size=BATCH_SIZE):
+        """
+        Constructor
+        :type log_queue: SimpleQueue
+        :param log_queue: the queue the records are put in
+        :type handler: BatchRotatingFileHandler
+        :param handler: the handler writing the records
+        :type batch_size: Int
+        :param batch_size: the maximum number of records written before flushing the file
+        """
+        Thread.__init__(self, name='LogListener', daemon=True)
+
+        self.log_queue = log_queue
+        self.handler = handler
+        self.batch_size = batch_size
+
+    def run(self):
+        stopped = False
+
+        while not stopped:
+            # Wait for a record, then take the ones that have already been queued after it
+            batch = [self.log_queue.get()]
+            try:
+                while len(batch) < self.batch_size:
+                    batch.append(self.log_queue.get_nowait())
+            except Empty:
+                pass
+
+            for record in batch:
+                # None is queued by stop()
+                if record is None:
+                    stopped = True
+                else:
+                    self.handler.handle(record)
+
+            self.handler.flush_batch()
+
+    def stop(self):
+        """
+        Writes the records that are still in the queue and stops the thread.
+        """
+        self.log_queue.put(None)
+        self.join()
+
+
+# The running listener, None until the logging is set up
+_LISTENER = None
+_SETUP_LOCK = Lock()
+
+
+def setup_logging(level=None, filename=LOG_FILE, max_bytes=MAX_BYTES,
+                  backup_count=BACKUP_COUNT):
+    """
+    Sets up the Marketplace's logger. The handler and the listener are only created the first time,
+    further calls only change the level, if one is given.
+    :type level: Int
+    :param level: the minimum level of the logged records, None for leaving the logger's level
+    unchanged, or DEFAULT_LEVEL if the logger has none yet
+    :type filename: String
+    :param filename: the log file
+    :type max_bytes: Int
+    :param max_bytes: the size at which the log file is rotated
+    :type backup_count: Int
+    :param backup_count: the number of rotated log files kept
+    """
+    global _LISTENER  # pylint: disable=global-statement
+
+    with _SETUP_LOCK:
+        if level is not None:
+            LOGGER.setLevel(level)
+        elif LOGGER.level == logging.NOTSET:
+            LOGGER.setLevel(DEFAULT_LEVEL)
+
+        if _LISTENER is not None:
+            return
+
+        # Using Rotating File Handler as specified on ocw, with the time in UTC
+        handler = BatchRotatingFileHandler(filename, maxBytes=max_bytes, backupCount=backup_count)
+        formatter = logging.Formatter(LOG_FORMAT)
+        formatter.converter = time.gmtime
+        handler.setFormatter(formatter)
+
+        log_queue = SimpleQueue()
+        LOGGER.addHandler(DeferredQueueHandler(log_queue))
+        LOGGER.propagate = False
+
+        _LISTENER = LogListener(log_queue, handler)
+        _LISTENER.start()
+
+        # Don't lose the records still in the queue when the program ends
+        atexit.register(shutdown_logging)
+
+
+def shutdown_logging():
+    """
+    Writes the queued records, closes the log file and removes the Marketplace's handler.
+    """
+    global _LISTENER  # pylint: disable=global-statement
+
+    with _SETUP_LOCK:
+        if _LISTENER is None:
+            return
+
+        for handler in list(LOGGER.handlers):
+            if isinstance(handler, DeferredQueueHandler):
+                LOGGER.removeHandler(handler)
+
+        _LISTENER.stop()
+        _LISTENER.handler.close()
+        _LISTENER = None
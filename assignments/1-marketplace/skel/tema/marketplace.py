@@ -4,13 +4,22 @@ Computer Systems Architecture Course
 Assignment 1
 March 2021
 """
+import io
 import logging
-import time
 import unittest
-from logging.handlers import RotatingFileHandler
-from threading import Lock, currentThread
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+from threading import Timer, current_thread
 
 import tema.product as product_module
+from tema.cart import CartRegistry, ExpiringCart, ReservationExpiry
+from tema.clock import REAL_CLOCK, VirtualClock
+from tema.logger import LOGGER, DeferredQueueHandler, setup_logging
+from tema.order_sink import OrderSink
+from tema.slots import ProducerSlots
+from tema.stats import MarketplaceStats, TimedLock
+from tema.stock import MarketplaceShard
+from tema.watchdog import ProgressWatchdog
 
 
 class Marketplace:
@@ -19,131 +28,245 @@ class Marketplace:
     The producers and consumers use its methods concurrently.
     """
 
-    def __init__(self, queue_size_per_producer):
+    def __init__(self, queue_size_per_producer, num_shards=16, log_level=None,
+                 order_sink=None, *, clock=REAL_CLOCK, stats_interval=None, fair=False,
+                 stall_window=None, on_stall=None, reservation_ttl=None):
         """
         Constructor
         :type queue_size_per_producer: Int
         :param queue_size_per_producer: the maximum size of a queue associated with each producer
+        :type num_shards: Int
+        :param num_shards: the number of independently locked shards the products are split into
+        :type log_level: Int
+        :param log_level: the minimum level of the logged messages, None for leaving the level the
+        Marketplace's logger already has
+        :type order_sink: OrderSink
+        :param order_sink: the sink the placed orders are written to, None for writing them to the
+        standard output
+        :type clock: RealClock
+        :param clock: the clock the producers and consumers wait with, a VirtualClock for running
+        in simulated time
+        :type stats_interval: Float
+        :param stats_interval: the number of seconds between two logs of the runtime metrics, None
+        for not logging them
+        :type fair: Bool
+        :param fair: hand the units of a product to the consumers waiting for it in the order they
+        started waiting, instead of to the most recent one first
+        :type stall_window: Float
+        :param stall_window: the number of seconds the market may go without progressing while
+        the waiting consumers need products no producer can publish, before it is reported as
+        stalled. None for not watching the progress
+        :type on_stall: Callable
+        :param on_stall: called with a diagnostic snapshot when the market stalls, None for
+        writing it to the standard error and aborting the process
+        :type reservation_ttl: Float
+        :param reservation_ttl: the number of seconds the units added to a cart stay reserved for
+        if its order isn't placed, None for keeping them until then. The expired units go back to
+        the marketplace and are added again when the order is placed
         """
         self.queue_size_per_producer = queue_size_per_producer
+        self.clock = clock
 
-        # Lists of lists consisting of each consumers/producers products
+        # The free slots in each producer's queue, taken by publish and freed by place_order
+        # (producer id -> ProducerSlots)
         self.producers = []
-        self.consumers = []
 
-        # List with all the products available in the marketplace
-        self.available_products = []
+        # Set by stop(), the producers' slots are closed from then on
+        self.stopped = False
 
-        # Locks
-        self.producer_lock = Lock()
-        self.consumer_lock = Lock()
-        self.product_lock = Lock()
+        # The consumers' open carts of reservations, expiring if they have a time to live
+        if reservation_ttl is None:
+            self.carts = CartRegistry()
+        else:
+            self.carts = CartRegistry(ExpiringCart, ReservationExpiry(reservation_ttl,
+                                                                      self.expire_reservation,
+                                                                      clock))
+            self.carts.expiry.start()
+
+        # The available products, split by their hash
+        self.shards = [MarketplaceShard(clock, fair) for _ in range(num_shards)]
+
+        # Where the placed orders are written
+        self.order_sink = order_sink or OrderSink()
 
-        # Logging initialisations
-        logger = logging.getLogger()
-        logger.setLevel(logging.INFO)
+        # Locks, counting how long they are waited for and held
+        self.producer_lock = TimedLock('producers')
 
-        # Using Rotating File Handler as specified on ocw
-        handler = RotatingFileHandler('marketplace.log')
-        handler.setLevel(logging.INFO)
+        # Runtime metrics, counted by each thread on its own. The waits are measured with the
+        # marketplace's clock, so they are simulated ones on a virtual clock
+        self.metrics = MarketplaceStats(clock.time)
 
-        # Setting a format for the logs
-        formatter = logging.Formatter('%(asctime)s %(levelname)8s: %(message)s')
-        handler.setFormatter(formatter)
+        # Logging initialisations, the log file is written by a background thread shared by all
+        # the marketplaces
+        setup_logging(log_level)
 
-        # Setting the time format
-        logging.Formatter.converter = time.gmtime
-        logger.addHandler(handler)
+        if stats_interval is not None:
+            self.metrics.start_dumping(stats_interval, self.stats)
 
-    def register_producer(self):
+        # Watches the published and added units and the orders, reporting a market that can't
+        # progress anymore
+        self.watchdog = None
+        if stall_window is not None:
+            self.watchdog = ProgressWatchdog(self, stall_window, on_stall)
+            self.watchdog.start()
+
+    def register_producer(self, products=None):
         """
         Returns an id for the producer that calls this.
+        :type products: Iterable
+        :param products: the products the producer makes, None if he doesn't tell. Only used to
+        tell whether the market can still progress
         """
-        logger = logging.getLogger()
-        logger.info("register producer")
+        LOGGER.info("register producer")
 
         # Producer's index in the producers array = producer's id
         # Using lock in order not to have two producers with the same id
         with self.producer_lock:
             producer_id = len(self.producers)
-            self.producers.append([])
+            self.producers.append(ProducerSlots(self.clock, self.queue_size_per_producer,
+                                                products))
+
+            if self.stopped:
+                self.producers[producer_id].close()
 
-        logger.info("registered producer %d", producer_id)
+        LOGGER.info("registered producer %d", producer_id)
         return producer_id
 
-    def publish(self, producer_id, product):
+    def publish(self, producer_id, product, block=False, timeout=None):
         """
         Adds the product provided by the producer to the marketplace
         :type producer_id: String
         :param producer_id: producer id
         :type product: Product
         :param product: the Product that will be published in the Marketplace
+        :type block: Bool
+        :param block: wait until the producer's queue has a free slot instead of failing
+        :type timeout: Float
+        :param timeout: the maximum number of seconds to wait for when blocking, None for no limit
         :returns True or False. If the caller receives False, it should wait and then try again.
         """
-        logger = logging.getLogger()
-        logger.info("publish %s by %d", str(product), producer_id)
+        return self.publish_many(producer_id, product, 1, block, timeout) == 1
 
-        # Using lock to avoid a race condition in case one consumer is trying to acquire a product
-        # from a producer's array while he is trying to produce some other product
-        with self.product_lock:
-            # If the producer's array is full then he can't produce anymore and has to wait
-            if len(self.producers[producer_id]) == self.queue_size_per_producer:
-                logger.info("publishing %s by producer %d failed", str(product), producer_id)
-                return False
+    def publish_many(self, producer_id, product, quantity, block=False, timeout=None):
+        """
+        Adds up to the given number of units of the product provided by the producer to the
+        marketplace, as many as there are free slots in the producer's queue
+        :type producer_id: String
+        :param producer_id: producer id
+        :type product: Product
+        :param product: the Product that will be published in the Marketplace
+        :type quantity: Int
+        :param quantity: the number of units to publish
+        :type block: Bool
+        :param block: wait until the producer's queue has at least one free slot instead of
+        publishing nothing
+        :type timeout: Float
+        :param timeout: the maximum number of seconds to wait for when blocking, None for no limit
+        :returns the number of published units. If the caller receives 0, it should wait and then
+        try again.
+        """
+        LOGGER.info("publish %d x %s by %d", quantity, product, producer_id)
 
-            # Add the product to the producer's array and to the list of available products
-            self.available_products.append(product)
-            self.producers[producer_id].append(product)
+        # If the producer's queue is full then he can't produce anymore and has to wait, either
+        # by trying again later or on his slots until one of his products is bought
+        start = self.clock.time() if block else 0.0
+        slots = self.producers[producer_id].take(quantity, block, timeout)
 
-        logger.info("publishing %s by producer %d succeeded", str(product), producer_id)
-        return True
+        self.metrics.published(producer_id, product, slots,
+                               self.clock.time() - start if block else 0.0)
+
+        if slots == 0:
+            LOGGER.info("publishing %s by producer %d failed", product, producer_id)
+            return 0
+
+        # Using the shard's lock to avoid a race condition in case one consumer is trying to
+        # acquire the product while he is trying to produce it
+        shard = self.shard_of(product)
+        with shard.lock:
+            # Make the units available
+            shard.supply(product, [producer_id] * slots)
+
+        LOGGER.info("publishing %d x %s by producer %d succeeded", slots, product,
+                    producer_id)
+        return slots
 
     def new_cart(self):
         """
         Creates a new cart for the consumer
         :returns an int representing the cart_id
         """
-        logger = logging.getLogger()
-        logger.info("new cart")
+        LOGGER.info("new cart")
 
-        # Consumer's index in the consumers array = cart's id
-        # Using lock in order not to have two consumers with the same cart id
-        with self.consumer_lock:
-            cart_id = len(self.consumers)
-            self.consumers.append([])
+        cart_id = self.carts.open()
 
-        logger.info("added cart %d", cart_id)
+        self.metrics.cart_started(cart_id)
+
+        LOGGER.info("added cart %d", cart_id)
         return cart_id
 
-    def add_to_cart(self, cart_id, product):
+    def add_to_cart(self, cart_id, product, block=False, timeout=None):
         """
         Adds a product to the given cart. The method returns
         :type cart_id: Int
         :param cart_id: id cart
         :type product: Product
         :param product: the product to add to cart
+        :type block: Bool
+        :param block: wait until a unit of the product becomes available instead of failing
+        :type timeout: Float
+        :param timeout: the maximum number of seconds to wait for when blocking, None for no limit
         :returns True or False. If the caller receives False, it should wait and then try again
         """
-        logger = logging.getLogger()
-        logger.info("add to cart %d %s", cart_id, str(product))
-
-        # Using lock to avoid a race condition in case one consumer is trying to acquire a product
-        # from a producer's array while he is trying to produce some other product
-        with self.product_lock:
-            # If the product isn't available at the moment in the marketplace the consumer has to
-            # wait and try again later
-            if product not in self.available_products:
-                logger.info("adding %s to cart %d failed", str(product), cart_id)
-                return False
+        return self.add_many_to_cart(cart_id, product, 1, block, timeout) == 1
 
-            # Remove the product from the list of available products
-            self.available_products.remove(product)
-
-        # Add the product to the customer's cart
-        self.consumers[cart_id].append(product)
+    def add_many_to_cart(self, cart_id, product, quantity, block=False, timeout=None):
+        """
+        Adds up to the given number of units of a product to the given cart, as many as are
+        available.
+        :type cart_id: Int
+        :param cart_id: id cart
+        :type product: Product
+        :param product: the product to add to cart
+        :type quantity: Int
+        :param quantity: the number of units to add
+        :type block: Bool
+        :param block: wait until all the units become available instead of adding only the
+        available ones
+        :type timeout: Float
+        :param timeout: the maximum number of seconds to wait for when blocking, None for no limit
+        :returns the number of added units. If the caller receives less than he asked for, he
+        should wait and then try again for the rest
+        """
+        LOGGER.info("add to cart %d %d x %s", cart_id, quantity, product)
+
+        # Using the shard's lock to avoid a race condition in case one consumer is trying to
+        # acquire the product while another one or a producer is working with it
+        shard = self.shard_of(product)
+        start = self.clock.time() if block else 0.0
+        with shard.lock:
+            # Reserve the units of the product, remembering the producers that supplied them
+            producer_ids = shard.reserve(product, quantity, block, timeout)
+
+        # Add the products to the customer's cart, starting their reservation's life
+        cart = self.carts.get(cart_id)
+        with cart.lock:
+            last_addition = cart.add(product, producer_ids)
+
+        if producer_ids and self.carts.expiry is not None:
+            self.carts.expiry.schedule(cart_id, product, last_addition)
+
+        self.metrics.added(product, quantity, len(producer_ids),
+                           self.clock.time() - start if block else 0.0)
+
+        # If the product isn't available at the moment in the marketplace the consumer has to
+        # wait and try again later
+        if len(producer_ids) < quantity:
+            LOGGER.info("adding %d x %s to cart %d failed, added %d", quantity, product,
+                        cart_id, len(producer_ids))
+        else:
+            LOGGER.info("adding %d x %s to cart %d succeeded", quantity, product, cart_id)
 
-        logger.info("adding %s to cart %d succeeded", str(product), cart_id)
-        return True
+        return len(producer_ids)
 
     def remove_from_cart(self, cart_id, product):
         """
@@ -153,48 +276,287 @@ class Marketplace:
         :type product: Product
         :param product: the product to remove from cart
         """
-        logger = logging.getLogger()
-        logger.info("remove from cart %d %s", cart_id, str(product))
+        self.remove_many_from_cart(cart_id, product, 1)
 
-        # First check if the consumer is trying to remove a product that exists in his cart
-        if product in self.consumers[cart_id]:
-            # Remove the product from the cart and add it back to the list of available products
-            self.consumers[cart_id].remove(product)
+    def remove_many_from_cart(self, cart_id, product, quantity):
+        """
+        Removes up to the given number of units of a product from cart.
+        :type cart_id: Int
+        :param cart_id: id cart
+        :type product: Product
+        :param product: the product to remove from cart
+        :type quantity: Int
+        :param quantity: the number of units to remove
+        :returns the number of removed units
+        """
+        LOGGER.info("remove from cart %d %d x %s", cart_id, quantity, product)
+
+        # Only the units that exist in the consumer's cart can be removed, the first ones he added.
+        # The expired ones are no longer in the cart, removing them means not adding them again
+        cart = self.carts.get(cart_id)
+        with cart.lock:
+            expired = cart.forget_expired(product, quantity)
+            producer_ids = cart.remove(product, quantity - expired)
+
+        if not producer_ids:
+            LOGGER.info("removing %s from cart %d removed %d expired units", product, cart_id,
+                        expired)
+            return expired
+
+        # Give the removed units back to their producers' stock
+        shard = self.shard_of(product)
+        with shard.lock:
+            shard.supply(product, producer_ids)
+
+        LOGGER.info("removing %d x %s from cart %d succeeded", len(producer_ids) + expired,
+                    product, cart_id)
+        return len(producer_ids) + expired
+
+    def place_order(self, cart_id, timeout=None):
+        """
+        Return a list with all the products in the cart.
+        :type cart_id: Int
+        :param cart_id: id cart
+        :type timeout: Float
+        :param timeout: the maximum number of seconds to wait for the units whose reservation
+        expired to be available again, None for no limit
+        :returns None if the expired units couldn't be added again before the timeout or the
+        marketplace stopped, the cart is then abandoned
+        """
+        LOGGER.info("place order from cart %d", cart_id)
 
-            with self.product_lock:
-                self.available_products.append(product)
+        deadline = None if timeout is None else self.clock.time() + timeout
 
-            logger.info("removing %s from cart %d succeeded", str(product), cart_id)
-        else:
-            logger.info("removing %s from cart %d failed", str(product), cart_id)
+        # Add the units that expired again, waiting for them, until the cart is whole. Then
+        # release the cart and place the order, the units in the order they were added
+        while True:
+            cart = self.carts.get(cart_id)
+            with cart.lock:
+                expired = cart.take_expired()
+                if not expired:
+                    reservations = self.carts.close(cart_id).reservations()
+                    break
+
+            for product, units in expired:
+                while units > 0:
+                    # Wait at most a time to live at once, so that a stop is noticed
+                    wait = self.carts.expiry.ttl
+                    if deadline is not None:
+                        wait = min(wait, deadline - self.clock.time())
+
+                    if self.stopped or wait <= 0:
+                        LOGGER.info("cart %d can't get its expired units back", cart_id)
+                        self.abandon_cart(cart_id)
+                        return None
+
+                    units -= self.add_many_to_cart(cart_id, product, units, block=True,
+                                                   timeout=wait)
+
+        order = [product for product, _ in reservations]
+        producer_ids = [producer_id for _, producer_id in reservations]
+
+        # Free the slot that each bought product occupied in its producer's queue in order for him
+        # to produce other products, waking him up if he is waiting for one
+        for producer_id, count in Counter(producer_ids).items():
+            self.producers[producer_id].release(count)
+
+        self.metrics.cart_ordered(cart_id, producer_ids)
 
-    def place_order(self, cart_id):
+        # Hand the whole order to the sink, no lock is held while it is written
+        self.order_sink.write_order(current_thread().name, order)
+
+        LOGGER.info("cart %d placed an order", cart_id)
+        return order
+
+    def rest(self, producer_id, seconds):
         """
-        Return a list with all the products in the cart.
+        Makes a producer wait between two products, until the marketplace stops.
+        :type producer_id: Int
+        :param producer_id: producer id
+        :type seconds: Float
+        :param seconds: the number of seconds to wait for
+        :returns False if the marketplace stopped, so the producer should stop producing
+        """
+        return self.producers[producer_id].rest(seconds)
+
+    def demand(self, product):
+        """
+        Returns the number of units of the product the waiting consumers still need. It is read
+        without a lock, so it may be slightly out of date.
+        :type product: Product
+        :param product: the product
+        """
+        return self.shard_of(product).demand.get(product.id, 0)
+
+    def follow_demand(self, producer_id, products):
+        """
+        Makes wait_for_demand wake up the producer when a consumer starts waiting for one of the
+        given products.
+        :type producer_id: Int
+        :param producer_id: producer id
+        :type products: List
+        :param products: the products the producer makes
+        """
+        for product in products:
+            shard = self.shard_of(product)
+            with shard.lock:
+                shard.demand_listeners[product.id].append(self.producers[producer_id])
+
+    def wait_for_demand(self, producer_id, products, timeout=None):
+        """
+        Waits until the waiting consumers need some of the given products. Only the consumers
+        that block in add_to_cart are known to need a product.
+        :type producer_id: Int
+        :param producer_id: the id of a producer that called follow_demand
+        :type products: List
+        :param products: the products the producer makes
+        :type timeout: Float
+        :param timeout: the maximum number of seconds to wait for, None for no limit
+        :returns the most needed product, None if none is needed after the timeout or the
+        marketplace stopped
+        """
+        if not self.producers[producer_id].wait_for_demand(
+                lambda: any(self.demand(product) > 0 for product in products), timeout):
+            return None
+
+        product = max(products, key=self.demand)
+        return product if self.demand(product) > 0 else None
+
+    def stop(self):
+        """
+        Stops the production: the producers waiting for a free slot or resting are woken up and
+        no unit can be published anymore, so the producers end. The units already published can
+        still be bought.
+        """
+        LOGGER.info("stop")
+
+        with self.producer_lock:
+            self.stopped = True
+            producers = list(self.producers)
+
+        for slots in producers:
+            slots.close()
+
+        # The consumers that are left can't progress, but they aren't stuck
+        if self.watchdog is not None:
+            self.watchdog.stop()
+
+        if self.carts.expiry is not None:
+            self.carts.expiry.stop()
+
+        self.metrics.stop_dumping()
+
+    def expire_reservation(self, cart_id, product, last_addition):
+        """
+        Gives the expired units of a product in a cart back to the marketplace, unless the cart
+        was released meanwhile.
         :type cart_id: Int
         :param cart_id: id cart
+        :type product: Product
+        :param product: the product whose units expired
+        :type last_addition: Int
+        :param last_addition: the addition number of the last unit that expired
         """
-        logger = logging.getLogger()
-        logger.info("place order from cart %d", cart_id)
+        cart = self.carts.find(cart_id)
+        if cart is None:
+            return
 
-        # Remove each product that the customer is buying from the producer's array in order for
-        # him to produce other products
-        for product in self.consumers[cart_id]:
-            with self.product_lock:
-                # Find which producer has the product the customer wants in its stock, then remove
-                # it
-                for id_producer in range(len(self.producers)):
-                    if product in self.producers[id_producer]:
-                        self.producers[id_producer].remove(product)
+        with cart.lock:
+            # The cart may have been released while waiting for its lock
+            if self.carts.find(cart_id) is not cart:
+                return
 
-                print(currentThread().getName() + " bought " + str(product))
+            producer_ids = cart.expire(product, last_addition)
 
-        # Empty the cart and place the order
-        order = self.consumers[cart_id].copy()
-        self.consumers[cart_id] = []
+        if not producer_ids:
+            return
 
-        logger.info("cart %d placed an order", cart_id)
-        return order
+        shard = self.shard_of(product)
+        with shard.lock:
+            shard.supply(product, producer_ids)
+
+        self.metrics.reservations_expired(len(producer_ids))
+
+        LOGGER.info("%d x %s expired in cart %d", len(producer_ids), product, cart_id)
+
+    def abandon_cart(self, cart_id):
+        """
+        Gives the units in a cart back to the marketplace and releases the cart, for a consumer
+        that leaves without placing an order.
+        :type cart_id: Int
+        :param cart_id: id cart
+        :returns the number of units given back
+        """
+        LOGGER.info("abandon cart %d", cart_id)
+
+        with self.carts.get(cart_id).lock:
+            cart = self.carts.close(cart_id)
+        self.metrics.cart_abandoned(cart_id)
+
+        returned = 0
+        for product, units in cart.units.items():
+            shard = self.shard_of(product)
+            with shard.lock:
+                shard.supply(product, [producer_id for _, producer_id in units])
+
+            returned += len(units)
+
+        LOGGER.info("cart %d abandoned, %d units given back", cart_id, returned)
+        return returned
+
+    def stats(self):
+        """
+        Returns a snapshot of the runtime metrics, merging the counters of all the threads.
+        :returns a dict with the publish and add attempts, units and wait times by producer and by
+        product, the time spent waiting for and holding each kind of lock, the number of occupied
+        slots in each producer's queue and the carts' fill times
+        """
+        with self.producer_lock:
+            slots_locks = [slots.lock for slots in self.producers]
+
+        snapshot = self.metrics.snapshot([self.producer_lock, self.carts.lock]
+                                         + [shard.lock for shard in self.shards] + slots_locks)
+        snapshot['queue_size_per_producer'] = self.queue_size_per_producer
+
+        return snapshot
+
+    def shard_of(self, product):
+        """
+        Returns the shard holding the given product.
+        :type product: Product
+        :param product: the product
+        """
+        return self.shards[product.id % len(self.shards)]
+
+    @contextmanager
+    def locked_shards(self, products=None):
+        """
+        Context manager holding the locks of the shards of several products at once. The locks are
+        always taken in the order of the shards, so operations on several shards can't deadlock.
+        :type products: Iterable
+        :param products: the products whose shards are locked, None for all the shards
+        """
+        if products is None:
+            shards = self.shards
+        else:
+            indexes = {product.id % len(self.shards) for product in products}
+            shards = [self.shards[index] for index in sorted(indexes)]
+
+        with ExitStack() as stack:
+            for shard in shards:
+                stack.enter_context(shard.lock)
+            yield
+
+    def inventory(self):
+        """
+        Returns a consistent snapshot of the products available in the marketplace.
+        :returns a dict mapping each available product to its number of units
+        """
+        with self.locked_shards():
+            return {product_module.Product.from_id(product_id): len(producer_ids)
+                    for shard in self.shards
+                    for product_id, producer_ids in shard.available_products.items()
+                    if producer_ids}
 
 
 class TestMarketplace(unittest.TestCase):
@@ -219,6 +581,24 @@ class TestMarketplace(unittest.TestCase):
         # Add a product to the test consumer's cart
         self.marketplace.add_to_cart(self.cart, product_module.Tea('Raspberry Tea', 1, 'Fruit'))
 
+    def test_logging_set_up_once(self):
+        """
+        Test that building several marketplaces doesn't duplicate the log handlers.
+        """
+        Marketplace(3)
+        Marketplace(3, log_level=logging.WARNING)
+
+        # Other handlers, such as a test runner's, may be attached too
+        self.assertEqual(sum(isinstance(handler, DeferredQueueHandler)
+                             for handler in LOGGER.handlers), 1)
+        self.assertEqual(LOGGER.level, logging.WARNING)
+
+        # A marketplace built without a level keeps the one set before
+        Marketplace(3)
+        self.assertEqual(LOGGER.level, logging.WARNING)
+
+        LOGGER.setLevel(logging.INFO)
+
     def test_register_producer(self):
         """
         Test the registration of a producer in the Marketplace.
@@ -244,6 +624,29 @@ class TestMarketplace(unittest.TestCase):
                                                   product_module.Tea('Camomile Tea', 1, 'Herbal')),
                          False)
 
+    def test_publish_blocking(self):
+        """
+        Test that a blocking publish waits for a slot to be freed by an order.
+        """
+        lime_tea = product_module.Tea('Lime Tea', 5, 'Fruit')
+        self.marketplace.publish(self.producer, lime_tea)
+
+        buyer = Timer(0.05, self.marketplace.place_order, (self.cart,))
+        buyer.start()
+
+        self.assertTrue(self.marketplace.publish(self.producer, lime_tea, block=True, timeout=5))
+        buyer.join()
+
+    def test_publish_blocking_timeout(self):
+        """
+        Test that a blocking publish fails once the timeout expires.
+        """
+        lime_tea = product_module.Tea('Lime Tea', 5, 'Fruit')
+        self.marketplace.publish(self.producer, lime_tea)
+
+        self.assertFalse(self.marketplace.publish(self.producer, lime_tea, block=True,
+                                                  timeout=0.05))
+
     def test_add_to_cart(self):
         """
         Test the adding of a product from the Marketplace to a cart.
@@ -257,6 +660,136 @@ class TestMarketplace(unittest.TestCase):
                                                       product_module.Tea('Camomile Tea', 1,
                                                                          'Herbal')), False)
 
+    def test_add_to_cart_counts_units(self):
+        """
+        Test that each published unit of a product can be added to a cart only once.
+        """
+        mint_tea = product_module.Tea('Mint Tea', 2, 'Herbal')
+        self.marketplace.publish(self.producer, mint_tea)
+
+        for _ in range(2):
+            self.assertTrue(self.marketplace.add_to_cart(self.cart, mint_tea))
+        self.assertFalse(self.marketplace.add_to_cart(self.cart, mint_tea))
+
+        # A removed unit becomes available again
+        self.marketplace.remove_from_cart(self.cart, mint_tea)
+        self.assertTrue(self.marketplace.add_to_cart(self.cart, mint_tea))
+
+    def test_place_order_frees_supplier_slot(self):
+        """
+        Test that placing an order frees only the slots of the producers that supplied the products.
+        """
+        lime_tea = product_module.Tea('Lime Tea', 5, 'Fruit')
+        other_producer = self.marketplace.register_producer()
+        for _ in range(3):
+            self.marketplace.publish(other_producer, lime_tea)
+
+        self.marketplace.add_to_cart(self.cart, lime_tea)
+        self.marketplace.place_order(self.cart)
+
+        # The second producer supplied only the lime tea, so it gets exactly one slot back
+        self.assertTrue(self.marketplace.publish(other_producer, lime_tea))
+        self.assertFalse(self.marketplace.publish(other_producer, lime_tea))
+
+        # The first producer supplied the raspberry tea and still holds the mint tea
+        self.assertTrue(self.marketplace.publish(self.producer, lime_tea))
+        self.assertTrue(self.marketplace.publish(self.producer, lime_tea))
+        self.assertFalse(self.marketplace.publish(self.producer, lime_tea))
+
+    def test_add_to_cart_blocking(self):
+        """
+        Test that a blocking add waits for the product to be published.
+        """
+        lime_tea = product_module.Tea('Lime Tea', 5, 'Fruit')
+        publisher = Timer(0.05, self.marketplace.publish, (self.producer, lime_tea))
+        publisher.start()
+
+        self.assertTrue(self.marketplace.add_to_cart(self.cart, lime_tea, block=True, timeout=5))
+        publisher.join()
+
+    def test_add_to_cart_blocking_timeout(self):
+        """
+        Test that a blocking add fails once the timeout expires.
+        """
+        self.assertFalse(self.marketplace.add_to_cart(self.cart,
+                                                      product_module.Tea('Lime Tea', 5, 'Fruit'),
+                                                      block=True, timeout=0.05))
+
+        # With a virtual clock the timeout expires without waiting for real
+        clock = VirtualClock()
+        marketplace = Marketplace(3, clock=clock)
+        cart = marketplace.new_cart()
+
+        # The test's thread is the only one using the clock
+        clock.register()
+        self.assertFalse(marketplace.add_to_cart(cart, product_module.Tea('Lime Tea', 5, 'Fruit'),
+                                                 block=True, timeout=3600))
+        clock.unregister()
+
+        self.assertEqual(clock.time(), 3600)
+
+    def test_inventory(self):
+        """
+        Test the snapshot of the products available in the Marketplace.
+        """
+        self.marketplace.publish(self.producer, product_module.Tea('Mint Tea', 2, 'Herbal'))
+
+        self.assertDictEqual(self.marketplace.inventory(),
+                             {product_module.Tea('Mint Tea', 2, 'Herbal'): 2})
+
+    def test_single_shard(self):
+        """
+        Test a Marketplace that keeps all its products under a single lock.
+        """
+        marketplace = Marketplace(3, num_shards=1)
+        producer = marketplace.register_producer()
+        cart = marketplace.new_cart()
+
+        marketplace.publish(producer, product_module.Tea('Mint Tea', 2, 'Herbal'))
+        marketplace.publish(producer, product_module.Tea('Lime Tea', 5, 'Fruit'))
+
+        self.assertTrue(marketplace.add_to_cart(cart, product_module.Tea('Lime Tea', 5, 'Fruit')))
+        self.assertDictEqual(marketplace.inventory(),
+                             {product_module.Tea('Mint Tea', 2, 'Herbal'): 1})
+
+    def test_publish_many(self):
+        """
+        Test publishing several units at once, as many as the producer's queue can hold.
+        """
+        lime_tea = product_module.Tea('Lime Tea', 5, 'Fruit')
+
+        self.assertEqual(self.marketplace.publish_many(self.producer, lime_tea, 3), 1)
+        self.assertEqual(self.marketplace.publish_many(self.producer, lime_tea, 3), 0)
+
+    def test_add_many_to_cart(self):
+        """
+        Test adding several units at once, as many as are available.
+        """
+        mint_tea = product_module.Tea('Mint Tea', 2, 'Herbal')
+        self.marketplace.publish(self.producer, mint_tea)
+
+        self.assertEqual(self.marketplace.add_many_to_cart(self.cart, mint_tea, 3), 2)
+        self.assertEqual(self.marketplace.add_many_to_cart(self.cart, mint_tea, 3), 0)
+
+        # A blocking add gets the units as they are returned
+        remover = Timer(0.05, self.marketplace.remove_many_from_cart, (self.cart, mint_tea, 2))
+        remover.start()
+
+        self.assertEqual(self.marketplace.add_many_to_cart(self.cart, mint_tea, 2, block=True,
+                                                           timeout=5), 2)
+        remover.join()
+
+    def test_remove_many_from_cart(self):
+        """
+        Test removing several units at once, as many as are in the cart.
+        """
+        raspberry_tea = product_module.Tea('Raspberry Tea', 1, 'Fruit')
+
+        self.assertEqual(self.marketplace.remove_many_from_cart(self.cart, raspberry_tea, 2), 1)
+        self.assertEqual(self.marketplace.remove_many_from_cart(self.cart, raspberry_tea, 2), 0)
+        self.assertDictEqual(self.marketplace.inventory(),
+                             {raspberry_tea: 1, product_module.Tea('Mint Tea', 2, 'Herbal'): 1})
+
     def test_remove_from_cart(self):
         """
         Test the removing of a product from a cart.
@@ -266,11 +799,33 @@ class TestMarketplace(unittest.TestCase):
                                                                               'Fruit')), None)
         self.assertListEqual(self.marketplace.place_order(self.cart), [], True)
 
+        # The cart was released by its order, it can't be used anymore
+        self.assertRaises(KeyError, self.marketplace.remove_from_cart, self.cart,
+                          product_module.Tea('Lime Tea', 5, 'Fruit'))
+
         # Trying to remove a product that doesn't exist in the customer's cart
-        self.assertEqual(self.marketplace.remove_from_cart(self.cart,
+        cart = self.marketplace.new_cart()
+        self.assertEqual(self.marketplace.remove_from_cart(cart,
                                                            product_module.Tea('Lime Tea', 5,
                                                                               'Fruit')), None)
-        self.assertListEqual(self.marketplace.place_order(self.cart), [], True)
+        self.assertListEqual(self.marketplace.place_order(cart), [], True)
+
+    def test_place_order_output(self):
+        """
+        Test that placing an order writes one line for each bought product to the order sink.
+        """
+        output = io.StringIO()
+        marketplace = Marketplace(3, order_sink=OrderSink(output))
+        producer = marketplace.register_producer()
+        cart = marketplace.new_cart()
+
+        marketplace.publish_many(producer, product_module.Tea('Mint Tea', 2, 'Herbal'), 2)
+        marketplace.add_many_to_cart(cart, product_module.Tea('Mint Tea', 2, 'Herbal'), 2)
+        marketplace.place_order(cart)
+
+        self.assertEqual(output.getvalue(),
+                         f"{current_thread().name} bought Tea(name='Mint Tea', price=2, "
+                         f"type='Herbal')\n" * 2)
 
     def test_place_order(self):
         """
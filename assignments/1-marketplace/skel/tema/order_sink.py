@@ -0,0 +1,138 @@
+"""
+This module offers the sinks that write the orders placed in the Marketplace.
+
+Computer Systems Architecture Course
+Assignment 1
+March 2021
+"""
+import sys
+from queue import Empty, SimpleQueue
+from threading import Lock, Thread
+
+# The maximum number of orders the buffered sink writes before flushing the stream
+BATCH_SIZE = 512
+
+
+def format_order(consumer_name, products):
+    """
+    Returns the lines describing an order, one for each bought product.
+    :type consumer_name: String
+    :param consumer_name: the name of the consumer that placed the order
+    :type products: List
+    :param products: the bought products
+    """
+    return "".join(f"{consumer_name} bought {product}\n" for product in products)
+
+
+class OrderSink:
+    """
+    Class that represents a sink writing each order to a stream as soon as it is placed.
+    """
+
+    def __init__(self, stream=None):
+        """
+        Constructor
+        :type stream: TextIO
+        :param stream: the stream the orders are written to, None for the current standard output
+        """
+        self.stream = stream
+        self.lock = Lock()
+
+    def write_order(self, consumer_name, products):
+        """
+        Writes an order. The whole order is written at once, so orders placed at the same time
+        don't mix their lines.
+        :type consumer_name: String
+        :param consumer_name: the name of the consumer that placed the order
+        :type products: List
+        :param products: the bought products
+        """
+        if not products:
+            return
+
+        text = format_order(consumer_name, products)
+        with self.lock:
+            (self.stream or sys.stdout).write(text)
+
+    def close(self):
+        """
+        Flushes the orders written so far.
+        """
+        with self.lock:
+            (self.stream or sys.stdout).flush()
+
+
+class DiscardingOrderSink(OrderSink):
+    """
+    Class that represents a sink that ignores the orders, for marketplaces whose orders are
+    written elsewhere or not at all.
+    """
+
+    def write_order(self, consumer_name, products):
+        """
+        Ignores the order.
+        """
+
+
+class BufferedOrderSink(OrderSink):
+    """
+    Class that represents a sink handing the orders to a background thread, which writes them to
+    the stream in batches.
+    """
+
+    def __init__(self, stream=None, batch_size=BATCH_SIZE):
+        """
+        Constructor
+        :type stream: TextIO
+        :param stream: the stream the orders are written to, None for the current standard output
+        :type batch_size: Int
+        :param batch_size: the maximum number of orders written before flushing the stream
+        """
+        OrderSink.__init__(self, stream)
+
+        self.batch_size = batch_size
+        self.orders = SimpleQueue()
+
+        self.writer = Thread(target=self.write_batches, name='OrderSink', daemon=True)
+        self.writer.start()
+
+    def write_order(self, consumer_name, products):
+        """
+        Queues an order for the writer thread.
+        :type consumer_name: String
+        :param consumer_name: the name of the consumer that placed the order
+        :type products: List
+        :param products: the bought products
+        """
+        if products:
+            self.orders.put((consumer_name, products))
+
+    def write_batches(self):
+        """
+        Writes the queued orders until the sink is closed. Runs on the writer thread.
+        """
+        stopped = False
+
+        while not stopped:
+            # Wait for an order, then take the ones that have already been queued after it
+            batch = [self.orders.get()]
+            try:
+                while len(batch) < self.batch_size:
+                    batch.append(self.orders.get_nowait())
+            except Empty:
+                pass
+
+            # None is queued by close()
+            stopped = None in batch
+            text = "".join(format_order(*order) for order in batch if order is not None)
+
+            stream = self.stream or sys.stdout
+            stream.write(text)
+            stream.flush()
+
+    def close(self):
+        """
+        Writes the queued orders and stops the writer thread.
+        """
+        self.orders.put(None)
+        self.writer.join()
@@ -0,0 +1,415 @@
+"""
+This module runs a market on several processes, so it isn't limited to the one core the GIL lets a
+process use.
+
+The producers are split into groups, each group running in a shard process that owns a Marketplace
+holding the products published by that group. The consumers are split among consumer processes,
+which reach the shards' marketplaces through manager proxies (pipes) and send the placed orders
+back to the main process through a queue.
+
+Computer Systems Architecture Course
+Assignment 1
+March 2021
+"""
+import io
+import multiprocessing
+import time
+import unittest
+from collections import Counter, defaultdict
+from multiprocessing.managers import BaseManager
+from threading import Thread, current_thread
+
+from tema.cart import CartRegistry
+from tema.consumer import Consumer
+from tema.logger import setup_logging
+from tema.marketplace import Marketplace
+from tema import product as product_module
+from tema.order_sink import DiscardingOrderSink, OrderSink
+from tema.producer import Producer
+
+# The number of seconds a consumer waits for a product on one shard before looking at the others
+POLL_INTERVAL = 0.05
+
+# The methods of a shard's marketplace the consumer processes can call
+SHARD_METHODS = ('new_cart', 'add_many_to_cart', 'remove_many_from_cart', 'place_order',
+                 'abandon_cart', 'inventory', 'stop')
+
+
+class QueueOrderSink(OrderSink):
+    """
+    Class that represents a sink sending the orders to another process through a queue.
+    """
+
+    def __init__(self, order_queue):
+        """
+        Constructor
+        :type order_queue: multiprocessing.Queue
+        :param order_queue: the queue the orders are put in
+        """
+        OrderSink.__init__(self)
+
+        self.order_queue = order_queue
+
+    def write_order(self, consumer_name, products):
+        """
+        Sends the order through the queue.
+        """
+        if products:
+            self.order_queue.put((consumer_name, products))
+
+
+class ShardManager(BaseManager):
+    """
+    Class that represents the manager serving the marketplace of a shard process.
+    """
+
+
+# The marketplace of the current shard process
+_SHARD_MARKETPLACE = None
+
+
+def start_shard(queue_size_per_producer, producer_configs, log_file):
+    """
+    Builds the marketplace of a shard process and starts its producers. Runs in the shard process,
+    before it starts serving the consumer processes.
+    :type queue_size_per_producer: Int
+    :param queue_size_per_producer: the maximum size of a queue associated with each producer
+    :type producer_configs: List
+    :param producer_configs: the configurations of the producers publishing in the shard
+    :type log_file: String
+    :param log_file: the shard's log file
+    """
+    global _SHARD_MARKETPLACE  # pylint: disable=global-statement
+
+    # Every process has its own log file, a rotating file can't be shared between processes
+    setup_logging(filename=log_file)
+
+    _SHARD_MARKETPLACE = Marketplace(queue_size_per_producer, order_sink=DiscardingOrderSink())
+
+    for producer_config in producer_configs:
+        Producer(**producer_config, marketplace=_SHARD_MARKETPLACE, daemon=True).start()
+
+
+def get_marketplace():
+    """
+    Returns the marketplace of the current shard process.
+    """
+    return _SHARD_MARKETPLACE
+
+
+ShardManager.register('get_marketplace', callable=get_marketplace, exposed=SHARD_METHODS)
+
+
+class ShardedMarketplaceClient:
+    """
+    Class that represents the Marketplace as seen by the consumers of a consumer process. A cart
+    is made of one cart on every shard the consumer took products from.
+    """
+
+    def __init__(self, shards, suppliers, order_sink, poll_interval=POLL_INTERVAL):
+        """
+        Constructor
+        :type shards: List
+        :param shards: proxies of the shards' marketplaces
+        :type suppliers: Dict
+        :param suppliers: the indexes of the shards having producers for each product
+        :type order_sink: OrderSink
+        :param order_sink: the sink the placed orders are written to
+        :type poll_interval: Float
+        :param poll_interval: the number of seconds a consumer waits for a product on one shard
+        before looking at the others
+        """
+        self.shards = shards
+        self.suppliers = suppliers
+        self.order_sink = order_sink
+        self.poll_interval = poll_interval
+
+        # The open carts, each made of its carts on the shards (dict shard index -> shard cart id)
+        # and the units it holds on each shard (Counter (shard index, product) -> units)
+        self.carts = CartRegistry(lambda: ({}, Counter()))
+
+    def new_cart(self):
+        """
+        Creates a new cart for the consumer
+        :returns an int representing the cart_id
+        """
+        return self.carts.open()
+
+    def shard_cart(self, cart_id, shard_index):
+        """
+        Returns the cart's cart on a shard, creating it the first time.
+        """
+        shard_carts, _ = self.carts.get(cart_id)
+        if shard_index not in shard_carts:
+            shard_carts[shard_index] = self.shards[shard_index].new_cart()
+
+        return shard_carts[shard_index]
+
+    def add_on_shard(self, cart_id, shard_index, product, quantity, timeout=None):
+        """
+        Adds up to the given number of units of a product from a shard to the cart. Waits for them
+        if a timeout is given.
+        :returns the number of added units
+        """
+        added = self.shards[shard_index].add_many_to_cart(self.shard_cart(cart_id, shard_index),
+                                                          product, quantity,
+                                                          timeout is not None, timeout)
+        self.carts.get(cart_id)[1][shard_index, product] += added
+
+        return added
+
+    def add_many_to_cart(self, cart_id, product, quantity, block=False, timeout=None):
+        """
+        Adds up to the given number of units of a product to the given cart, taking them from any
+        shard that has them.
+        :type block: Bool
+        :param block: wait until all the units become available instead of adding only the
+        available ones
+        :type timeout: Float
+        :param timeout: the maximum number of seconds to wait for when blocking, None for no limit
+        :returns the number of added units
+        """
+        shard_indexes = self.suppliers.get(product, [])
+        deadline = None if timeout is None else time.monotonic() + timeout
+        added = 0
+        attempt = 0
+
+        while True:
+            # Take the units that are available right away on every shard
+            for shard_index in shard_indexes:
+                if added < quantity:
+                    added += self.add_on_shard(cart_id, shard_index, product, quantity - added)
+
+            if added == quantity or not block or not shard_indexes:
+                return added
+
+            # Wait on one of the shards for a while, then look at all of them again
+            wait = self.poll_interval
+            if deadline is not None:
+                wait = min(wait, deadline - time.monotonic())
+                if wait <= 0:
+                    return added
+
+            added += self.add_on_shard(cart_id, shard_indexes[attempt % len(shard_indexes)],
+                                       product, quantity - added, wait)
+            attempt += 1
+
+    def add_to_cart(self, cart_id, product, block=False, timeout=None):
+        """
+        Adds a product to the given cart.
+        :returns True or False. If the caller receives False, it should wait and then try again
+        """
+        return self.add_many_to_cart(cart_id, product, 1, block, timeout) == 1
+
+    def remove_many_from_cart(self, cart_id, product, quantity):
+        """
+        Removes up to the given number of units of a product from cart.
+        :returns the number of removed units
+        """
+        shard_carts, held = self.carts.get(cart_id)
+        removed = 0
+
+        for shard_index, shard_cart_id in shard_carts.items():
+            if removed < quantity and held[shard_index, product]:
+                count = self.shards[shard_index].remove_many_from_cart(shard_cart_id, product,
+                                                                       quantity - removed)
+                held[shard_index, product] -= count
+                removed += count
+
+        return removed
+
+    def remove_from_cart(self, cart_id, product):
+        """
+        Removes a product from cart.
+        """
+        self.remove_many_from_cart(cart_id, product, 1)
+
+    def place_order(self, cart_id):
+        """
+        Places the order on every shard of the cart.
+        :returns a list with all the products in the cart
+        """
+        shard_carts, _ = self.carts.close(cart_id)
+
+        order = []
+        for shard_index, shard_cart_id in shard_carts.items():
+            order += self.shards[shard_index].place_order(shard_cart_id)
+
+        self.order_sink.write_order(current_thread().name, order)
+        return order
+
+    def abandon_cart(self, cart_id):
+        """
+        Gives the units in the cart back to every shard and releases the cart.
+        :returns the number of units given back
+        """
+        shard_carts, _ = self.carts.close(cart_id)
+
+        return sum(self.shards[shard_index].abandon_cart(shard_cart_id)
+                   for shard_index, shard_cart_id in shard_carts.items())
+
+
+def run_consumers(consumer_configs, addresses, authkey, suppliers, order_queue):
+    """
+    Runs a group of consumers. Runs in a consumer process.
+    :type consumer_configs: List
+    :param consumer_configs: the configurations of the consumers
+    :type addresses: List
+    :param addresses: the addresses of the shards' managers
+    :type authkey: Bytes
+    :param authkey: the shards' managers authentication key
+    :type suppliers: Dict
+    :param suppliers: the indexes of the shards having producers for each product
+    :type order_queue: multiprocessing.Queue
+    :param order_queue: the queue the placed orders are sent through
+    """
+    shards = []
+    for address in addresses:
+        manager = ShardManager(address=address, authkey=authkey)
+        manager.connect()
+        shards.append(manager.get_marketplace())  # pylint: disable=no-member
+
+    marketplace = ShardedMarketplaceClient(shards, suppliers, QueueOrderSink(order_queue))
+
+    consumers = [Consumer(**consumer_config, marketplace=marketplace)
+                 for consumer_config in consumer_configs]
+
+    for consumer in consumers:
+        consumer.start()
+
+    for consumer in consumers:
+        consumer.join()
+
+    # Tell the main process this group is done
+    order_queue.put(None)
+
+
+def write_orders(order_queue, order_sink, num_groups):
+    """
+    Writes the orders sent by the consumer processes until all of them are done.
+    """
+    while num_groups > 0:
+        order = order_queue.get()
+
+        if order is None:
+            num_groups -= 1
+        else:
+            order_sink.write_order(*order)
+
+
+def run_market(market_config, num_processes, order_sink):
+    """
+    Runs a market configuration, as built by test.py, on the given number of shard processes and
+    as many consumer processes, until every consumer is done.
+    :type market_config: Dict
+    :param market_config: the marketplace, producers and consumers configuration
+    :type num_processes: Int
+    :param num_processes: the number of shard processes and of consumer processes
+    :type order_sink: OrderSink
+    :param order_sink: the sink the placed orders are written to
+    """
+    context = multiprocessing.get_context('spawn')
+
+    producer_configs = market_config['producers']
+    consumer_configs = market_config['consumers']
+    num_shards = max(1, min(num_processes, len(producer_configs)))
+    num_groups = max(1, min(num_processes, len(consumer_configs)))
+
+    # Start the shards, each with a group of producers, and remember which shards can supply
+    # each product
+    managers = []
+    suppliers = defaultdict(list)
+
+    for index in range(num_shards):
+        # The managers are shut down once the consumers are done
+        manager = ShardManager(ctx=context)
+        manager.start(  # pylint: disable=consider-using-with
+            start_shard, (market_config['marketplace']['queue_size_per_producer'],
+                          producer_configs[index::num_shards], f'marketplace-shard{index}.log'))
+        managers.append(manager)
+
+        for producer_config in producer_configs[index::num_shards]:
+            for product, _, _ in producer_config['products']:
+                if index not in suppliers[product]:
+                    suppliers[product].append(index)
+
+    # Start the consumer processes and write their orders as they arrive
+    order_queue = context.Queue()
+    writer = Thread(target=write_orders, args=(order_queue, order_sink, num_groups))
+    writer.start()
+
+    authkey = bytes(multiprocessing.current_process().authkey)
+    groups = [context.Process(target=run_consumers,
+                              args=(consumer_configs[index::num_groups],
+                                    [manager.address for manager in managers], authkey,
+                                    dict(suppliers), order_queue))
+              for index in range(num_groups)]
+
+    for group in groups:
+        group.start()
+
+    for group in groups:
+        group.join()
+
+    writer.join()
+
+    # Let the shards' producers end before the shard processes do
+    for manager in managers:
+        manager.get_marketplace().stop()  # pylint: disable=no-member
+        manager.shutdown()
+
+
+class TestShardedMarketplaceClient(unittest.TestCase):
+    """
+    Class used for testing the ShardedMarketplaceClient, with in-process marketplaces as shards.
+    """
+
+    def setUp(self) -> None:
+        """
+        Sets up the testing environment for the unit tests.
+        """
+        self.output = io.StringIO()
+        self.shards = [Marketplace(2, order_sink=DiscardingOrderSink()) for _ in range(2)]
+        self.producers = [shard.register_producer() for shard in self.shards]
+        self.tea = product_module.Tea('Mint Tea', 2, 'Herbal')
+        self.marketplace = ShardedMarketplaceClient(self.shards, {self.tea: [0, 1]},
+                                                    OrderSink(self.output), poll_interval=0.01)
+        self.cart = self.marketplace.new_cart()
+
+    def test_add_from_every_shard(self):
+        """
+        Test that the units of a product are taken from all the shards that have them.
+        """
+        for shard, producer in zip(self.shards, self.producers):
+            shard.publish(producer, self.tea)
+
+        self.assertEqual(self.marketplace.add_many_to_cart(self.cart, self.tea, 3), 2)
+        self.assertEqual(self.marketplace.add_many_to_cart(self.cart, self.tea, 1, block=True,
+                                                           timeout=0.05), 0)
+
+    def test_add_waits_on_any_shard(self):
+        """
+        Test that a blocking add gets the units published on a shard it isn't waiting on.
+        """
+        publisher = Thread(target=self.shards[1].publish_many,
+                           args=(self.producers[1], self.tea, 2))
+        publisher.start()
+
+        self.assertEqual(self.marketplace.add_many_to_cart(self.cart, self.tea, 2, block=True,
+                                                           timeout=5), 2)
+        publisher.join()
+
+    def test_remove_and_place_order(self):
+        """
+        Test that the removed units go back to their shard and the rest are ordered.
+        """
+        for shard, producer in zip(self.shards, self.producers):
+            shard.publish(producer, self.tea)
+        self.marketplace.add_many_to_cart(self.cart, self.tea, 2)
+
+        self.assertEqual(self.marketplace.remove_many_from_cart(self.cart, self.tea, 1), 1)
+        self.assertEqual(sum(sum(shard.inventory().values()) for shard in self.shards), 1)
+
+        self.assertEqual(self.marketplace.place_order(self.cart), [self.tea])
+        self.assertEqual(self.output.getvalue(), f"{current_thread().name} bought {self.tea}\n")
+        self.assertRaises(KeyError, self.marketplace.place_order, self.cart)
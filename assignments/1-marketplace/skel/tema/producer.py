@@ -5,16 +5,18 @@ Computer Systems Architecture Course
 Assignment 1
 March 2021
 """
-import time
 from threading import Thread
 
+from tema.clock import REAL_CLOCK
+
 
 class Producer(Thread):
     """
     Class that represents a producer.
     """
 
-    def __init__(self, products, marketplace, republish_wait_time, **kwargs):
+    def __init__(self, products, marketplace, republish_wait_time, blocking=True, *,
+                 on_demand=False, clock=REAL_CLOCK, **kwargs):
         """
         Constructor.
 
@@ -28,6 +30,17 @@ class Producer(Thread):
         @param republish_wait_time: the number of seconds that a producer must
         wait until the marketplace becomes available
 
+        @type blocking: Boolean
+        @param blocking: wait in the marketplace for a free slot instead of
+        retrying every republish_wait_time seconds
+
+        @type on_demand: Boolean
+        @param on_demand: only produce the products the waiting consumers
+        need, the most needed first, instead of cycling through all of them
+
+        @type clock: RealClock
+        @param clock: the clock the producer waits with, the marketplace's one
+
         @type kwargs:
         @param kwargs: other arguments that are passed to the Thread's __init__()
         """
@@ -36,23 +49,81 @@ class Producer(Thread):
         self.products = products
         self.marketplace = marketplace
         self.republish_wait_time = republish_wait_time
+        self.blocking = blocking
+        self.on_demand = on_demand
+        self.clock = clock
 
-        # Register the producer in the marketplace
-        self.producer_id = self.marketplace.register_producer()
+        # Register the producer in the marketplace and with the clock, before he starts so that a
+        # virtual clock doesn't move on without him
+        self.producer_id = self.marketplace.register_producer([product[0]
+                                                               for product in products])
+        self.clock.register()
 
     def run(self):
+        try:
+            if self.on_demand:
+                self.produce_on_demand()
+            else:
+                self.produce()
+        finally:
+            self.clock.unregister()
+
+    def produce(self):
+        """
+        Publishes the products until the marketplace stops.
+        """
         # Cycle through the products that the producer is able to produce and try to add them to
         # the marketplace
         while True:
             for product in self.products:
                 quantity = product[1]
 
-                for _ in range(quantity):
-                    # If the producer's array is full then he has to wait until he tries to
-                    # republish it
-                    while not self.marketplace.publish(self.producer_id, product[0]):
-                        time.sleep(self.republish_wait_time)
+                while quantity > 0:
+                    # Publish as many units as the producer's queue can hold. If it is full then
+                    # he has to wait until one of his products is bought, either in the
+                    # marketplace or by trying to republish it
+                    published = self.marketplace.publish_many(self.producer_id, product[0],
+                                                              quantity, block=self.blocking)
+                    if not published and not self.marketplace.rest(self.producer_id,
+                                                                   self.republish_wait_time):
+                        return
+
+                    quantity -= published
+
+                    # The products have been added to the marketplace and the producer has to wait
+                    # until he can produce new products. The marketplace cuts the wait short when
+                    # it stops
+                    if not self.marketplace.rest(self.producer_id, published * product[2]):
+                        return
+
+    def produce_on_demand(self):
+        """
+        Publishes the products the waiting consumers need until the marketplace stops. A product
+        no one waits for doesn't take up a slot in the producer's queue.
+        """
+        # (product -> (quantity, production time))
+        details = {product[0]: (product[1], product[2]) for product in self.products}
+        self.marketplace.follow_demand(self.producer_id, list(details))
+
+        while True:
+            # Wait until a consumer needs one of the products, then produce the most needed one,
+            # at most a batch of it
+            product = self.marketplace.wait_for_demand(self.producer_id, list(details))
+            if product is None:
+                return
+
+            quantity = min(details[product][0], self.marketplace.demand(product))
+
+            # The demand is read without a lock, it may have been met since. Nothing to publish
+            # nor to rest for then
+            if quantity == 0:
+                continue
+
+            published = self.marketplace.publish_many(self.producer_id, product, quantity,
+                                                      block=self.blocking)
+            if not published and not self.marketplace.rest(self.producer_id,
+                                                           self.republish_wait_time):
+                return
 
-                    # The product has been added to the marketplace and the producer has to wait
-                    # until he can produce a new product
-                    time.sleep(product[2])
+            if not self.marketplace.rest(self.producer_id, published * details[product][1]):
+                return
@@ -1,35 +1,154 @@
 """
 This module offers the available Products.
 
+The products are interned: building a product with the same field values, of the same types, as
+an existing one returns the existing instance, so the marketplace can compare them by identity and
+key them by a small integer id instead of comparing and hashing all their fields.
+
 Computer Systems Architecture Course
 Assignment 1
 March 2021
 """
 
-from dataclasses import dataclass
+import itertools
+import pickle
+import unittest
+from dataclasses import astuple, dataclass, fields
+from threading import Lock
+
+# The interned products, by class and typed field values and by id
+INSTANCES = {}
+INSTANCES_BY_ID = {}
+INSTANCES_LOCK = Lock()
+NEXT_ID = itertools.count()
 
 
-@dataclass(init=True, repr=True, order=False, frozen=True)
-class Product:
+class Interned(type):
     """
-    Class that represents a product.
+    Metaclass of the products, interning them when they are built. A product is only interned
+    once it is fully built, and an interned product is never built again.
     """
+
+    def __call__(cls, *args, **kwargs):
+        names = [field.name for field in fields(cls)]
+
+        # Leave the wrong arguments to the constructor to complain about
+        if len(args) + len(kwargs) != len(names) or set(kwargs) != set(names[len(args):]):
+            return super().__call__(*args, **kwargs)
+
+        # Equal values of different types, such as 2 and 2.0, make different products
+        values = args + tuple(kwargs[name] for name in names[len(args):])
+        key = (cls, tuple((type(value), value) for value in values))
+
+        with INSTANCES_LOCK:
+            product = INSTANCES.get(key)
+        if product is not None:
+            return product
+
+        product = super().__call__(*args, **kwargs)
+
+        # Another thread may have built the same product meanwhile
+        with INSTANCES_LOCK:
+            interned = INSTANCES.setdefault(key, product)
+            if interned is product:
+                object.__setattr__(product, 'id', next(NEXT_ID))
+                INSTANCES_BY_ID[product.id] = product
+
+        return interned
+
+
+@dataclass(init=True, repr=True, eq=False, order=False, frozen=True)
+class Product(metaclass=Interned):
+    """
+    Class that represents a product. Equal products are the same instance, identified by their id.
+    """
+    # The id is set when the product is interned, it isn't a field
+    # pylint: disable=no-member
+    __slots__ = ('name', 'price', 'id')
+
     name: str
     price: int
 
+    def __eq__(self, other):
+        return self is other
+
+    def __hash__(self):
+        return self.id
 
-@dataclass(init=True, repr=True, order=False, frozen=True)
+    def __reduce__(self):
+        # The ids are only valid in one process, an unpickled product is interned again
+        return self.__class__, astuple(self)
+
+    @staticmethod
+    def from_id(product_id):
+        """
+        Returns the product with the given id.
+        :type product_id: Int
+        :param product_id: the id of an existing product
+        """
+        return INSTANCES_BY_ID[product_id]
+
+
+@dataclass(init=True, repr=True, eq=False, order=False, frozen=True)
 class Tea(Product):
     """
     Tea products
     """
+    __slots__ = ('type',)
+
     type: str
 
 
-@dataclass(init=True, repr=True, order=False, frozen=True)
+@dataclass(init=True, repr=True, eq=False, order=False, frozen=True)
 class Coffee(Product):
     """
     Coffee products
     """
+    __slots__ = ('acidity', 'roast_level')
+
     acidity: str
     roast_level: str
+
+
+class TestProduct(unittest.TestCase):
+    """
+    Class used for testing the interned Products.
+    """
+
+    def test_interned(self):
+        """
+        Test that equal products are the same instance and different ones aren't equal.
+        """
+        tea = Tea('Mint Tea', 2, 'Herbal')
+
+        self.assertIs(Tea(name='Mint Tea', price=2, type='Herbal'), tea)
+        self.assertIs(Product.from_id(tea.id), tea)  # pylint: disable=no-member
+        self.assertNotEqual(Tea('Mint Tea', 3, 'Herbal'), tea)
+        self.assertNotEqual(Product('Mint Tea', 2), tea)
+        self.assertEqual(repr(tea), "Tea(name='Mint Tea', price=2, type='Herbal')")
+        self.assertRaises(TypeError, Tea, 'Mint Tea', 2)
+        self.assertFalse(hasattr(tea, '__dict__'))
+
+    def test_interned_by_type(self):
+        """
+        Test that values equal but of different types make different products, leaving the
+        interned one unchanged, and that failed constructions intern nothing.
+        """
+        tea = Tea('Mint Tea', 2, 'Herbal')
+        float_tea = Tea('Mint Tea', 2.0, 'Herbal')
+
+        self.assertIsNot(float_tea, tea)
+        self.assertEqual(repr(tea), "Tea(name='Mint Tea', price=2, type='Herbal')")
+        self.assertEqual(repr(float_tea), "Tea(name='Mint Tea', price=2.0, type='Herbal')")
+
+        interned = len(INSTANCES)
+        self.assertRaises(TypeError, Tea, 'Mint Tea', 2, type='Herbal', price=2)
+        self.assertRaises(TypeError, Tea, 'Mint Tea', 2, kind='Herbal')
+        self.assertEqual(len(INSTANCES), interned)
+
+    def test_pickle(self):
+        """
+        Test that an unpickled product is the interned one.
+        """
+        coffee = Coffee('Indonezia', 1, '5.05', 'MEDIUM')
+        self.assertIs(pickle.loads(pickle.dumps(coffee)), coffee)
@@ -0,0 +1,363 @@
+"""
+This module loads the market configurations of the tests, turning the product definitions and ids
+into actual products.
+
+A configuration is either loaded whole or streamed: the streaming loader reads the input file
+incrementally, keeping only the consumers' names and wait times, and reads each consumer's carts
+again from the file, one at a time, as the consumer goes through them. Its memory doesn't grow
+with the number of operations of the scenario.
+
+Computer Systems Architecture Course
+Assignment 1
+March 2021
+"""
+import codecs
+import os
+import tempfile
+import unittest
+from json import JSONDecodeError, JSONDecoder, dumps, loads
+
+from tema import product as product_module
+
+# The number of bytes read from the input file at once
+CHUNK_SIZE = 64 * 1024
+
+
+def build_product(definition):
+    """
+    Builds the product of a product definition.
+    :type definition: Dict
+    :param definition: the product's type and fields
+    :returns the product
+    """
+    params = {k: definition[k] for k in definition.keys() if k != 'product_type'}
+    return getattr(product_module, definition['product_type'])(**params)
+
+
+def build_producer(producer, products):
+    """
+    Turns the product ids of a producer's configuration into products.
+    :type producer: Dict
+    :param producer: the producer's configuration, changed in place
+    :type products: Dict
+    :param products: the products by id
+    :returns the configuration
+    """
+    producer['products'] = [(products[i], quantity, sleep_time)
+                            for i, quantity, sleep_time
+                            in producer['products']]
+    return producer
+
+
+def build_cart(cart, products):
+    """
+    Turns the product ids of a cart's operations into products.
+    :type cart: List
+    :param cart: the cart's operations, changed in place
+    :type products: Dict
+    :param products: the products by id
+    :returns the cart
+    """
+    for operation in cart:
+        operation['product'] = products[operation['product']]
+
+    return cart
+
+
+def build_market_config(market_config):
+    """
+    Convert a market configuration with product definitions and ids into one with products, used
+    to build the Producer, Consumer and Marketplace models. The products' definitions are removed.
+    :type market_config: Dict
+    :param market_config: the configuration, changed in place
+    :returns the configuration
+    """
+    # turn product definitions into actual products
+    products = {k: build_product(definition)
+                for k, definition in market_config['products'].items()}
+    del market_config['products']
+
+    # turn product ids into products in producers
+    for producer in market_config['producers']:
+        build_producer(producer, products)
+
+    # turn product ids into products in consumer order lists
+    for consumer in market_config['consumers']:
+        for cart in consumer['carts']:
+            build_cart(cart, products)
+
+    return market_config
+
+
+def load_market_config(filename):
+    """
+    Loads the market configuration of a test's input file.
+    :type filename: String
+    :param filename: the input file
+    :returns the configuration, with products instead of product ids
+    """
+    with open(filename, encoding='utf-8') as input_file:
+        return build_market_config(loads(input_file.read()))
+
+
+class JsonStream:
+    """
+    Class that represents a JSON document read incrementally from a binary file. The containers
+    are walked through with items() and elements(), their values are decoded one by one with
+    value(), so only the value being decoded is held in memory.
+    """
+
+    def __init__(self, input_file, offset=0):
+        """
+        Constructor
+        :type input_file: BinaryIO
+        :param input_file: the file, opened in binary mode
+        :type offset: Int
+        :param offset: the byte offset to start reading at
+        """
+        input_file.seek(offset)
+
+        self.input_file = input_file
+        self.decoder = codecs.getincrementaldecoder('utf-8')()
+        self.json_decoder = JSONDecoder()
+
+        # The text read and not consumed yet, from index on, and the byte offset of its start
+        self.buffer = ''
+        self.index = 0
+        self.offset = offset
+
+    def fill(self):
+        """
+        Reads the next chunk of the file, dropping the consumed text.
+        :returns False if the end of the file was reached
+        """
+        chunk = self.input_file.read(CHUNK_SIZE)
+
+        self.offset += len(self.buffer[:self.index].encode('utf-8'))
+        self.buffer = self.buffer[self.index:] + self.decoder.decode(chunk, final=not chunk)
+        self.index = 0
+
+        return bool(chunk)
+
+    def peek(self):
+        """
+        Skips the whitespace and returns the next character.
+        """
+        while True:
+            while self.index < len(self.buffer) and self.buffer[self.index].isspace():
+                self.index += 1
+
+            if self.index < len(self.buffer):
+                return self.buffer[self.index]
+
+            if not self.fill():
+                raise ValueError(f"unexpected end of the document at byte {self.position()}")
+
+    def expect(self, characters):
+        """
+        Consumes the next character, which must be one of the given ones.
+        :returns the character
+        """
+        character = self.peek()
+        if character not in characters:
+            raise ValueError(f"expected one of {characters!r} at byte {self.position()}, "
+                             f"got {character!r}")
+
+        self.index += 1
+        return character
+
+    def position(self):
+        """
+        Returns the byte offset of the next character to consume.
+        """
+        return self.offset + len(self.buffer[:self.index].encode('utf-8'))
+
+    def value(self):
+        """
+        Decodes the next value.
+        """
+        self.peek()
+
+        while True:
+            try:
+                value, end = self.json_decoder.raw_decode(self.buffer, self.index)
+            except JSONDecodeError:
+                # The value may go on in the next chunk
+                if not self.fill():
+                    raise
+                continue
+
+            # A number ending the buffer may go on in the next chunk too
+            if end == len(self.buffer) and self.fill():
+                continue
+
+            self.index = end
+            return value
+
+    def items(self):
+        """
+        Walks through the next object, yielding its keys. The value of each key must be consumed
+        before moving on to the next one.
+        """
+        self.expect('{')
+        if self.peek() == '}':
+            self.index += 1
+            return
+
+        while True:
+            key = self.value()
+            self.expect(':')
+            yield key
+
+            if self.expect(',}') == '}':
+                return
+
+    def elements(self):
+        """
+        Walks through the next array, yielding once per element. Each element must be consumed
+        before moving on to the next one.
+        """
+        self.expect('[')
+        if self.peek() == ']':
+            self.index += 1
+            return
+
+        while True:
+            yield
+
+            if self.expect(',]') == ']':
+                return
+
+
+class StreamedCarts:
+    """
+    Class that represents the carts of a consumer, read from the input file each time they are
+    iterated, one cart at a time.
+    """
+
+    def __init__(self, filename, offset, products):
+        """
+        Constructor
+        :type filename: String
+        :param filename: the input file
+        :type offset: Int
+        :param offset: the byte offset of the consumer's list of carts
+        :type products: Dict
+        :param products: the products by id
+        """
+        self.filename = filename
+        self.offset = offset
+        self.products = products
+
+    def __iter__(self):
+        with open(self.filename, 'rb') as input_file:
+            stream = JsonStream(input_file, self.offset)
+
+            for _ in stream.elements():
+                yield build_cart(stream.value(), self.products)
+
+
+def stream_market_config(filename):
+    """
+    Loads the market configuration of a test's input file without reading the consumers' carts
+    into memory: each consumer's carts are a StreamedCarts.
+    :type filename: String
+    :param filename: the input file
+    :returns the configuration, with products instead of product ids
+    """
+    market_config = {}
+    products = {}
+
+    with open(filename, 'rb') as input_file:
+        stream = JsonStream(input_file)
+
+        for key in stream.items():
+            if key == 'products':
+                for product_id in stream.items():
+                    products[product_id] = build_product(stream.value())
+            elif key == 'consumers':
+                market_config['consumers'] = list(stream_consumers(stream, filename, products))
+            else:
+                market_config[key] = stream.value()
+
+    # The products may come after the producers in the file
+    for producer in market_config['producers']:
+        build_producer(producer, products)
+
+    return market_config
+
+
+def stream_consumers(stream, filename, products):
+    """
+    Reads the consumers' configurations, skipping their carts.
+    :type stream: JsonStream
+    :param stream: the input file, at the list of consumers
+    :type filename: String
+    :param filename: the input file's name
+    :type products: Dict
+    :param products: the products by id, possibly filled in later
+    :returns a generator of the consumers' configurations
+    """
+    for _ in stream.elements():
+        consumer = {}
+
+        for key in stream.items():
+            if key == 'carts':
+                consumer['carts'] = StreamedCarts(filename, stream.position(), products)
+
+                # Decode the carts one by one, only to get past them
+                for _ in stream.elements():
+                    stream.value()
+            else:
+                consumer[key] = stream.value()
+
+        yield consumer
+
+
+class TestScenario(unittest.TestCase):
+    """
+    Class used for testing the scenario loaders.
+    """
+
+    def test_streamed_like_loaded(self):
+        """
+        Test that a streamed configuration has the same producers and carts as a loaded one, even
+        when the values are split across chunks and the products come last.
+        """
+        scenario = {
+            'producers': [{'name': 'prod1', 'products': [['id1', 2, 0.1]],
+                           'republish_wait_time': 0.2}],
+            'consumers': [{'name': 'cons1', 'retry_wait_time': 0.1,
+                           'carts': [[{'type': 'add', 'product': 'id1', 'quantity': 12345}],
+                                     [{'type': 'remove', 'product': 'id2', 'quantity': 1}]]},
+                          {'name': 'cons2', 'retry_wait_time': 0.3, 'carts': []}],
+            'marketplace': {'queue_size_per_producer': 8},
+            'products': {'id1': {'product_type': 'Tea', 'name': 'Lipton ă', 'type': 'Green',
+                                 'price': 1},
+                         'id2': {'product_type': 'Coffee', 'name': 'Brasil', 'acidity': 5.09,
+                                 'roast_level': 'MEDIUM', 'price': 7}},
+        }
+
+        with tempfile.NamedTemporaryFile('w', encoding='utf-8', suffix='.in',
+                                         delete=False) as input_file:
+            input_file.write(dumps(scenario, indent=4, ensure_ascii=False))
+
+        global CHUNK_SIZE  # pylint: disable=global-statement
+        chunk_size, CHUNK_SIZE = CHUNK_SIZE, 7
+        try:
+            loaded = load_market_config(input_file.name)
+            streamed = stream_market_config(input_file.name)
+
+            self.assertEqual(streamed['marketplace'], loaded['marketplace'])
+            self.assertEqual(streamed['producers'], loaded['producers'])
+            self.assertEqual([consumer['name'] for consumer in streamed['consumers']],
+                             ['cons1', 'cons2'])
+
+            for consumer, loaded_consumer in zip(streamed['consumers'], loaded['consumers']):
+                self.assertIsInstance(consumer['carts'], StreamedCarts)
+                self.assertEqual(list(consumer['carts']), loaded_consumer['carts'])
+                # The carts can be gone through again
+                self.assertEqual(list(consumer['carts']), loaded_consumer['carts'])
+        finally:
+            CHUNK_SIZE = chunk_size
+            os.unlink(input_file.name)
@@ -0,0 +1,113 @@
+"""
+This module offers the slots of the producers' queues, which bound the number of units each
+producer has in the Marketplace.
+
+Computer Systems Architecture Course
+Assignment 1
+March 2021
+"""
+from tema.stats import TimedLock
+
+
+class ProducerSlots:
+    """
+    Class that represents the free slots in a producer's queue. Publishing takes slots and placing
+    an order gives them back. A producer whose queue is full waits without waking up until a slot
+    is freed or the slots are closed, which happens when the marketplace stops.
+    """
+
+    def __init__(self, clock, size, products=None):
+        """
+        Constructor
+        :type clock: RealClock
+        :param clock: the clock the producer waits with
+        :type size: Int
+        :param size: the number of slots in the queue
+        :type products: Iterable
+        :param products: the products the producer makes, None if he didn't tell
+        """
+        self.size = size
+        self.free = size
+        self.closed = False
+        self.products = None if products is None else frozenset(products)
+
+        # The producer waits on the first condition for a free slot, on the second one while
+        # resting between two products, only woken up by closing the slots, and on the third one
+        # until a consumer waits for one of his products
+        self.lock = TimedLock('producer_slots')
+        self.slot_freed = clock.condition(self.lock)
+        self.slots_closed = clock.condition(self.lock)
+        self.products_wanted = clock.condition(self.lock)
+
+    def take(self, quantity, block, timeout):
+        """
+        Takes up to the given number of free slots.
+        :type quantity: Int
+        :param quantity: the number of slots wanted
+        :type block: Bool
+        :param block: wait until at least one slot is free instead of taking none
+        :type timeout: Float
+        :param timeout: the maximum number of seconds to wait for when blocking, None for no limit
+        :returns the number of taken slots, 0 once the slots are closed
+        """
+        with self.lock:
+            if block and quantity > 0:
+                self.slot_freed.wait_for(lambda: self.free or self.closed, timeout)
+
+            if self.closed:
+                return 0
+
+            taken = min(quantity, self.free)
+            self.free -= taken
+
+        return taken
+
+    def release(self, count):
+        """
+        Frees the given number of slots, waking up the producer if he is waiting for one.
+        """
+        with self.lock:
+            if self.free + count > self.size:
+                raise ValueError("Slots released too many times")
+
+            self.free += count
+            self.slot_freed.notify()
+
+    def rest(self, seconds):
+        """
+        Waits for the given number of seconds, unless the slots are closed meanwhile.
+        :returns False if the slots are closed
+        """
+        with self.lock:
+            return not self.slots_closed.wait_for(lambda: self.closed, seconds)
+
+    def wait_for_demand(self, wanted, timeout):
+        """
+        Waits until some of the producer's products are wanted, unless the slots are closed
+        meanwhile.
+        :type wanted: Callable
+        :param wanted: returns True if some of the producer's products are wanted
+        :type timeout: Float
+        :param timeout: the maximum number of seconds to wait for, None for no limit
+        :returns False if the slots are closed
+        """
+        with self.lock:
+            self.products_wanted.wait_for(lambda: self.closed or wanted(), timeout)
+            return not self.closed
+
+    def demand_raised(self):
+        """
+        Wakes up the producer if he is waiting for his products to be wanted.
+        """
+        with self.lock:
+            self.products_wanted.notify()
+
+    def close(self):
+        """
+        Closes the slots for good, waking up the producer.
+        """
+        with self.lock:
+            self.closed = True
+            self.slot_freed.notify_all()
+            self.slots_closed.notify_all()
+            self.products_wanted.notify_all()
@@ -0,0 +1,437 @@
+"""
+This module collects the Marketplace's runtime metrics: the publish and add attempts, the time spent
+waiting for slots, products and locks, the producers' queue occupancy and the time carts take to
+fill.
+
+Each thread counts in its own counters and each lock counts its own times, only updated by its
+holder, so counting takes no lock. The counters are merged when a snapshot is read.
+
+Computer Systems Architecture Course
+Assignment 1
+March 2021
+"""
+import time
+import unittest
+from collections import defaultdict
+from threading import Condition, Event, Lock, Thread, current_thread, local
+
+from tema.logger import LOGGER
+
+
+class TimedLock:
+    """
+    Class that represents a lock counting how long its holders waited for it and held it. Only the
+    holder updates the counts, so they need no synchronization of their own. A condition using it
+    releases it while waiting, so the waits don't count as holding it.
+    """
+
+    def __init__(self, name):
+        """
+        Constructor
+        :type name: String
+        :param name: the name the lock's times are reported under, shared by similar locks
+        """
+        self.name = name
+        self.lock = Lock()
+
+        self.acquisitions = 0
+        self.wait_time = 0.0
+        self.hold_time = 0.0
+        self.acquired_at = 0.0
+
+    def acquire(self, blocking=True, timeout=-1):
+        """
+        Acquires the lock, like Lock.acquire.
+        :returns True if the lock was acquired
+        """
+        # Only read the time once if the lock is free. The lock is released by release()
+        if self.lock.acquire(False):  # pylint: disable=consider-using-with
+            self.acquired_at = time.perf_counter()
+        else:
+            if not blocking:
+                return False
+
+            start = time.perf_counter()
+            if not self.lock.acquire(True, timeout):  # pylint: disable=consider-using-with
+                return False
+
+            self.acquired_at = time.perf_counter()
+            self.wait_time += self.acquired_at - start
+
+        self.acquisitions += 1
+        return True
+
+    def release(self):
+        """
+        Releases the lock.
+        """
+        self.hold_time += time.perf_counter() - self.acquired_at
+        self.lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *args):
+        self.release()
+
+
+class ThreadCounters:
+    """
+    Class that represents the counters of one thread. The records are lists updated in place, so
+    counting an operation costs a single dictionary lookup.
+    """
+
+    def __init__(self):
+        """
+        Constructor
+        """
+        # (producer id, product) -> [attempts, published units, failed attempts, wait time]
+        self.publishes = {}
+
+        # product -> [attempts, added units, attempts that got fewer units, wait time]
+        self.adds = {}
+
+        # The units published by each producer minus the ordered ones (producer id -> units)
+        self.slots = defaultdict(int)
+
+        # [orders, ordered units, total fill time, longest fill time]
+        self.orders = [0, 0, 0.0, 0.0]
+
+        # The number of reserved units given back because their reservation expired
+        self.expired = 0
+
+    @staticmethod
+    def record(records, key):
+        """
+        Returns the record of a key in publishes or adds, creating it the first time.
+        """
+        record = records.get(key)
+        if record is None:
+            record = records[key] = [0, 0, 0, 0.0]
+
+        return record
+
+    def add(self, other):
+        """
+        Adds the counts of another thread's counters to these ones.
+        :type other: ThreadCounters
+        :param other: the counters to add, possibly still updated by their thread
+        """
+        add_records(self.publishes, other.publishes)
+        add_records(self.adds, other.adds)
+
+        for producer_id, units in list(other.slots.items()):
+            self.slots[producer_id] += units
+
+        orders = list(other.orders)
+        self.orders = [self.orders[0] + orders[0], self.orders[1] + orders[1],
+                       self.orders[2] + orders[2], max(self.orders[3], orders[3])]
+        self.expired += other.expired
+
+
+def add_records(total, records):
+    """
+    Adds the [count, ..., time] records of a thread to the total ones.
+    """
+    # Copying the items is a single C call, the owning thread can't add a record meanwhile
+    for key, record in list(records.items()):
+        if key in total:
+            total[key] = [value + other for value, other in zip(total[key], record)]
+        else:
+            total[key] = list(record)
+
+
+class MarketplaceStats:
+    """
+    Class that represents the metrics of a Marketplace, except for the locks' times, which the
+    locks count themselves. Each thread counts in its own ThreadCounters, merged when a snapshot
+    is read.
+    """
+
+    def __init__(self, now=time.perf_counter):
+        """
+        Constructor
+        :type now: Callable
+        :param now: returns the current time the carts' fill times are measured with
+        """
+        self.now = now
+        self.local = local()
+
+        # The counters of the running threads, read by snapshot() (list of (thread, counters)).
+        # Those of the finished threads are added up in retired, so that their number doesn't
+        # grow with every thread that ever used the marketplace
+        self.counters = []
+        self.retired = ThreadCounters()
+        self.counters_lock = Lock()
+
+        # The time each cart started filling at (cart id -> time)
+        self.cart_starts = {}
+
+        self.dumper = None
+
+    def thread_counters(self):
+        """
+        Returns the calling thread's counters, creating them the first time.
+        """
+        try:
+            return self.local.counters
+        except AttributeError:
+            self.local.counters = ThreadCounters()
+
+            with self.counters_lock:
+                self.retire_finished()
+                self.counters.append((current_thread(), self.local.counters))
+
+            return self.local.counters
+
+    def retire_finished(self):
+        """
+        Adds up the counters of the finished threads in the retired ones. Must be called with the
+        counters' lock held.
+        """
+        running = []
+        for thread, counters in self.counters:
+            if thread.is_alive():
+                running.append((thread, counters))
+            else:
+                self.retired.add(counters)
+
+        self.counters = running
+
+    def published(self, producer_id, product, units, wait_time):
+        """
+        Counts a publish attempt.
+        :type producer_id: Int
+        :param producer_id: the producer's id
+        :type product: Product
+        :param product: the product
+        :type units: Int
+        :param units: the number of published units, 0 if the attempt failed
+        :type wait_time: Float
+        :param wait_time: the time spent waiting for a free slot
+        """
+        counters = self.thread_counters()
+        record = counters.record(counters.publishes, (producer_id, product))
+
+        record[0] += 1
+        record[1] += units
+        record[2] += not units
+        record[3] += wait_time
+        counters.slots[producer_id] += units
+
+    def added(self, product, quantity, units, wait_time):
+        """
+        Counts an add attempt.
+        :type product: Product
+        :param product: the product
+        :type quantity: Int
+        :param quantity: the number of units asked for
+        :type units: Int
+        :param units: the number of added units
+        :type wait_time: Float
+        :param wait_time: the time spent waiting for the units
+        """
+        counters = self.thread_counters()
+        record = counters.record(counters.adds, product)
+
+        record[0] += 1
+        record[1] += units
+        record[2] += units < quantity
+        record[3] += wait_time
+
+    def cart_started(self, cart_id):
+        """
+        Records that a cart started filling.
+        """
+        self.cart_starts[cart_id] = self.now()
+
+    def cart_ordered(self, cart_id, producer_ids):
+        """
+        Records that a cart was ordered, freeing the slots of the given producers.
+        """
+        now = self.now()
+        fill_time = now - self.cart_starts.pop(cart_id, now)
+
+        counters = self.thread_counters()
+        for producer_id in producer_ids:
+            counters.slots[producer_id] -= 1
+
+        orders = counters.orders
+        orders[0] += 1
+        orders[1] += len(producer_ids)
+        orders[2] += fill_time
+        orders[3] = max(orders[3], fill_time)
+
+    def cart_abandoned(self, cart_id):
+        """
+        Records that a cart was abandoned.
+        """
+        self.cart_starts.pop(cart_id, None)
+
+    def reservations_expired(self, units):
+        """
+        Counts the units given back because their reservation expired.
+        """
+        self.thread_counters().expired += units
+
+    def snapshot(self, locks=()):
+        """
+        Returns the metrics gathered so far.
+        :type locks: Iterable
+        :param locks: the TimedLocks whose times are reported, added up by name
+        :returns a dict with the publish and add attempts by producer and by product, the producers
+        that published each product, the time spent in each kind of lock, each producer's occupied
+        slots and the carts' fill times
+        """
+        total = ThreadCounters()
+
+        with self.counters_lock:
+            self.retire_finished()
+            total.add(self.retired)
+
+            for _, counters in self.counters:
+                total.add(counters)
+
+        publishes, adds, slots, orders = total.publishes, total.adds, total.slots, total.orders
+
+        by_producer = defaultdict(lambda: {'attempts': 0, 'units': 0, 'failed': 0, 'wait_s': 0.0})
+        by_product = defaultdict(dict)
+        for (producer_id, product), record in publishes.items():
+            for name, value in zip(('attempts', 'units', 'failed', 'wait_s'), record):
+                by_producer[producer_id][name] += value
+                by_product[product]['published_' + name] = \
+                    by_product[product].get('published_' + name, 0) + value
+
+        for product, record in adds.items():
+            by_product[product].update(zip(('added_attempts', 'added_units', 'added_failed',
+                                            'add_wait_s'), record))
+
+        lock_times = defaultdict(lambda: {'acquisitions': 0, 'wait_s': 0.0, 'hold_s': 0.0})
+        for lock in locks:
+            lock_times[lock.name]['acquisitions'] += lock.acquisitions
+            lock_times[lock.name]['wait_s'] += lock.wait_time
+            lock_times[lock.name]['hold_s'] += lock.hold_time
+
+        return {
+            'publish_by_producer': dict(sorted(by_producer.items())),
+            'by_product': dict(by_product),
+            'locks': dict(lock_times),
+            'queue_occupancy': dict(sorted(slots.items())),
+            'carts': {'orders': orders[0],
+                      'ordered_units': orders[1],
+                      'mean_fill_s': orders[2] / orders[0] if orders[0] else 0.0,
+                      'max_fill_s': orders[3],
+                      'expired_units': total.expired},
+        }
+
+    def start_dumping(self, interval, read_stats):
+        """
+        Starts a background thread logging the metrics periodically.
+        :type interval: Float
+        :param interval: the number of seconds between two dumps
+        :type read_stats: Callable
+        :param read_stats: returns the metrics to log
+        """
+        self.dumper = StatsDumper(interval, read_stats)
+        self.dumper.start()
+
+    def stop_dumping(self):
+        """
+        Stops the thread logging the metrics, if it was started.
+        """
+        if self.dumper is not None:
+            self.dumper.stop()
+            self.dumper = None
+
+
+class StatsDumper(Thread):
+    """
+    Class that represents the thread logging the metrics periodically.
+    """
+
+    def __init__(self, interval, read_stats):
+        """
+        Constructor
+        :type interval: Float
+        :param interval: the number of seconds between two dumps
+        :type read_stats: Callable
+        :param read_stats: returns the metrics to log
+        """
+        Thread.__init__(self, name='StatsDumper', daemon=True)
+
+        self.interval = interval
+        self.read_stats = read_stats
+        self.stopped = Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            LOGGER.info("stats %s", self.read_stats())
+
+    def stop(self):
+        """
+        Stops the thread.
+        """
+        self.stopped.set()
+        self.join()
+
+
+class TestMarketplaceStats(unittest.TestCase):
+    """
+    Class used for testing the MarketplaceStats.
+    """
+
+    def setUp(self) -> None:
+        """
+        Sets up the testing environment for the unit tests.
+        """
+        self.stats = MarketplaceStats()
+
+    def test_counters_merged(self):
+        """
+        Test that the counters of several threads are added up.
+        """
+        def publish():
+            for _ in range(100):
+                self.stats.published(0, 'tea', 2, 0.0)
+            self.stats.published(0, 'tea', 0, 1.0)
+
+        threads = [Thread(target=publish) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        snapshot = self.stats.snapshot()
+        self.assertEqual(snapshot['publish_by_producer'],
+                         {0: {'attempts': 404, 'units': 800, 'failed': 4, 'wait_s': 4.0}})
+        self.assertEqual(snapshot['by_product']['tea']['published_units'], 800)
+        self.assertEqual(snapshot['queue_occupancy'], {0: 800})
+
+    def test_lock_times(self):
+        """
+        Test that the time spent waiting on a condition doesn't count as holding the lock.
+        """
+        lock = TimedLock('shard')
+        condition = Condition(lock)
+
+        with lock:
+            condition.wait(0.05)
+
+        times = self.stats.snapshot([lock, TimedLock('shard')])['locks']['shard']
+        self.assertEqual(times['acquisitions'], 2)
+        self.assertLess(times['hold_s'], 0.04)
+
+    def test_cart_fill_time(self):
+        """
+        Test the carts' fill times and the slots freed by the orders.
+        """
+        self.stats.published(0, 'tea', 3, 0.0)
+        self.stats.cart_started(0)
+        time.sleep(0.01)
+        self.stats.cart_ordered(0, [0, 0])
+
+        snapshot = self.stats.snapshot()
+        self.assertEqual((snapshot['carts']['orders'], snapshot['carts']['ordered_units']), (1, 2))
+        self.assertGreaterEqual(snapshot['carts']['max_fill_s'], 0.01)
+        self.assertEqual(snapshot['queue_occupancy'], {0: 1})
@@ -0,0 +1,230 @@
+"""
+This module represents the products available in the Marketplace and the consumers waiting for
+them.
+
+Computer Systems Architecture Course
+Assignment 1
+March 2021
+"""
+import unittest
+from collections import defaultdict, deque
+from threading import Condition, Lock
+
+import tema.product as product_module
+from tema.clock import REAL_CLOCK
+from tema.stats import TimedLock
+
+
+class ProductWaiter:
+    """
+    Class that represents a consumer blocked in add_to_cart until the units of a product he asked
+    for are handed to him.
+    """
+
+    def __init__(self, condition, quantity):
+        """
+        Constructor
+        :type condition: Condition
+        :param condition: a condition using the lock of the shard holding the product
+        :type quantity: Int
+        :param quantity: the number of units the waiter needs
+        """
+        self.condition = condition
+        self.quantity = quantity
+
+        # The producers that supplied the units handed to the waiter so far
+        self.producer_ids = []
+
+    def satisfied(self):
+        """
+        Returns True if the waiter got all the units he needs.
+        """
+        return len(self.producer_ids) == self.quantity
+
+    def hand_over(self, producer_id):
+        """
+        Gives the waiter a unit supplied by the given producer and wakes him up once he has all of
+        them. Must be called with the shard's lock held.
+        :type producer_id: Int
+        :param producer_id: the id of the producer that supplied the unit
+        """
+        self.producer_ids.append(producer_id)
+
+        if self.satisfied():
+            self.condition.notify()
+
+
+class ProductStock:
+    """
+    Class that represents the available units of some products and the consumers waiting for them.
+    It doesn't synchronize anything itself, its users have to.
+    """
+
+    def __init__(self, fair=False):
+        """
+        Constructor
+        :type fair: Bool
+        :param fair: hand the units to the consumers in the order they started waiting
+        """
+        # The available units of each product, stored as the ids of the producers that supplied
+        # them (product id -> list of producer ids), so that checking, reserving and returning a
+        # product doesn't have to scan every published unit and every reservation knows which
+        # producer's slot it occupies. The interned products' ids are cheaper keys than the
+        # products themselves
+        self.available_products = defaultdict(list)
+
+        # Consumers waiting until units of a product are handed to them, the most recent one last
+        # (product id -> deque of waiters). Units go to the most recent waiter so that a consumer
+        # gathers all the units he needs while the others keep waiting, instead of every waiting
+        # consumer holding a part of the stock and none of them being able to finish his cart.
+        # In fair mode they go to the oldest waiter instead, which gathers all of his units just
+        # the same but can't be overtaken by the consumers that came after him.
+        # A waiter has a quantity, the producer_ids handed to him, a satisfied() and a
+        # hand_over(producer_id) method
+        self.product_waiters = defaultdict(deque)
+        self.served_waiter = 0 if fair else -1
+
+        # The units of each product the waiting consumers still need (product id -> units)
+        self.demand = defaultdict(int)
+
+        # The producers to tell when a consumer starts waiting for a product
+        # (product id -> list of objects with a demand_raised() method)
+        self.demand_listeners = defaultdict(list)
+
+    def take(self, product, quantity):
+        """
+        Takes up to the given number of available units of the product.
+        :type product: Product
+        :param product: the product to take
+        :type quantity: Int
+        :param quantity: the number of units to take
+        :returns a list with the ids of the producers that supplied the taken units
+        """
+        available = self.available_products[product.id]
+        count = min(quantity, len(available))
+
+        producer_ids = available[len(available) - count:]
+        del available[len(available) - count:]
+
+        return producer_ids
+
+    def supply(self, product, producer_ids):
+        """
+        Makes units of the product available, handing them directly to the most recent consumer
+        waiting for it if there is one.
+        :type product: Product
+        :param product: the product that became available
+        :type producer_ids: List
+        :param producer_ids: the ids of the producers that supplied the units
+        """
+        waiters = self.product_waiters[product.id]
+
+        for producer_id in producer_ids:
+            if waiters:
+                waiter = waiters[self.served_waiter]
+                waiter.hand_over(producer_id)
+                self.demand[product.id] -= 1
+
+                if waiter.satisfied():
+                    del waiters[self.served_waiter]
+            else:
+                self.available_products[product.id].append(producer_id)
+
+    def add_waiter(self, product, waiter):
+        """
+        Makes a consumer wait for units of the product, telling its producers about the demand.
+        :type product: Product
+        :param product: the product the consumer waits for
+        :type waiter: ProductWaiter
+        :param waiter: the waiting consumer
+        """
+        self.product_waiters[product.id].append(waiter)
+        self.demand[product.id] += waiter.quantity - len(waiter.producer_ids)
+
+        for listener in self.demand_listeners[product.id]:
+            listener.demand_raised()
+
+    def remove_waiter(self, product, waiter):
+        """
+        Stops a consumer from waiting for units of the product, unless he already got them all.
+        :type product: Product
+        :param product: the product the consumer waits for
+        :type waiter: ProductWaiter
+        :param waiter: the waiting consumer
+        """
+        if waiter in self.product_waiters[product.id]:
+            self.product_waiters[product.id].remove(waiter)
+            self.demand[product.id] -= waiter.quantity - len(waiter.producer_ids)
+
+
+class MarketplaceShard(ProductStock):
+    """
+    Class that represents a part of the Marketplace's products, guarded by its own lock so that
+    operations on products from different shards don't wait for each other. Its methods must be
+    called with the shard's lock held.
+    """
+
+    def __init__(self, clock=REAL_CLOCK, fair=False):
+        """
+        Constructor
+        :type clock: RealClock
+        :param clock: the clock the consumers wait with
+        :type fair: Bool
+        :param fair: hand the units to the consumers in the order they started waiting
+        """
+        ProductStock.__init__(self, fair)
+
+        self.lock = TimedLock('shard')
+        self.clock = clock
+
+    def reserve(self, product, quantity, block, timeout):
+        """
+        Takes up to the given number of units of the product.
+        :type product: Product
+        :param product: the product to reserve
+        :type quantity: Int
+        :param quantity: the number of units to reserve
+        :type block: Bool
+        :param block: wait until all the units are handed to the caller instead of taking only the
+        available ones
+        :type timeout: Float
+        :param timeout: the maximum number of seconds to wait for when blocking, None for no limit
+        :returns a list with the ids of the producers that supplied the reserved units
+        """
+        producer_ids = self.take(product, quantity)
+
+        if len(producer_ids) == quantity or not block:
+            return producer_ids
+
+        waiter = ProductWaiter(self.clock.condition(self.lock), quantity - len(producer_ids))
+        self.add_waiter(product, waiter)
+
+        if not waiter.condition.wait_for(waiter.satisfied, timeout):
+            self.remove_waiter(product, waiter)
+
+        return producer_ids + waiter.producer_ids
+
+
+class TestProductStock(unittest.TestCase):
+    """
+    Class used for testing the ProductStock.
+    """
+
+    def test_hand_over_order(self):
+        """
+        Test that the units go to the most recent waiter first, or to the oldest one in fair mode.
+        """
+        mint_tea = product_module.Tea('Mint Tea', 2, 'Herbal')
+        condition = Condition(Lock())
+
+        for fair, expected in ((False, [[1], [0]]), (True, [[0, 1], []])):
+            stock = ProductStock(fair)
+            waiters = [ProductWaiter(condition, 2), ProductWaiter(condition, 1)]
+            for waiter in waiters:
+                stock.add_waiter(mint_tea, waiter)
+
+            with condition:
+                stock.supply(mint_tea, [0, 1])
+
+            self.assertListEqual([waiter.producer_ids for waiter in waiters], expected)
+            self.assertEqual(sum(stock.demand.values()), 1)
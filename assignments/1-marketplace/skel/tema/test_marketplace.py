@@ -0,0 +1,318 @@
+"""
+This module tests the Marketplace along with running producers, consumers and its background
+threads: the end of the producers, the runtime metrics, the expiry of the reservations, the
+watchdog and the production on demand. The tests of the single operations are in
+tema/marketplace.py.
+
+Computer Systems Architecture Course
+Assignment 1
+March 2021
+"""
+import unittest
+from threading import Thread, Timer
+
+import tema.product as product_module
+from tema.clock import VirtualClock
+from tema.marketplace import Marketplace
+from tema.producer import Producer
+
+
+class TestLifecycle(unittest.TestCase):
+    """
+    Class used for testing the release of the Marketplace's carts and the end of its producers.
+    """
+
+    def test_carts_released(self):
+        """
+        Test that placed and abandoned carts release their storage and abandoned units go back to
+        the marketplace.
+        """
+        mint_tea = product_module.Tea('Mint Tea', 2, 'Herbal')
+        marketplace = Marketplace(3)
+        producer = marketplace.register_producer()
+        marketplace.publish_many(producer, mint_tea, 3)
+
+        ordered, abandoned = marketplace.new_cart(), marketplace.new_cart()
+        marketplace.add_to_cart(ordered, mint_tea)
+        marketplace.add_many_to_cart(abandoned, mint_tea, 2)
+
+        self.assertListEqual(marketplace.place_order(ordered), [mint_tea])
+        self.assertEqual(marketplace.abandon_cart(abandoned), 2)
+        self.assertEqual(len(marketplace.carts), 0)
+        self.assertDictEqual(marketplace.inventory(), {mint_tea: 2})
+        self.assertRaises(KeyError, marketplace.place_order, 2)
+
+    def test_producers_end(self):
+        """
+        Test that stopping wakes up a producer waiting for a free slot and one resting between two
+        products, and that the published units can still be bought.
+        """
+        marketplace = Marketplace(1)
+        mint_tea = product_module.Tea('Mint Tea', 2, 'Herbal')
+        producers = [Producer([(mint_tea, 2, 0)], marketplace, 0.1),
+                     Producer([(mint_tea, 1, 3600)], marketplace, 0.1)]
+
+        for producer in producers:
+            producer.start()
+
+        cart = marketplace.new_cart()
+        self.assertEqual(marketplace.add_many_to_cart(cart, mint_tea, 2, block=True, timeout=5), 2)
+
+        marketplace.stop()
+        for producer in producers:
+            producer.join(5)
+            self.assertFalse(producer.is_alive())
+
+        self.assertEqual(marketplace.publish(producers[0].producer_id, mint_tea), False)
+        self.assertListEqual(marketplace.place_order(cart), [mint_tea, mint_tea])
+
+
+class TestStats(unittest.TestCase):
+    """
+    Class used for testing the Marketplace's runtime metrics.
+    """
+
+    def test_place_order_stats(self):
+        """
+        Test the runtime metrics after placing an order.
+        """
+        raspberry_tea = product_module.Tea('Raspberry Tea', 1, 'Fruit')
+        marketplace = Marketplace(3)
+        producer = marketplace.register_producer()
+        cart = marketplace.new_cart()
+
+        marketplace.publish(producer, raspberry_tea)
+        marketplace.publish(producer, product_module.Tea('Mint Tea', 2, 'Herbal'))
+        marketplace.add_to_cart(cart, raspberry_tea)
+        marketplace.place_order(cart)
+
+        # The order freed the slot of the bought product, the other one is still published
+        stats = marketplace.stats()
+        self.assertEqual(stats['queue_occupancy'], {producer: 1})
+        self.assertEqual(stats['publish_by_producer'][producer]['units'], 2)
+        self.assertEqual(stats['by_product'][raspberry_tea],
+                         {'published_attempts': 1, 'published_units': 1, 'published_failed': 0,
+                          'published_wait_s': 0.0, 'added_attempts': 1, 'added_units': 1,
+                          'added_failed': 0, 'add_wait_s': 0.0})
+        self.assertEqual(stats['carts']['orders'], 1)
+        self.assertEqual(stats['locks']['shard']['acquisitions'], 3)
+
+        # Two publishes took a slot each, the order gave one back
+        self.assertEqual(stats['locks']['producer_slots']['acquisitions'], 3)
+
+    def test_stop_stats_dumping(self):
+        """
+        Test that stopping the marketplace stops the thread logging its metrics.
+        """
+        marketplace = Marketplace(3, stats_interval=60)
+        dumper = marketplace.metrics.dumper
+        self.assertTrue(dumper.is_alive())
+
+        marketplace.stop()
+        self.assertFalse(dumper.is_alive())
+
+
+class TestReservationExpiry(unittest.TestCase):
+    """
+    Class used for testing the expiry of the carts' reservations.
+    """
+
+    def test_hoarded_units_freed(self):
+        """
+        Test that units held by a cart go to another one once they expire, and are added back to
+        the first cart when its order is placed.
+        """
+        mint_tea = product_module.Tea('Mint Tea', 2, 'Herbal')
+        marketplace = Marketplace(2, reservation_ttl=0.1)
+        producer = marketplace.register_producer()
+        marketplace.publish_many(producer, mint_tea, 2)
+
+        hoarder, buyer = marketplace.new_cart(), marketplace.new_cart()
+        marketplace.add_many_to_cart(hoarder, mint_tea, 2)
+
+        self.assertEqual(marketplace.add_to_cart(buyer, mint_tea, block=True, timeout=5), True)
+        self.assertListEqual(marketplace.place_order(buyer), [mint_tea])
+
+        marketplace.publish(producer, mint_tea)
+        self.assertListEqual(marketplace.place_order(hoarder), [mint_tea, mint_tea])
+        self.assertEqual(marketplace.stats()['carts']['expired_units'], 2)
+
+        marketplace.stop()
+        self.assertFalse(marketplace.carts.expiry.is_alive())
+
+    def test_order_fails_cleanly(self):
+        """
+        Test that an order whose expired units can't be added again fails after its timeout, or
+        once the marketplace stops, giving back the units it got again.
+        """
+        mint_tea = product_module.Tea('Mint Tea', 2, 'Herbal')
+        lime_tea = product_module.Tea('Lime Tea', 5, 'Fruit')
+        marketplace = Marketplace(3, reservation_ttl=0.05)
+        producer = marketplace.register_producer()
+        marketplace.publish(producer, mint_tea)
+        marketplace.publish_many(producer, lime_tea, 2)
+
+        hoarders = [marketplace.new_cart(), marketplace.new_cart()]
+        marketplace.add_to_cart(hoarders[0], lime_tea)
+        marketplace.add_to_cart(hoarders[1], lime_tea)
+        marketplace.add_to_cart(hoarders[0], mint_tea)
+
+        # Another consumer buys the mint tea once it expires, the lime teas are back too
+        buyer = marketplace.new_cart()
+        self.assertEqual(marketplace.add_to_cart(buyer, mint_tea, block=True, timeout=5), True)
+        self.assertListEqual(marketplace.place_order(buyer), [mint_tea])
+
+        self.assertIsNone(marketplace.place_order(hoarders[0], timeout=0.2))
+        self.assertDictEqual(marketplace.inventory(), {lime_tea: 2})
+
+        # The second cart only misses a lime tea, it waits for good once they are bought
+        buyer = marketplace.new_cart()
+        marketplace.add_many_to_cart(buyer, lime_tea, 2)
+        self.assertListEqual(marketplace.place_order(buyer), [lime_tea, lime_tea])
+
+        Timer(0.2, marketplace.stop).start()
+        self.assertIsNone(marketplace.place_order(hoarders[1]))
+        self.assertRaises(KeyError, marketplace.place_order, hoarders[1])
+
+
+class TestWatchdog(unittest.TestCase):
+    """
+    Class used for testing the detection of a stalled Marketplace.
+    """
+
+    def test_stall_reported(self):
+        """
+        Test that a consumer waiting for a product whose only producer has a full queue is
+        reported, and a slow producer isn't.
+        """
+        mint_tea = product_module.Tea('Mint Tea', 2, 'Herbal')
+        lime_tea = product_module.Tea('Lime Tea', 5, 'Fruit')
+
+        reports = []
+        marketplace = Marketplace(1, stall_window=0.2, on_stall=reports.append)
+        producer = marketplace.register_producer()
+
+        marketplace.publish(producer, lime_tea)
+        cart = marketplace.new_cart()
+        self.assertEqual(marketplace.add_to_cart(cart, lime_tea, block=True, timeout=0.5), True)
+
+        # The queue is full, the mint tea can't be published until the lime tea is ordered
+        marketplace.publish(producer, mint_tea)
+        self.assertEqual(marketplace.add_to_cart(cart, mint_tea, block=True, timeout=0.1), False)
+        marketplace.add_to_cart(cart, mint_tea, block=True, timeout=1)
+
+        marketplace.watchdog.join(1)
+        self.assertEqual(len(reports), 1)
+        self.assertDictEqual(reports[0]['demand'], {mint_tea: 1})
+        self.assertListEqual(reports[0]['blocked'], [mint_tea])
+        self.assertEqual(reports[0]['free_slots'], {producer: 0})
+
+    def test_declared_supplier(self):
+        """
+        Test that a product whose previous supplier has a full queue isn't reported while another
+        producer that declared it, and hasn't published it yet, has free slots.
+        """
+        mint_tea = product_module.Tea('Mint Tea', 2, 'Herbal')
+        lime_tea = product_module.Tea('Lime Tea', 5, 'Fruit')
+
+        reports = []
+        marketplace = Marketplace(1, stall_window=0.2, on_stall=reports.append)
+        supplier = marketplace.register_producer([mint_tea, lime_tea])
+        marketplace.register_producer([mint_tea])
+
+        # The first producer sold a mint tea, then filled his queue with a lime tea
+        marketplace.publish(supplier, mint_tea)
+        cart = marketplace.new_cart()
+        marketplace.add_to_cart(cart, mint_tea)
+        marketplace.place_order(cart)
+        marketplace.publish(supplier, lime_tea)
+
+        cart = marketplace.new_cart()
+        self.assertEqual(marketplace.add_to_cart(cart, mint_tea, block=True, timeout=0.5), False)
+        self.assertEqual(reports, [])
+
+        marketplace.stop()
+
+    def test_virtual_deadlock(self):
+        """
+        Test that a deadlock is reported at once on a virtual clock.
+        """
+        clock = VirtualClock()
+        mint_tea = product_module.Tea('Mint Tea', 2, 'Herbal')
+        lime_tea = product_module.Tea('Lime Tea', 5, 'Fruit')
+
+        reports = []
+        marketplace = Marketplace(1, clock=clock, stall_window=3600, on_stall=reports.append)
+        producer = Producer([(lime_tea, 1, 0), (mint_tea, 1, 0)], marketplace, 0.1, clock=clock)
+        producer.start()
+
+        def buy():
+            try:
+                marketplace.add_to_cart(marketplace.new_cart(), mint_tea, block=True)
+            finally:
+                clock.unregister()
+
+        clock.register()
+        consumer = Thread(target=buy)
+        consumer.start()
+
+        marketplace.watchdog.join(5)
+        self.assertEqual(len(reports), 1)
+        self.assertListEqual(reports[0]['blocked'], [mint_tea])
+
+        # Buying the lime tea frees the slot the mint tea is waiting for
+        cart = marketplace.new_cart()
+        marketplace.add_to_cart(cart, lime_tea)
+        marketplace.place_order(cart)
+        consumer.join(5)
+        self.assertFalse(consumer.is_alive())
+
+        marketplace.stop()
+        producer.join(5)
+        self.assertFalse(producer.is_alive())
+
+
+class TestDemand(unittest.TestCase):
+    """
+    Class used for testing the demand-driven production.
+    """
+
+    def test_only_wanted_produced(self):
+        """
+        Test that a producer on demand only publishes the units the waiting consumers need.
+        """
+        marketplace = Marketplace(5)
+        mint_tea = product_module.Tea('Mint Tea', 2, 'Herbal')
+        lime_tea = product_module.Tea('Lime Tea', 5, 'Fruit')
+        producer = Producer([(mint_tea, 3, 0), (lime_tea, 3, 0)], marketplace, 0.1,
+                            on_demand=True)
+        producer.start()
+
+        cart = marketplace.new_cart()
+        self.assertEqual(marketplace.add_many_to_cart(cart, lime_tea, 2, block=True, timeout=5),
+                         2)
+        self.assertEqual(marketplace.demand(lime_tea), 0)
+
+        marketplace.stop()
+        producer.join(5)
+
+        self.assertFalse(producer.is_alive())
+        self.assertDictEqual(marketplace.inventory(), {})
+
+    def test_stale_demand_skipped(self):
+        """
+        Test that a producer on demand neither publishes nor rests when the demand is met by the
+        time he reads it.
+        """
+        marketplace = Marketplace(5)
+        mint_tea = product_module.Tea('Mint Tea', 2, 'Herbal')
+
+        # The demand is reported once, then the marketplace stops
+        answers = [mint_tea, None]
+        marketplace.wait_for_demand = lambda producer_id, products, timeout=None: answers.pop(0)
+        producer = Producer([(mint_tea, 3, 0)], marketplace, 0.01, on_demand=True)
+
+        producer.run()
+
+        self.assertEqual(answers, [])
+        self.assertDictEqual(marketplace.stats()['publish_by_producer'], {})
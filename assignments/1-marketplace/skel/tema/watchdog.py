@@ -0,0 +1,159 @@
+"""
+This module watches the progress of a Marketplace: the published and added units and the placed
+orders. When the consumers wait for products that none of the producers able to make them has a
+free slot for, and nothing has progressed for a while, the market can't progress anymore. The
+watchdog then hands a diagnostic snapshot to a callback, by default one that aborts the process,
+instead of letting the run hang until an outer timeout.
+
+Computer Systems Architecture Course
+Assignment 1
+March 2021
+"""
+import os
+import sys
+from collections import defaultdict
+from functools import partial
+from pprint import pformat
+from threading import Event, Thread, current_thread
+
+from tema.clock import VirtualClock
+from tema.logger import LOGGER, shutdown_logging
+from tema.product import Product
+
+# The exit status of a process aborted by the watchdog
+STALLED_EXIT_CODE = 3
+
+# The number of times the progress is checked during a window, and the most real seconds between
+# two checks, for windows measured on a virtual clock
+CHECKS_PER_WINDOW = 4
+MAX_CHECK_INTERVAL = 0.1
+
+
+def progress_report(marketplace):
+    """
+    Returns the progress of a marketplace and what its waiting consumers need.
+    :type marketplace: Marketplace
+    :param marketplace: the marketplace
+    :returns a dict with the number of published units, added units and orders, the units of each
+    product the waiting consumers need, the producers that make each needed product, the free slots
+    of each producer, the needed products none of their producers can publish and whether the
+    market is stuck, that is needs products and can't publish any of them
+    """
+    snapshot = marketplace.metrics.snapshot()
+
+    with marketplace.locked_shards():
+        demand = {Product.from_id(product_id): units
+                  for shard in marketplace.shards
+                  for product_id, units in shard.demand.items() if units}
+
+    # The producers that make each needed product, as they declared when registering. One that
+    # didn't declare his products may make any of them
+    suppliers = defaultdict(list)
+    with marketplace.producer_lock:
+        free_slots = {}
+        for producer_id, slots in enumerate(marketplace.producers):
+            free_slots[producer_id] = 0 if slots.closed else slots.free
+
+            for product in demand:
+                if slots.products is None or product in slots.products:
+                    suppliers[product].append(producer_id)
+
+    blocked = [product for product in demand
+               if not any(free_slots[producer_id] for producer_id in suppliers[product])]
+
+    return {
+        'published': sum(record['units'] for record in snapshot['publish_by_producer'].values()),
+        'added': sum(record.get('added_units', 0) for record in snapshot['by_product'].values()),
+        'orders': snapshot['carts']['orders'],
+        'open_carts': len(marketplace.carts),
+        'demand': demand,
+        'suppliers': dict(suppliers),
+        'free_slots': free_slots,
+        'blocked': blocked,
+        'stuck': bool(demand) and len(blocked) == len(demand),
+    }
+
+
+def abort_stalled(report, order_sink=None):
+    """
+    Writes the diagnostic snapshot of a stalled marketplace to the standard error and ends the
+    process at once, the waiting threads would never end. Ending this way skips the exit handlers,
+    so the queued log records and the buffered orders are written first.
+    :type report: Dict
+    :param report: the snapshot, as returned by progress_report
+    :type order_sink: OrderSink
+    :param order_sink: the marketplace's order sink, None if it has nothing buffered
+    """
+    LOGGER.critical("marketplace stalled %s", report)
+    shutdown_logging()
+
+    sys.stderr.write("marketplace stalled, no progress is possible:\n"
+                     + pformat(report) + "\n")
+    sys.stderr.flush()
+
+    if order_sink is not None:
+        order_sink.close()
+    sys.stdout.flush()
+
+    os._exit(STALLED_EXIT_CODE)  # pylint: disable=protected-access
+
+
+class ProgressWatchdog(Thread):
+    """
+    Class that represents the thread watching the progress of a marketplace.
+    """
+
+    def __init__(self, marketplace, window, on_stall=None):
+        """
+        Constructor
+        :type marketplace: Marketplace
+        :param marketplace: the watched marketplace
+        :type window: Float
+        :param window: the number of seconds, on the marketplace's clock, the market may be stuck
+        without progressing before it is reported
+        :type on_stall: Callable
+        :param on_stall: called with the diagnostic snapshot when the market stalls, None for
+        aborting the process
+        """
+        Thread.__init__(self, name='ProgressWatchdog', daemon=True)
+
+        self.marketplace = marketplace
+        self.window = window
+        self.on_stall = on_stall or partial(abort_stalled, order_sink=marketplace.order_sink)
+        self.stopped = Event()
+
+    def run(self):
+        clock = self.marketplace.clock
+        last_progress = None
+        last_progress_time = clock.time()
+        interval = min(self.window / CHECKS_PER_WINDOW, MAX_CHECK_INTERVAL)
+
+        # Checked in real time, the marketplace's clock may be a virtual one that doesn't move
+        # while the market is deadlocked
+        while not self.stopped.wait(interval):
+            # A stalled virtual clock means every thread waits for good, no need to wait more. It
+            # is checked first, the report then shows what the threads are waiting for
+            stalled = isinstance(clock, VirtualClock) and clock.stalled()
+
+            report = progress_report(self.marketplace)
+            progress = (report['published'], report['added'], report['orders'])
+
+            if progress != last_progress or not report['stuck']:
+                last_progress = progress
+                last_progress_time = clock.time()
+                continue
+
+            report['idle_s'] = clock.time() - last_progress_time
+            if stalled or report['idle_s'] >= self.window:
+                self.on_stall(report)
+                return
+
+    def stop(self):
+        """
+        Stops the thread.
+        """
+        self.stopped.set()
+
+        # The callback may stop the marketplace, and the watchdog with it
+        if self.is_alive() and current_thread() is not self:
+            self.join()
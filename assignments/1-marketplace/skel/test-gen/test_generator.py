@@ -11,10 +11,17 @@ Script input
     - max number of carts per consumer
     - is basic test
     - should have removal operations
+
+With --stream, the input and reference output files are written in one pass, without the JSON
+file. The consumers are generated in chunks, by --jobs processes, each chunk with a random
+generator seeded from --seed and its index, so a test only depends on the seed and the chunk
+size. The reference output isn't sorted, the outputs are compared whatever their order.
 """
 import argparse
 import random
+from functools import partial
 from json import loads, dumps
+from multiprocessing import Pool
 
 from tema.product import *  # pylint: disable=wildcard-import, unused-wildcard-import
 from test_utils import *  # pylint: disable=wildcard-import, unused-wildcard-import
@@ -26,13 +33,13 @@ def generate_test():
 
     :return: nothing
     """
-    random.seed(0)
-
     cmdline_arguments = parse_input()
     if not sanitize_inputs(cmdline_arguments):
         print("Invalid arguments")
     print(cmdline_arguments)
 
+    random.seed(cmdline_arguments[ARG_SEED])
+
     products = generate_products(cmdline_arguments[ARG_PRODUCTS])
     producers = generate_producers(cmdline_arguments[ARG_PRODUCERS],
                                    products, cmdline_arguments[ARG_IS_BASIC])
@@ -43,6 +50,18 @@ def generate_test():
         if not products[prod_id]["is_produced"]:
             del products[prod_id]
 
+    if cmdline_arguments[ARG_STREAM]:
+        for prod_id in products.keys():
+            del products[prod_id]["is_produced"]
+
+        test_name = cmdline_arguments[ARG_TEST_NAME]
+        with open(f'{TESTS_DIR}/{test_name}.in', 'w') as input_file, \
+                open(f'{TESTS_DIR}/{test_name}.ref.out', 'w') as output_file:
+            generate_stream_test(cmdline_arguments, products, producers,
+                                 generate_marketplace(cmdline_arguments[ARG_MARKETPLACE_Q]),
+                                 input_file=input_file, output_file=output_file)
+        return
+
     consumers = generate_consumers(cmdline_arguments[ARG_CONSUMERS],
                                    products,
                                    cmdline_arguments[ARG_MIN_CARTS],
@@ -93,6 +112,15 @@ def parse_input():
                         help="True if it is a simple test, False otherwise")
     parser.add_argument(ARG_SUPPORTS_REMOVAL, type=bool, nargs='?', default=True,
                         help="True if the consumer can remove products from cart, False otherwise")
+    parser.add_argument("--seed", dest=ARG_SEED, type=int, default=DEFAULT_SEED,
+                        help="seed of the random generator")
+    parser.add_argument("--stream", dest=ARG_STREAM, action="store_true",
+                        help="write the input and reference output files in one pass, "
+                             "generating the consumers in chunks")
+    parser.add_argument("--jobs", dest=ARG_JOBS, type=int, default=DEFAULT_JOBS,
+                        help="number of processes generating the consumers' chunks with --stream")
+    parser.add_argument("--chunk-size", dest=ARG_CHUNK_SIZE, type=int, default=DEFAULT_CHUNK_SIZE,
+                        help="number of consumers in a chunk with --stream")
 
     return parser.parse_args().__dict__
 
@@ -109,7 +137,9 @@ def sanitize_inputs(arguments):
             and arguments[ARG_MARKETPLACE_Q] > 0 \
             and arguments[ARG_MIN_CARTS] > 0 \
             and arguments[ARG_MAX_CARTS] > 0 \
-            and arguments[ARG_MAX_CARTS] >= arguments[ARG_MIN_CARTS]:
+            and arguments[ARG_MAX_CARTS] >= arguments[ARG_MIN_CARTS] \
+            and arguments[ARG_JOBS] > 0 \
+            and arguments[ARG_CHUNK_SIZE] > 0:
         return True
 
     return False
@@ -204,7 +234,7 @@ def generate_producers(count, products, basic_test):
         producer = {"name": PRODUCER_NAME_PREFIX + str(i + 1)}
 
         num_products_per_producer = random.randint(1, len(products.keys()))
-        products_to_produce = random.sample(products.keys(), num_products_per_producer)
+        products_to_produce = random.sample(list(products.keys()), num_products_per_producer)
 
         products_list = [[x, random.randint(1, max_quantity), round(random.uniform(0.05, 0.4), 2)]
                          for x in products_to_produce]
@@ -256,11 +286,10 @@ def generate_consumers(count, products, min_cart, max_cart,
         for _ in range(num_carts):
             num_operations = random.randint(1, max_operations_per_cart)
 
-            print(products.keys(), " ", num_operations)
             if len(products) < num_operations:
                 num_operations = len(products)
 
-            product_ids = random.sample(products.keys(), num_operations)
+            product_ids = random.sample(list(products.keys()), num_operations)
             operations = [{"type": ADD_TO_CART_OP, "product": x,
                            "quantity": random.randint(1, max_quantity)} for x in product_ids]
 
@@ -313,10 +342,7 @@ def generate_in_out_test_files(test_name):
         conf = loads(json_file.read())
 
     # turn product definitions into actual products
-    products = {}
-    for k, prod_dict in conf['products'].items():
-        params = {k: v for k, v in prod_dict.items() if k != 'product_type'}
-        products[k] = globals()[prod_dict['product_type']](**params)
+    products = build_products(conf['products'])
 
     # turn product ids into products in consumer order lists and expected carts
     for consumer in conf['consumers']:
@@ -327,7 +353,6 @@ def generate_in_out_test_files(test_name):
 
     lines = []
     for consumer in conf['consumers']:
-        print("consumer" + str(consumer))
         for cart in consumer['carts']:
             for product, count in cart['expected_cart'].items():
                 lines += ([f'{consumer["name"]} bought {product}'] * count)
@@ -345,5 +370,91 @@ def generate_in_out_test_files(test_name):
         print(dumps(conf, indent=4), file=input_file)
 
 
+def build_products(products):
+    """
+    Turns product definitions into actual products
+    :param products: the product definitions, by id
+    :return: a dictionary of products, by id
+    """
+    built_products = {}
+    for k, prod_dict in products.items():
+        params = {k: v for k, v in prod_dict.items() if k != 'product_type'}
+        built_products[k] = globals()[prod_dict['product_type']](**params)
+
+    return built_products
+
+
+def generate_consumer_chunk(chunk, products, arguments):
+    """
+    Generates a chunk of consumers with a random generator of its own, so that the chunk is the
+    same whichever process generates it
+    :param chunk: the chunk's index, its first consumer's index and its number of consumers
+    :param products: all the products that can be bought
+    :param arguments: the command line arguments
+    :return: the consumers' part of the input file and their lines of the reference output
+    """
+    index, first, count = chunk
+    random.seed(f"{arguments[ARG_SEED]}:{index}")
+
+    consumers = generate_consumers(count, products,
+                                   arguments[ARG_MIN_CARTS],
+                                   arguments[ARG_MAX_CARTS],
+                                   has_remove_operation=arguments[ARG_SUPPORTS_REMOVAL],
+                                   basic_test=arguments[ARG_IS_BASIC])
+    built_products = build_products(products)
+
+    consumer_lines = []
+    ref_lines = []
+    for i, consumer in enumerate(consumers):
+        consumer["name"] = CONSUMER_NAME_PREFIX + str(first + i + 1)
+
+        for cart in consumer['carts']:
+            for product_id, quantity in cart['expected_cart'].items():
+                ref_lines.append(f'{consumer["name"]} bought {built_products[product_id]}\n'
+                                 * quantity)
+
+        consumer['carts'] = [cart['ops'] for cart in consumer['carts']]
+        consumer_lines.append(' ' * 8 + dumps(consumer))
+
+    return ',\n'.join(consumer_lines), ''.join(ref_lines)
+
+
+def generate_stream_test(arguments, products, producers, marketplace, *, input_file,
+                         output_file):
+    """
+    Writes the input and reference output of a test in one pass, one chunk of consumers at a
+    time, the consumers last
+    :param arguments: the command line arguments
+    :param products: all the products that can be bought
+    :param producers: the producers
+    :param marketplace: the marketplace
+    :param input_file: the stream the input is written to
+    :param output_file: the stream the reference output is written to
+    :return: nothing
+    """
+    num_consumers = arguments[ARG_CONSUMERS]
+    chunk_size = arguments[ARG_CHUNK_SIZE]
+
+    chunks = [(index, first, min(chunk_size, num_consumers - first))
+              for index, first in enumerate(range(0, num_consumers, chunk_size))]
+    generate_chunk = partial(generate_consumer_chunk, products=products, arguments=arguments)
+
+    header = dumps({ARG_PRODUCTS: products, ARG_PRODUCERS: producers,
+                    "marketplace": marketplace}, indent=4)
+
+    with Pool(arguments[ARG_JOBS]) as pool:
+        # leave the object open, the consumers come last
+        input_file.write(header[:-len('\n}')] + f',\n    "{ARG_CONSUMERS}": [\n')
+
+        # the chunks are written in order, as soon as they are generated
+        for index, (consumer_lines, ref_lines) in enumerate(pool.imap(generate_chunk, chunks)):
+            if index:
+                input_file.write(',\n')
+            input_file.write(consumer_lines)
+            output_file.write(ref_lines)
+
+        input_file.write('\n    ]\n}\n')
+
+
 if __name__ == "__main__":
     generate_test()
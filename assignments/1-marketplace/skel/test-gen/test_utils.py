@@ -41,6 +41,9 @@ DEFAULT_NUM_PRODUCTS = 7
 DEFAULT_MARKETPLACE_QUEUE_SIZE = 8
 DEFAULT_MIN_NUMBER_CARTS_PER_CONSUMER = 1
 DEFAULT_MAX_NUMBER_CARTS_PER_CONSUMER = 3
+DEFAULT_SEED = 0
+DEFAULT_JOBS = 1
+DEFAULT_CHUNK_SIZE = 1000
 
 # Input arguments names for the test_generator script
 ARG_TEST_NAME = "test_name"
@@ -52,3 +55,7 @@ ARG_MAX_CARTS = "max_carts"
 ARG_MARKETPLACE_Q = "marketplace_q"
 ARG_IS_BASIC = "is_basic"
 ARG_SUPPORTS_REMOVAL = "supports_removal"
+ARG_SEED = "seed"
+ARG_STREAM = "stream"
+ARG_JOBS = "jobs"
+ARG_CHUNK_SIZE = "chunk_size"
@@ -6,68 +6,113 @@ Assignment 1
 March 2020
 """
 
+import argparse
+import asyncio
 import sys
-from json import loads
 
 from tema.producer import Producer
 from tema.consumer import Consumer
+from tema import process_marketplace
+from tema.async_marketplace import run_market
+from tema.clock import REAL_CLOCK, VirtualClock
 from tema.marketplace import Marketplace
-from tema.product import Product, Coffee, Tea
+from tema.order_sink import BufferedOrderSink
+from tema.scenario import stream_market_config
 
 
 def main():
     """
-        Convert the market_configuration input file into specific models:
-        Producer, Consumer, Marketplace
+        Run the market described by the input file
     """
-    try:
-        filename = sys.argv[1]
-    except IndexError:
-        print("no input file specified")
-        raise SystemExit
-
-    with open(filename) as input_file:
-        market_config = loads(input_file.read())
-
-    # turn product definitions into actual products
-    products = {}
-
-    for k, products_dict in market_config['products'].items():
-        params = {k: products_dict[k] for k in products_dict.keys() if k != 'product_type'}
-        products[k] = globals()[products_dict['product_type']](**params)
-    del market_config['products']
-
-    # turn product ids into products in producers
-    for producer in market_config['producers']:
-        producer['products'] = [(products[i], quantity, sleep_time)
-                                for i, quantity, sleep_time
-                                in producer['products']]
-
-    # turn product ids into products in consumer order lists and expected carts
-    for consumer in market_config['consumers']:
-        for cart in consumer['carts']:
-            for operation in cart:
-                operation['product'] = products[operation['product']]
+    parser = argparse.ArgumentParser()
+    parser.add_argument("filename", help="the test's input file")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("--async", dest="use_async", action="store_true",
+                      help="run the producers and consumers as coroutines on one event loop")
+    mode.add_argument("--processes", type=int, default=0, metavar="N",
+                      help="split the producers among N shard processes and the consumers "
+                           "among N consumer processes")
+    mode.add_argument("--virtual-time", action="store_true",
+                      help="run the threads in simulated time, skipping the waits")
+    parser.add_argument("--on-demand", action="store_true",
+                        help="only produce the products the waiting consumers need")
+    parser.add_argument("--fair", action="store_true",
+                        help="serve the consumers waiting for a product in arrival order")
+    parser.add_argument("--stats-interval", type=float, metavar="SECONDS",
+                        help="log the marketplace's runtime metrics every SECONDS seconds")
+    parser.add_argument("--stall-window", type=float, metavar="SECONDS",
+                        help="abort once the consumers wait for products no producer can publish "
+                             "and nothing progressed for SECONDS seconds")
+    parser.add_argument("--reservation-ttl", type=float, metavar="SECONDS",
+                        help="give back the units a cart holds for longer than SECONDS, they are "
+                             "added again when its order is placed")
+    args = parser.parse_args()
+
+    if args.on_demand and args.use_async:
+        parser.error("--on-demand is not supported with --async")
+    # only the threaded marketplace supports these options
+    threads_only = [option for option, value in (("--fair", args.fair),
+                                                 ("--stats-interval", args.stats_interval),
+                                                 ("--stall-window", args.stall_window),
+                                                 ("--reservation-ttl", args.reservation_ttl))
+                    if value not in (None, False)]
+    if threads_only and (args.use_async or args.processes):
+        parser.error(f"{threads_only[0]} is only supported with threads")
+
+    # the consumers' carts are read from the file as the consumers go through them
+    market_config = stream_market_config(args.filename)
+
+    if args.on_demand:
+        for p_market_config in market_config['producers']:
+            p_market_config['on_demand'] = True
+
+    # the orders are written to stdout by a background thread
+    order_sink = BufferedOrderSink(sys.stdout)
+
+    if args.use_async:
+        asyncio.run(run_market(market_config, order_sink))
+        order_sink.close()
+        return
+
+    if args.processes > 0:
+        process_marketplace.run_market(market_config, args.processes, order_sink)
+        order_sink.close()
+        return
+
+    # the producers, consumers and marketplace wait with the same clock
+    clock = VirtualClock() if args.virtual_time else REAL_CLOCK
 
     # build the marketplace
-    marketplace = Marketplace(**market_config['marketplace'])
-
-    # build and start the producers
-    producers = [Producer(**p_market_config, marketplace=marketplace, daemon=True)
+    marketplace = Marketplace(**market_config['marketplace'], order_sink=order_sink, clock=clock,
+                              stats_interval=args.stats_interval, fair=args.fair,
+                              stall_window=args.stall_window,
+                              reservation_ttl=args.reservation_ttl)
+
+    # build the producers and the consumers, the consumers don't keep the process alive if the run
+    # is interrupted
+    producers = [Producer(**p_market_config, marketplace=marketplace, clock=clock)
                  for p_market_config in market_config['producers']]
+    consumers = [Consumer(**c_market_config, marketplace=marketplace, clock=clock, daemon=True)
+                 for c_market_config in market_config['consumers']]
 
     for producer in producers:
         producer.start()
 
-    # build and start the consumers
-    consumers = [Consumer(**c_market_config, marketplace=marketplace)
-                 for c_market_config in market_config['consumers']]
+    try:
+        for consumer in consumers:
+            consumer.start()
+
+        for consumer in consumers:
+            consumer.join()
+    finally:
+        # the producers end once the marketplace stops, even if the run was interrupted
+        marketplace.stop()
 
-    for consumer in consumers:
-        consumer.start()
+        for producer in producers:
+            producer.join()
 
-    for consumer in consumers:
-        consumer.join()
+        # write the orders that are still buffered
+        order_sink.close()
 
 
 if __name__ == '__main__':